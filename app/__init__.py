@@ -2,16 +2,47 @@ from flask import Flask
 from flask_cors import CORS
 
 from .routes import api
-from .commands import create_tables, drop_and_create_tables, init_data
-from .extensions import db
+from .commands import (
+    create_tables,
+    drop_and_create_tables,
+    init_data,
+    seed_synthetic,
+    check_query_plans_command,
+    score_leads_command,
+    rebuild_funnel_stats_command,
+    prune_tombstones_command,
+    check_query_budgets_command,
+    benchmark_command,
+)
+from .extensions import db, migrate
+from .cache import response_cache
+from .metrics import app_metrics
+from .json_backend import json_backend
+from .compression import compression
 
-def create_app(config_file='settings.py'):
+def create_app(config_file='settings.py', config=None):
     app = Flask(__name__)
     
     app.config.from_pyfile(config_file)
+    # overrides on top of the settings file, e.g. the benchmark databases
+    app.config.update(config or {})
     
     db.init_app(app)
     
+    # JSON_BACKEND, ISO-8601 datetimes
+    json_backend.init_app(app)
+    
+    # flask db upgrade
+    migrate.init_app(app, db)
+    
+    response_cache.init_app(app)
+    
+    # GET /metrics
+    app_metrics.init_app(app)
+    
+    # gzip, br, zstd above COMPRESSION_MIN_SIZE, after the metrics hook so it sees compressed sizes
+    compression.init_app(app)
+    
     app.register_blueprint(api)
     
     CORS(app)
@@ -25,4 +56,25 @@ def create_app(config_file='settings.py'):
     # flask init_data
     app.cli.add_command(init_data)
     
+    # flask seed_synthetic --leads N --todos-per-lead M
+    app.cli.add_command(seed_synthetic)
+    
+    # flask check_query_plans --leads N
+    app.cli.add_command(check_query_plans_command)
+    
+    # flask score_leads
+    app.cli.add_command(score_leads_command)
+    
+    # flask rebuild_funnel_stats
+    app.cli.add_command(rebuild_funnel_stats_command)
+    
+    # flask prune_tombstones --days N
+    app.cli.add_command(prune_tombstones_command)
+    
+    # flask check_query_budgets --small 10 --large 10000
+    app.cli.add_command(check_query_budgets_command)
+    
+    # flask benchmark --sizes 100,10000 --output results.json --compare baseline.json
+    app.cli.add_command(benchmark_command)
+    
     return app
\ No newline at end of file
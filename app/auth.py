@@ -1,4 +1,8 @@
 import json
+import os
+import threading
+import time
+from collections import OrderedDict
 from flask import request, _request_ctx_stack, abort
 from functools import wraps
 from jose import jwt
@@ -9,6 +13,16 @@ AUTH0_DOMAIN = 'nroman.us.auth0.com'
 ALGORITHMS = ['RS256']
 API_AUDIENCE = 'drink'
 
+# The JWKS url can be pointed at a local stand-in server for development
+JWKS_URL = os.environ.get('AUTH0_JWKS_URL', f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+JWKS_TTL = int(os.environ.get('AUTH0_JWKS_TTL', 3600))
+# Lower bound between two refetches triggered by an unknown kid
+JWKS_MIN_REFETCH_INTERVAL = 30
+# After a failed fetch no other is tried for this long, doubling up to the max
+JWKS_RETRY_BACKOFF = 1
+JWKS_MAX_RETRY_BACKOFF = 300
+TOKEN_CACHE_SIZE = int(os.environ.get('AUTH0_TOKEN_CACHE_SIZE', 1024))
+
 # AuthError Exception
 '''
 AuthError Exception
@@ -22,6 +36,147 @@ class AuthError(Exception):
         self.status_code = status_code
 
 
+class JWKSUnavailable(Exception):
+    """The signing keys are needed but the JWKS endpoint can't be reached
+    """
+
+
+# JWKS Cache
+
+'''
+JWKSCache
+A process-wide cache of the Auth0 signing keys, keyed by kid
+    keys are fetched once and served from memory until JWKS_TTL expires
+    once stale, keys keep being served while a background thread refetches them
+    an unknown kid (key rotation) triggers a synchronous refetch, rate limited
+    by JWKS_MIN_REFETCH_INTERVAL so bogus kids can't hammer the IdP
+    a failed fetch keeps the cached keys and backs off exponentially, from
+    JWKS_RETRY_BACKOFF up to JWKS_MAX_RETRY_BACKOFF, before the next attempt
+    when a key can't be known (nothing cached yet, or an unknown kid whose
+    refetch failed) get raises JWKSUnavailable instead of the fetch error
+'''
+
+
+class JWKSCache:
+    def __init__(self, url, ttl, min_refetch_interval,
+                 retry_backoff=JWKS_RETRY_BACKOFF, max_retry_backoff=JWKS_MAX_RETRY_BACKOFF):
+        self.url = url
+        self.ttl = ttl
+        self.min_refetch_interval = min_refetch_interval
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self._keys = {}
+        self._fetched_at = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._backoff = 0
+        self._retry_at = 0
+
+    def fetch(self):
+        jsonurl = urlopen(self.url, timeout=5)
+        jwks = json.loads(jsonurl.read())
+        keys = {}
+        for key in jwks['keys']:
+            keys[key['kid']] = {
+                'kty': key['kty'],
+                'kid': key['kid'],
+                'use': key['use'],
+                'n': key['n'],
+                'e': key['e']
+            }
+        with self._lock:
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+
+    def backing_off(self):
+        return time.monotonic() < self._retry_at
+
+    def refresh(self):
+        """Fetches the keys unless backing off from a failure, True on success
+        """
+        if self.backing_off():
+            return False
+        try:
+            self.fetch()
+        except Exception:
+            # unreachable IdP, bad response: wait before anyone tries again
+            with self._lock:
+                self._backoff = min(self._backoff * 2, self.max_retry_backoff) if self._backoff else self.retry_backoff
+                self._retry_at = time.monotonic() + self._backoff
+            return False
+        with self._lock:
+            self._backoff = 0
+            self._retry_at = 0
+        return True
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        finally:
+            self._refreshing = False
+
+    def get(self, kid):
+        if self._fetched_at is None and not self.refresh():
+            raise JWKSUnavailable(self.url)
+
+        age = time.monotonic() - self._fetched_at
+        if age > self.ttl and not self._refreshing and not self.backing_off():
+            with self._lock:
+                start_refresh = not self._refreshing
+                self._refreshing = True
+            if start_refresh:
+                threading.Thread(target=self._background_refresh, daemon=True).start()
+
+        key = self._keys.get(kid)
+        if key is None and age > self.min_refetch_interval:
+            if not self.refresh():
+                raise JWKSUnavailable(self.url)
+            key = self._keys.get(kid)
+        return key
+
+
+jwks_cache = JWKSCache(JWKS_URL, JWKS_TTL, JWKS_MIN_REFETCH_INTERVAL)
+
+
+'''
+TokenCache
+A bounded LRU of tokens that already passed verification, mapped to their payload
+    a cached payload is only returned while its exp claim is in the future
+'''
+
+
+class TokenCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._payloads = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            payload = self._payloads.get(token)
+            if payload is None:
+                return None
+            if payload.get('exp', 0) <= time.time():
+                del self._payloads[token]
+                return None
+            self._payloads.move_to_end(token)
+            return payload
+
+    def set(self, token, payload):
+        with self._lock:
+            self._payloads[token] = payload
+            self._payloads.move_to_end(token)
+            while len(self._payloads) > self.maxsize:
+                self._payloads.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._payloads.clear()
+
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE)
+
+
 # Auth Header
 
 '''
@@ -96,7 +251,9 @@ implement verify_decode_jwt(token) method
         token: a json web token (string)
 
     it should be an Auth0 token with key id (kid)
-    it should verify the token using Auth0 /.well-known/jwks.json
+    it should return the cached payload if the token was already verified and hasn't expired
+    it should verify the token using Auth0 /.well-known/jwks.json (served from jwks_cache)
+        it should abort with 503 if the keys can't be fetched and none is cached for the kid
     it should decode the payload from the token
     it should validate the claims
     return the decoded payload
@@ -106,22 +263,18 @@ implement verify_decode_jwt(token) method
 
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
+
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if 'kid' not in unverified_header:
         abort(401, 'Authorization malformed.')
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    try:
+        rsa_key = jwks_cache.get(unverified_header['kid'])
+    except JWKSUnavailable:
+        abort(503, 'Unable to fetch the signing keys, try again later.')
     if rsa_key:
         try:
             payload = jwt.decode(
@@ -132,6 +285,7 @@ def verify_decode_jwt(token):
                 issuer='https://' + AUTH0_DOMAIN + '/'
             )
 
+            token_cache.set(token, payload)
             return payload
 
         except jwt.ExpiredSignatureError:
@@ -0,0 +1,383 @@
+import http.client
+import json
+import math
+import os
+import platform
+import tempfile
+import threading
+import time
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from statistics import median
+import sqlalchemy
+from flask import json as flask_json
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+from .extensions import db
+from .models import Lead, Opportunity, OpportunityInfo, FunnelStep, Todo
+from .synthetic_data import seed_synthetic_data
+from .query_budgets import budget_urls
+from .utils import default_response, paginate, with_fields
+from .core_reads import select_page
+from .search import memory_index
+from .json_backend import json_backend, make_backend, orjson
+from . import msgpack_backend
+
+# ---------------------------------------------------------------------------- #
+# Benchmarks
+# ---------------------------------------------------------------------------- #
+
+'''
+run_benchmarks boots a fresh app per dataset size, seeds it with the
+synthetic generator (so the same sizes always hold the same rows), serves
+it on a local port and drives every endpoint at a fixed concurrency. Each
+endpoint gets its own run, read routes first so that the writes do not
+change what they read. Micro-benchmarks time default_response and the
+format() methods in process. The results are plain JSON, compare_results
+flags the metrics that got slower than a previous run.
+'''
+
+WARMUP_REQUESTS = 5
+PERCENTILES = (50, 95, 99)
+MICRO_ROWS = 100
+BULK_ROWS = 100
+JSON_ROWS = 1000
+LEAD_INSERTS = 200
+MSGPACK_ACCEPT = {'Accept': msgpack_backend.MSGPACK_MIMETYPE}
+# (name, url, headers) of reads beyond the budgeted urls, for payload heavy paths
+EXTRA_URLS = [
+    ('GET /leads?limit=1000', '/leads?limit=1000', {}),
+    ('GET /leads?limit=1000 msgpack', '/leads?limit=1000', MSGPACK_ACCEPT),
+    ('GET /leads?limit=1000 gzip', '/leads?limit=1000', {'Accept-Encoding': 'gzip'}),
+    ('GET /todos?limit=1000', '/todos?limit=1000', {}),
+    ('GET /todos?limit=1000 msgpack', '/todos?limit=1000', MSGPACK_ACCEPT),
+    # search by name prefix, a misspelled name, email, phone digits and a partial city
+    ('GET /leads/search?q=mas', '/leads/search?q=mas', {}),
+    ('GET /leads/search?q=olvia smith', '/leads/search?q=olvia%20smith', {}),
+    ('GET /leads/search?q=smith', '/leads/search?q=smith', {}),
+    ('GET /leads/search?q=2024', '/leads/search?q=2024', {}),
+    ('GET /leads/search?q=waterlo', '/leads/search?q=waterlo', {}),
+]
+
+
+def lead_payload(i):
+    return {
+        'city': 'Waterloo',
+        'state': 'IA',
+        'email': f'benchmark{i}@example.com',
+        'funnelStepId': 1,
+        'name': f'Benchmark Lead {i}',
+        'phone': '+15555550100',
+    }
+
+
+def bulk_csv(i):
+    rows = ['name,funnelStepId,email']
+    rows.extend(f'Bulk Lead {i}-{row},1,bulk{i}.{row}@example.com' for row in range(BULK_ROWS))
+    return '\n'.join(rows) + '\n'
+
+
+'''
+WRITE_REQUESTS
+(name, method, url, body(i) -> (bytes, content type)) for every write route.
+Alternating payloads make every request an actual write.
+'''
+
+WRITE_REQUESTS = [
+    ('POST /leads', 'POST', '/leads',
+     lambda i: (json.dumps(lead_payload(i)).encode(), 'application/json')),
+    ('PATCH /leads/<id>', 'PATCH', '/leads/1',
+     lambda i: (json.dumps({'funnelStepId': 1 + i % 2}).encode(), 'application/json')),
+    ('PATCH /todos/<id>/move', 'PATCH', '/todos/1/move',
+     lambda i: (json.dumps({'afterId': 2 + i % 2}).encode(), 'application/json')),
+    ('POST /leads/bulk', 'POST', '/leads/bulk',
+     lambda i: (bulk_csv(i).encode(), 'text/csv')),
+]
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of sorted values
+    """
+    return values[min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    summary = {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': round(len(latencies) / elapsed, 1) if elapsed else None,
+    }
+    for p in PERCENTILES:
+        summary[f'p{p}Ms'] = round(percentile(latencies, p) * 1000, 3) if latencies else None
+    return summary
+
+
+def send(port, method, url, body=None, headers=None):
+    """Sends one request, returns (status, seconds until the body was read)
+    """
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    headers = dict(headers or {})
+    payload = None
+    if body is not None:
+        payload, headers['Content-Type'] = body
+    start = time.perf_counter()
+    try:
+        connection.request(method, url, body=payload, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        return response.status, time.perf_counter() - start
+    finally:
+        connection.close()
+
+
+def drive(port, method, url, body, requests, concurrency, headers=None):
+    """Sends requests at a fixed number in flight and summarizes their latencies
+    """
+    def one(i):
+        return send(port, method, url, body(i) if body else None, headers)
+
+    for i in range(WARMUP_REQUESTS):
+        one(requests + i)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+    errors = sum(1 for status, _ in results if status >= 400)
+    return summarize([latency for _, latency in results], errors, elapsed)
+
+
+def micro_benchmark(statement, number):
+    """Median seconds per call over five timeit repeats
+    """
+    timings = timeit.repeat(statement, number=number, repeat=5)
+    return {'meanUs': round(median(timings) / number * 1e6, 3)}
+
+
+def run_micro_benchmarks(app):
+    results = {}
+    with app.test_request_context():
+        for model, identifier in [(Lead, 'leads'), (Opportunity, 'opportunities'),
+                                  (OpportunityInfo, 'opportunityInfo'), (FunnelStep, 'funnelSteps'),
+                                  (Todo, 'todos')]:
+            items = model.query.order_by(model.id).limit(MICRO_ROWS).all()
+            if not items:
+                continue
+            # relationships behind format() are loaded once, outside the timed loop
+            for item in items:
+                item.format()
+            results[f'{model.__name__}.format x{len(items)}'] = micro_benchmark(
+                lambda: [item.format() for item in items], 10)
+            results[f'default_response {identifier} x{len(items)}'] = micro_benchmark(
+                lambda: default_response([(items, identifier)]), 10)
+            results.update(compare_read_paths(model, identifier))
+        results.update(compare_json_backends())
+        results.update(compare_msgpack(Lead, 'leads'))
+        results.update(compare_msgpack(Todo, 'todos'))
+        db.session.remove()
+    return results
+
+
+def envelope(model, identifier):
+    """The default_response body of a JSON_ROWS page, as it is before encoding
+    """
+    page = select_page(model, None, JSON_ROWS)
+    return page, {'success': True, 'code': 200, identifier: {
+        'allIds': [row['id'] for row in page.items],
+        'byId': {row['id']: row for row in page.items},
+        'nextCursor': page.next_cursor,
+    }}
+
+
+def compare_json_backends():
+    """Encodes a large /leads envelope with Flask's own encoder and every available backend
+    """
+    page, data = envelope(Lead, 'leads')
+    results = {f'flask json leads x{len(page.items)}': micro_benchmark(
+        lambda: flask_json.dumps(data, cls=flask_json.JSONEncoder, separators=(',', ':')), 10)}
+    for name in ('stdlib', 'orjson'):
+        if name == 'orjson' and orjson is None:
+            continue
+        backend = make_backend(name)
+        results[f'{name} json leads x{len(page.items)}'] = micro_benchmark(lambda: backend.dumps(data), 10)
+    return results
+
+
+def compare_msgpack(model, identifier):
+    """Encoded size and encode/decode times of a large envelope, MessagePack against JSON
+    """
+    page, data = envelope(model, identifier)
+    data[identifier]['byId'] = {str(key): row for key, row in data[identifier]['byId'].items()}
+    backend = json_backend.backend
+    loads = orjson.loads if orjson is not None else json.loads
+    json_body = backend.dumps(data)
+    msgpack_body = msgpack_backend.packb(data)
+    rows = len(page.items)
+    return {
+        f'{backend.name} encode {identifier} x{rows}': {
+            **micro_benchmark(lambda: backend.dumps(data), 10), 'bytes': len(json_body)},
+        f'msgpack encode {identifier} x{rows}': {
+            **micro_benchmark(lambda: msgpack_backend.packb(data), 10), 'bytes': len(msgpack_body)},
+        f'json decode {identifier} x{rows}': micro_benchmark(lambda: loads(json_body), 10),
+        f'msgpack decode {identifier} x{rows}': micro_benchmark(lambda: msgpack_backend.unpackb(msgpack_body), 10),
+    }
+
+
+def compare_read_paths(model, identifier):
+    """Times a page read through the ORM and format() against the core_reads path
+
+    Each call starts from an empty session, as a request does. The two
+    bodies must be byte-identical, which is recorded with the timings.
+    """
+    def orm_page():
+        db.session.remove()
+        return default_response([(paginate(with_fields(model.query, None), model, MICRO_ROWS), identifier)])
+
+    def core_page():
+        db.session.remove()
+        return default_response([(select_page(model, None, MICRO_ROWS), identifier)])
+
+    identical = orm_page().get_data() == core_page().get_data()
+    return {
+        f'orm read {identifier} x{MICRO_ROWS}': micro_benchmark(orm_page, 10),
+        f'core read {identifier} x{MICRO_ROWS}': {**micro_benchmark(core_page, 10), 'identical': identical},
+    }
+
+
+# ---------------------------------------------------------------------------- #
+# Lead Inserts
+# ---------------------------------------------------------------------------- #
+
+def add_lead(i):
+    """What POST /leads does, one transaction whose step membership is the lead row itself
+    """
+    Lead(**lead_payload(i), chanceToConvert=0.15, dateCreated=datetime.now(),
+         lastContact=datetime.now(), status='Follow Up').insert()
+
+
+def add_lead_read_modify_write(i):
+    """What POST /leads did before, for comparison
+
+    It committed the lead, then read the step's whole lead list into
+    Python and wrote the step row back in a second transaction.
+    """
+    lead = Lead(**lead_payload(i), chanceToConvert=0.15, dateCreated=datetime.now(),
+                lastContact=datetime.now(), status='Follow Up')
+    lead.insert()
+    step = FunnelStep.query.get(lead.funnelStepId)
+    step_leads = [*[lead_id for (lead_id,) in db.session.query(Lead.id).filter(Lead.funnelStepId == step.id)], lead.id]
+    step.name = f'{step.name.split(" (")[0]} ({len(step_leads)})'
+    db.session.commit()
+
+
+def compare_lead_inserts(app, concurrency):
+    """Inserts per second of LEAD_INSERTS leads added from concurrency threads, both ways
+    """
+    def timed(add):
+        def one(i):
+            with app.app_context():
+                try:
+                    add(i)
+                    return 0
+                except Exception:
+                    return 1
+                finally:
+                    db.session.remove()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            errors = sum(executor.map(one, range(LEAD_INSERTS)))
+        elapsed = time.perf_counter() - start
+        return {'inserts': LEAD_INSERTS, 'errors': errors, 'insertsPerSec': round(LEAD_INSERTS / elapsed, 1)}
+
+    return {
+        f'one transaction x{concurrency}': timed(add_lead),
+        f'read-modify-write x{concurrency}': timed(add_lead_read_modify_write),
+    }
+
+
+def prepare_database(app, size):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed_synthetic_data(size, todos_per_lead=3)
+        db.session.remove()
+    # every fresh database starts at the same table versions
+    memory_index.clear()
+
+
+def run_size(create_app, database_url, size, requests, concurrency, config):
+    """Benchmarks one dataset size, returns {'http': {...}, 'micro': {...}, 'inserts': {...}}
+    """
+    app = create_app(config={**config, 'SQLALCHEMY_DATABASE_URI': database_url})
+    prepare_database(app, size)
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        http_results = {}
+        for url, _, _ in budget_urls(app):
+            http_results['GET ' + url] = drive(server.port, 'GET', url, None, requests, concurrency)
+        for name, url, headers in EXTRA_URLS:
+            http_results[name] = drive(server.port, 'GET', url, None, requests, concurrency, headers)
+        for name, method, url, body in WRITE_REQUESTS:
+            http_results[name] = drive(server.port, method, url, body, requests, concurrency)
+    finally:
+        server.shutdown()
+        thread.join()
+    micro_results = run_micro_benchmarks(app)
+    insert_results = compare_lead_inserts(app, concurrency)
+    with app.app_context():
+        db.get_engine(app).dispose()
+    return {'http': http_results, 'micro': micro_results, 'inserts': insert_results}
+
+
+def run_benchmarks(create_app, sizes, requests, concurrency, database_url=None, config=None):
+    """Runs the whole suite once per size, returns the results document
+
+    Without database_url every size gets its own SQLite file in a
+    temporary directory. A database_url is dropped and recreated for
+    every size.
+    """
+    config = {'RESPONSE_CACHE_BACKEND': 'memory', **(config or {})}
+    directory = tempfile.mkdtemp(prefix='autoflow-benchmark-')
+    results = {}
+    for size in sizes:
+        url = database_url or 'sqlite:///' + os.path.join(directory, f'benchmark-{size}.db')
+        results[str(size)] = run_size(create_app, url, size, requests, concurrency, config)
+    return {
+        'meta': {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlalchemy': sqlalchemy.__version__,
+            'database': sqlalchemy.engine.url.make_url(database_url).drivername if database_url else 'sqlite',
+            'requests': requests,
+            'concurrency': concurrency,
+            'config': config,
+            'jsonBackend': json_backend.name,
+            # msgpack without its C extension is an order of magnitude slower
+            'msgpackExtension': not msgpack_backend.msgpack.Packer.__module__.endswith('fallback'),
+        },
+        'sizes': results,
+    }
+
+
+def compare_results(baseline, current, threshold):
+    """[(size, benchmark, metric, before, after)] for every metric that got slower by more than threshold
+    """
+    regressions = []
+    for size, groups in current['sizes'].items():
+        for group, metric in (('http', 'p95Ms'), ('micro', 'meanUs')):
+            for name, result in groups[group].items():
+                before = baseline.get('sizes', {}).get(size, {}).get(group, {}).get(name, {}).get(metric)
+                after = result.get(metric)
+                if before and after and after > before * (1 + threshold):
+                    regressions.append((size, name, metric, before, after))
+    return regressions
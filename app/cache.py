@@ -0,0 +1,206 @@
+import pickle
+import threading
+from collections import defaultdict, namedtuple
+from functools import wraps
+from cachetools import LRUCache
+from flask import request, make_response, Response
+
+from .versioning import current_versions, on_commit
+from .utils import response_format
+
+# ---------------------------------------------------------------------------- #
+# Response Cache
+# ---------------------------------------------------------------------------- #
+
+'''
+CacheEntry
+The serialized body of a response and the table versions it was built from
+'''
+
+CacheEntry = namedtuple('CacheEntry', ['versions', 'body', 'mimetype'])
+
+
+'''
+Backends
+Every backend implements get(key), set(key, entry, tables) and evict_tables(tables)
+'''
+
+
+class EvictingLRUCache(LRUCache):
+    """An LRUCache that calls on_evict(key) for every entry it drops to make room
+    """
+
+    def __init__(self, maxsize, getsizeof, on_evict):
+        super().__init__(maxsize, getsizeof=getsizeof)
+        self.on_evict = on_evict
+
+    def popitem(self):
+        key, value = super().popitem()
+        self.on_evict(key)
+        return key, value
+
+
+class MemoryBackend:
+    """An in-process LRU capped by the total size of the cached bodies
+
+    The table index only holds keys that are still cached, entries the LRU
+    drops are removed from it as well.
+    """
+
+    def __init__(self, max_bytes):
+        self._entries = EvictingLRUCache(max_bytes, lambda entry: len(entry.body), self._forget)
+        self._keys_by_table = defaultdict(set)
+        self._tables_by_key = {}
+        self._lock = threading.Lock()
+
+    def _forget(self, key):
+        # called with the lock held
+        for table in self._tables_by_key.pop(key, ()):
+            keys = self._keys_by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_table[table]
+
+    def get(self, key):
+        with self._lock:
+            return self._entries.get(key)
+
+    def set(self, key, entry, tables):
+        if len(entry.body) > self._entries.maxsize:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._tables_by_key.setdefault(key, set()).update(tables)
+            for table in tables:
+                self._keys_by_table[table].add(key)
+
+    def evict_tables(self, tables):
+        with self._lock:
+            for table in tables:
+                for key in self._keys_by_table.pop(table, ()):
+                    self._entries.pop(key, None)
+                    self._forget(key)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    """A cache shared by every worker, stored in Redis
+
+    Entries from other workers can't be evicted on commit, they are expired
+    by ttl and rejected on read once their table versions are stale. Any
+    client with redis-py's get/set interface works, e.g. fakeredis locally,
+    see RESPONSE_CACHE_REDIS_CLIENT.
+    """
+
+    def __init__(self, client, ttl, prefix='response-cache:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return CacheEntry(*pickle.loads(value)) if value is not None else None
+
+    def set(self, key, entry, tables):
+        self.client.set(self.prefix + key, pickle.dumps(tuple(entry)), ex=self.ttl)
+
+    def evict_tables(self, tables):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+class NullBackend:
+    def get(self, key):
+        return None
+
+    def set(self, key, entry, tables):
+        pass
+
+    def evict_tables(self, tables):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+class ResponseCache:
+    """Caches the serialized output of read routes per url
+
+    A cached body is only served while the versions of the tables it was
+    built from are unchanged, so any committed write (add_lead bumps both
+    lead and funnelStep) invalidates exactly the entries that read those
+    tables. Local entries are also dropped as soon as the write commits.
+    """
+
+    def __init__(self):
+        self.backend = NullBackend()
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        on_commit(self.evict_tables)
+
+    def init_app(self, app):
+        backend = app.config['RESPONSE_CACHE_BACKEND']
+        if backend == 'memory':
+            self.backend = MemoryBackend(app.config['RESPONSE_CACHE_MAX_BYTES'])
+        elif backend == 'redis':
+            client = app.config.get('RESPONSE_CACHE_REDIS_CLIENT')
+            if client is None:
+                import redis
+                client = redis.Redis.from_url(app.config['RESPONSE_CACHE_REDIS_URL'])
+            self.backend = RedisBackend(client, app.config['RESPONSE_CACHE_TTL'])
+        else:
+            self.backend = NullBackend()
+
+    def count(self, hit):
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def evict_tables(self, tables):
+        self.backend.evict_tables(tables)
+
+    def stats(self):
+        with self._stats_lock:
+            hits, misses = self.hits, self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'entries': len(self.backend),
+            'hits': hits,
+            'misses': misses,
+        }
+
+    def cached(self, *tables):
+        def cached_decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                # the same url is cached once per negotiated format
+                key = response_format() + ':' + request.full_path
+                versions = current_versions(tables)
+                entry = self.backend.get(key)
+                if entry is not None and entry.versions == versions:
+                    self.count(hit=True)
+                    response = Response(entry.body, mimetype=entry.mimetype)
+                    response.vary.add('Accept')
+                    return response
+
+                self.count(hit=False)
+                response = make_response(f(*args, **kwargs))
+                if response.status_code == 200 and not response.is_streamed:
+                    entry = CacheEntry(versions, response.get_data(), response.mimetype)
+                    self.backend.set(key, entry, tables)
+                return response
+
+            return wrapper
+        return cached_decorator
+
+
+response_cache = ResponseCache()
+cached = response_cache.cached
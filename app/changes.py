@@ -0,0 +1,308 @@
+from collections import defaultdict, namedtuple
+from datetime import datetime
+from functools import lru_cache
+from flask import request, abort
+from sqlalchemy import and_, case, event, select, func, text
+from sqlalchemy.orm.interfaces import ONETOMANY
+
+from .extensions import db
+from .models import Lead, Opportunity, OpportunityInfo, FunnelStep, Todo, ChangeCounter, Tombstone
+from .versioning import touch, before_commit
+from .funnel_stats import stored
+from .core_reads import select_rows
+
+# ---------------------------------------------------------------------------- #
+# Change Feed
+# ---------------------------------------------------------------------------- #
+
+'''
+Every write gives the rows it creates or updates the next numbers of one
+global change sequence (changeSeq, with updatedAt), and every deleted row
+leaves a Tombstone with a number of its own. GET /changes?since=<cursor>
+returns what was numbered after the cursor.
+
+Writes leave changeSeq NULL on the rows they write and record the tables,
+the rows are numbered in one go when the transaction commits. Numbers are
+reserved by incrementing the change_counter row from a before_commit hook,
+after the table versions are bumped, so the counter is always the last lock
+a transaction takes and is only held while it commits. Numbers still
+become visible in order: a reader that reads the counter first and returns
+nothing above it never skips a change that commits later.
+
+Derived fields list the ids of child rows (FunnelStep.leads), so a parent
+is renumbered as well whenever a child joins or leaves it.
+
+Tombstones are kept for TOMBSTONE_RETENTION_DAYS, then prune_tombstones
+deletes them and records the highest number it deleted as prunedSeq on the
+counter row. A cursor below prunedSeq (other than 0) may have missed
+deletes, so /changes answers it with a 410 and the client loads everything
+again with since=0. Rows numbered below prunedSeq are renumbered by the
+prune, so that load never passes such a cursor. A row nobody writes is
+therefore sent again about once per retention period.
+
+ChangesPage
+collections    [(rows, identifier)] of the changed rows, for default_response
+deleted        {identifier: [ids]} of the deleted rows
+cursor         the since= of the next request
+has_more       whether changes beyond cursor are already waiting
+oldest_cursor  the lowest since= (other than 0) that still sees every delete
+'''
+
+ChangesPage = namedtuple('ChangesPage', ['collections', 'deleted', 'cursor', 'has_more', 'oldest_cursor'])
+
+# Models in the feed and their collection names, as in /bootstrap
+CHANGE_COLLECTIONS = [
+    (Opportunity, 'opportunities'),
+    (FunnelStep, 'funnelSteps'),
+    (Lead, 'leads'),
+    (OpportunityInfo, 'opportunityInfo'),
+    (Todo, 'todos'),
+]
+CHANGE_MODELS = tuple(model for model, _ in CHANGE_COLLECTIONS)
+CHANGE_TABLES = [model.__tablename__ for model in CHANGE_MODELS]
+# Whatever /changes returns depends on, pruning only touches the tombstones
+FEED_TABLES = [*CHANGE_TABLES, Tombstone.__tablename__]
+
+
+def reserve_change_seqs(count):
+    """Reserves count consecutive change numbers in the current transaction, returns the first
+
+    The counter stays locked until the transaction ends.
+    """
+    table = ChangeCounter.__table__
+    updated = db.session.execute(table.update().where(table.c.id == 1).values(seq=table.c.seq + count))
+    if updated.rowcount == 0:
+        db.session.execute(table.insert().values(id=1, seq=count))
+    last = db.session.execute(select([table.c.seq]).where(table.c.id == 1)).scalar()
+    return last - count + 1
+
+
+def latest_change_seq():
+    table = ChangeCounter.__table__
+    return db.session.execute(select([table.c.seq]).where(table.c.id == 1)).scalar() or 0
+
+
+def change_seq_bounds():
+    """(latest change number, prunedSeq) from the counter row, in one read
+    """
+    table = ChangeCounter.__table__
+    row = db.session.execute(select([table.c.seq, table.c.prunedSeq]).where(table.c.id == 1)).first()
+    return tuple(row) if row else (0, 0)
+
+
+@lru_cache(maxsize=None)
+def derived_parents(model):
+    """(parent model, foreign key attribute) of every derived field listing the model's ids
+    """
+    parents = []
+    for parent in CHANGE_MODELS:
+        for relationship_name in getattr(parent, 'derived_fields', {}).values():
+            relationship = parent.__mapper__.relationships[relationship_name]
+            if relationship.mapper.class_ is model:
+                column, = relationship.remote_side
+                parents.append((parent, model.__mapper__.get_property_by_column(column).key))
+    return tuple(parents)
+
+
+def number_at_commit(*tables):
+    """Has the rows of the tables left with a NULL changeSeq numbered when the transaction commits
+    """
+    db.session.info.setdefault('unnumbered_tables', set()).update(tables)
+
+
+def mark_changed(model, ids):
+    """Renumbers rows whose API fields changed without an ORM write to them
+    """
+    ids = sorted(set(ids) - {None})
+    if ids:
+        table = model.__table__
+        db.session.execute(table.update().where(table.c.id.in_(ids)).values(changeSeq=None, updatedAt=datetime.now()))
+        number_at_commit(model.__tablename__)
+        touch(model.__tablename__)
+
+
+'''
+Writes that bypass the unit of work (bulk inserts, Core statements, COPY)
+set changeSeq to NULL themselves, and mark their parents, with the
+functions below.
+'''
+
+
+def stamp_rows(model, rows):
+    """Stamps row dicts that are about to be inserted, and renumbers their parents
+    """
+    now = datetime.now()
+    for row in rows:
+        row['changeSeq'] = None
+        row['updatedAt'] = now
+    number_at_commit(model.__tablename__)
+    for parent, key in derived_parents(model):
+        mark_changed(parent, {row.get(key) for row in rows})
+
+
+def stamp_copied_rows(model):
+    """Stamps the rows a Postgres COPY just inserted (they have no changeSeq yet)
+    """
+    table = model.__table__
+    db.session.execute(table.update().where(table.c.changeSeq == None).values(updatedAt=datetime.now()))
+    number_at_commit(model.__tablename__)
+    for parent, key in derived_parents(model):
+        rows = db.session.execute(select([table.c[key]]).where(table.c.changeSeq == None).distinct())
+        mark_changed(parent, [row[0] for row in rows])
+
+
+def pending_changes(session):
+    """(rows to renumber, deleted rows, {parent model: ids to renumber}) of the pending ORM writes
+    """
+    changed = [obj for obj in session.new if isinstance(obj, CHANGE_MODELS)]
+    changed += [obj for obj in session.dirty if isinstance(obj, CHANGE_MODELS) and session.is_modified(obj)]
+    deleted = [obj for obj in session.deleted if isinstance(obj, CHANGE_MODELS)]
+    # the flush sets the foreign key of a deleted row's children to NULL
+    for obj in deleted:
+        for relationship in obj.__mapper__.relationships:
+            if relationship.direction is ONETOMANY:
+                changed += [child for child in getattr(obj, relationship.key) if child not in session.deleted]
+    changed = list(dict.fromkeys(changed))
+
+    parents = defaultdict(set)
+    for model in CHANGE_MODELS:
+        children = [obj for obj in [*changed, *deleted] if isinstance(obj, model)]
+        for parent, key in derived_parents(model):
+            old = stored(
+                session,
+                [model.id, model.__mapper__.columns[key]],
+                [obj.id for obj in children if obj not in session.new]
+            )
+            for obj in children:
+                old_id, = old.get(obj.id, (None,))
+                new_id = None if obj in session.deleted else getattr(obj, key)
+                if old_id != new_id:
+                    parents[parent].update({old_id, new_id} - {None})
+    # parents written or deleted in this flush are numbered with the rest
+    for obj in [*changed, *deleted]:
+        parents[type(obj)].discard(obj.id)
+    return changed, deleted, {parent: ids for parent, ids in parents.items() if ids}
+
+
+@event.listens_for(db.session, 'before_flush')
+def stamp_flushed_changes(session, flush_context, instances):
+    with session.no_autoflush:
+        changed, deleted, parents = pending_changes(session)
+    now = datetime.now()
+    for obj in changed:
+        obj.changeSeq = None
+        obj.updatedAt = now
+    for obj in deleted:
+        session.add(Tombstone(obj.__tablename__, obj.id, None, now))
+    for parent, ids in parents.items():
+        mark_changed(parent, ids)
+    tables = {obj.__tablename__ for obj in changed}
+    if deleted:
+        tables.add(Tombstone.__tablename__)
+    number_at_commit(*tables)
+
+
+@before_commit
+def number_changes(session):
+    """Numbers the rows the transaction left with a NULL changeSeq, table by table in id order
+    """
+    tables = sorted(session.info.pop('unnumbered_tables', ()))
+    counts = []
+    for name in tables:
+        table = db.metadata.tables[name]
+        counts.append(session.execute(select([func.count()]).where(table.c.changeSeq == None)).scalar())
+    if not sum(counts):
+        return
+    first = reserve_change_seqs(sum(counts))
+    for name, count in zip(tables, counts):
+        if count:
+            session.execute(text(f'''
+                UPDATE "{name}" SET "changeSeq" = :first + numbered.position - 1
+                FROM (
+                    SELECT id, row_number() OVER (ORDER BY id) AS position FROM "{name}" WHERE "changeSeq" IS NULL
+                ) AS numbered
+                WHERE "{name}".id = numbered.id
+            '''), {'first': first})
+            first += count
+
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_unnumbered_tables(session):
+    session.info.pop('unnumbered_tables', None)
+
+
+def prune_tombstones(older_than):
+    """Deletes the tombstones up to the newest numbered one from before older_than, returns how many
+
+    The rows last numbered at or below it are numbered again, so every cursor
+    handed out from now on, paging from since=0 included, is above prunedSeq.
+    prunedSeq is raised in the same transaction and last, the counter being
+    the last lock a transaction takes.
+    """
+    table = Tombstone.__table__
+    pruned_seq = db.session.execute(
+        select([func.max(table.c.changeSeq)]).where(and_(table.c.deletedAt < older_than, table.c.changeSeq != None))
+    ).scalar()
+    if pruned_seq is None:
+        return 0
+    deleted = db.session.execute(table.delete().where(table.c.changeSeq <= pruned_seq)).rowcount
+    for model in CHANGE_MODELS:
+        rows = model.__table__
+        if db.session.execute(rows.update().where(rows.c.changeSeq <= pruned_seq).values(changeSeq=None)).rowcount:
+            number_at_commit(model.__tablename__)
+            touch(model.__tablename__)
+    counter = ChangeCounter.__table__
+    db.session.execute(counter.update().where(counter.c.id == 1).values(
+        prunedSeq=case([(counter.c.prunedSeq < pruned_seq, pruned_seq)], else_=counter.c.prunedSeq)
+    ))
+    # cached /changes responses of the pruned cursors are stale now
+    touch(Tombstone.__tablename__)
+    return deleted
+
+# ---------------------------------------------------------------------------- #
+# Reading Changes
+# ---------------------------------------------------------------------------- #
+
+def since_arg():
+    """Reads ?since=, the cursor of the previous /changes response (0 for everything)
+    """
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        abort(400, 'since must be an integer.')
+    if since < 0:
+        abort(400, 'since must not be negative.')
+    return since
+
+
+def changes_since(since, limit):
+    """The first limit changes numbered after since, as a ChangesPage
+
+    Each table gives at most limit + 1 rows off its changeSeq index, which
+    always holds the first limit changes overall. When since is ahead of
+    the latest change (the database was recreated), the cursor is below it.
+    """
+    upto, pruned_seq = change_seq_bounds()
+    fetched = []
+    for model, identifier in CHANGE_COLLECTIONS:
+        criteria = [model.changeSeq > since, model.changeSeq <= upto]
+        fetched.append((select_rows(model, None, criteria, order_by=[model.changeSeq], limit=limit + 1), identifier))
+    table = Tombstone.__table__
+    tombstones = db.session.execute(
+        select([table.c.tableName, table.c.entityId, table.c.changeSeq])
+        .where(table.c.changeSeq > since).where(table.c.changeSeq <= upto)
+        .order_by(table.c.changeSeq).limit(limit + 1)
+    ).fetchall()
+
+    seqs = sorted([row['changeSeq'] for rows, _ in fetched for row in rows] + [row.changeSeq for row in tombstones])
+    cursor, has_more = upto, False
+    if len(seqs) > limit:
+        cursor, has_more = seqs[limit - 1], True
+
+    collections = [([row for row in rows if row['changeSeq'] <= cursor], identifier) for rows, identifier in fetched]
+    identifiers = {model.__tablename__: identifier for model, identifier in CHANGE_COLLECTIONS}
+    deleted = {identifier: [] for _, identifier in CHANGE_COLLECTIONS}
+    for row in tombstones:
+        if row.changeSeq <= cursor:
+            deleted[identifiers[row.tableName]].append(row.entityId)
+    return ChangesPage(collections, deleted, cursor, has_more, pruned_seq)
@@ -1,9 +1,18 @@
+import json
+import time
+from datetime import datetime, timedelta
 import click
+from flask import current_app
 from flask.cli import with_appcontext
 
 from .extensions import db
 from .models import Lead, Opportunity, OpportunityInfo, FunnelStep
-from .initialize_data import initialize_data
+from .initialize_data import initialize_data, load_file, MODELS
+from .synthetic_data import seed_synthetic_data
+from .query_plans import check_query_plans
+from .funnel_stats import rebuild_funnel_stats
+from .changes import prune_tombstones
+from .query_budgets import measure_queries, compare_query_budgets
 
 @click.command(name="create_tables")
 @with_appcontext
@@ -17,6 +26,136 @@ def drop_and_create_tables():
     db.create_all()
 
 @click.command(name="init_data")
+@click.option('--file', 'path', type=click.Path(exists=True, dir_okay=False),
+              help='NDJSON or CSV file to load instead of the default data.')
+@click.option('--table', type=click.Choice(sorted(MODELS)),
+              help='Table the --file rows belong to.')
 @with_appcontext
-def init_data():
-    initialize_data()
\ No newline at end of file
+def init_data(path, table):
+    if path is None:
+        initialize_data()
+        return
+    if table is None:
+        raise click.UsageError('--table is required with --file.')
+    count = load_file(MODELS[table], path)
+    click.echo(f'Loaded {count} rows into {table}')
+
+@click.command(name="seed_synthetic")
+@click.option('--leads', default=1000, show_default=True, help='Number of leads to generate.')
+@click.option('--todos-per-lead', default=3, show_default=True, help='Todos generated for every lead.')
+@click.option('--opportunities', default=4, show_default=True, help='Opportunities (7 funnel steps each).')
+@click.option('--seed', default=0, show_default=True, help='Random seed, same seed same data.')
+@with_appcontext
+def seed_synthetic(leads, todos_per_lead, opportunities, seed):
+    seed_synthetic_data(leads, todos_per_lead, opportunities, seed)
+    click.echo(f'Generated {leads} leads and {leads * todos_per_lead} todos')
+
+@click.command(name="check_query_plans")
+@click.option('--leads', default=0, help='Seed this many synthetic leads first.')
+@with_appcontext
+def check_query_plans_command(leads):
+    if leads:
+        seed_synthetic_data(leads, todos_per_lead=3)
+    failures = 0
+    for name, plan, ok in check_query_plans():
+        click.echo(f'{"ok  " if ok else "FAIL"} {name}')
+        if not ok:
+            failures += 1
+            click.echo('\n'.join('      ' + line for line in plan))
+    if failures:
+        raise click.ClickException(f'{failures} hot queries do not use an index')
+
+@click.command(name="score_leads")
+@with_appcontext
+def score_leads_command():
+    # imported here so numpy is only loaded by the commands that need it
+    from .lead_scoring import score_leads
+    start = time.perf_counter()
+    count = score_leads()
+    click.echo(f'Scored {count} leads in {time.perf_counter() - start:.2f}s')
+
+@click.command(name="rebuild_funnel_stats")
+@with_appcontext
+def rebuild_funnel_stats_command():
+    rebuild_funnel_stats()
+    db.session.commit()
+    click.echo('Rebuilt funnel step stats')
+
+@click.command(name="prune_tombstones")
+@click.option('--days', type=int, default=None,
+              help='Keep the tombstones of this many days, TOMBSTONE_RETENTION_DAYS by default.')
+@with_appcontext
+def prune_tombstones_command(days):
+    # run it from a daily job, clients with older cursors resync from since=0
+    days = current_app.config['TOMBSTONE_RETENTION_DAYS'] if days is None else days
+    count = prune_tombstones(datetime.now() - timedelta(days=days))
+    db.session.commit()
+    click.echo(f'Pruned {count} tombstones older than {days} days')
+
+@click.command(name="check_query_budgets")
+@click.option('--small', default=10, show_default=True, help='Leads in the first measurement.')
+@click.option('--large', default=10000, show_default=True, help='Leads in the second measurement.')
+@with_appcontext
+def check_query_budgets_command(small, large):
+    # grows its own dataset, e.g. DATABASE_URL=sqlite:// flask check_query_budgets
+    db.create_all()
+    if db.session.query(Lead.id).first() is not None:
+        raise click.ClickException('check_query_budgets needs an empty database.')
+    app = current_app._get_current_object()
+    seed_synthetic_data(small, todos_per_lead=3, seed=0)
+    small_counts = measure_queries(app)
+    seed_synthetic_data(large - small, todos_per_lead=3, seed=1)
+    large_counts = measure_queries(app)
+
+    failures = 0
+    for url, budget, small_count, large_count, problem in compare_query_budgets(app, small_counts, large_counts):
+        click.echo(f'{"FAIL" if problem else "ok  "} {url}  {small_count} / {large_count} of {budget}'
+                   + (f'  ({problem})' if problem else ''))
+        if problem:
+            failures += 1
+    if failures:
+        raise click.ClickException(f'{failures} routes break their query budget')
+
+@click.command(name="benchmark")
+@click.option('--sizes', default='100,10000', show_default=True, help='Comma separated lead counts to seed.')
+@click.option('--requests', default=200, show_default=True, help='Requests sent to every endpoint.')
+@click.option('--concurrency', default=8, show_default=True, help='Requests in flight at once.')
+@click.option('--database-url', default=None,
+              help='Database to benchmark against, DROPPED and reseeded for every size. '
+                   'Defaults to a temporary SQLite file per size.')
+@click.option('--no-cache', is_flag=True, help='Disable the response cache.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write the results to this JSON file.')
+@click.option('--compare', 'baseline_path', type=click.Path(exists=True, dir_okay=False),
+              help='Results of a previous run to compare against.')
+@click.option('--threshold', default=0.2, show_default=True, help='Slowdown flagged as a regression.')
+def benchmark_command(sizes, requests, concurrency, database_url, no_cache, output, baseline_path, threshold):
+    # imported here so the suite only loads when it runs
+    from . import create_app
+    from .benchmark import run_benchmarks, compare_results
+    config = {'RESPONSE_CACHE_BACKEND': 'none'} if no_cache else {}
+    sizes = [int(size) for size in sizes.split(',')]
+    results = run_benchmarks(create_app, sizes, requests, concurrency, database_url, config)
+
+    for size, groups in results['sizes'].items():
+        click.echo(f'\n{size} leads')
+        for name, result in groups['http'].items():
+            click.echo(f'  {name:<48} {result["throughput"]:>8} req/s  p50 {result["p50Ms"]:>8} ms'
+                       f'  p95 {result["p95Ms"]:>8} ms  p99 {result["p99Ms"]:>8} ms  errors {result["errors"]}')
+        for name, result in groups['micro'].items():
+            identical = {True: '  identical output', False: '  OUTPUT DIFFERS'}.get(result.get('identical'), '')
+            encoded = f'  {result["bytes"]} bytes' if 'bytes' in result else ''
+            click.echo(f'  {name:<48} {result["meanUs"]:>10} us{encoded}{identical}')
+        for name, result in groups.get('inserts', {}).items():
+            click.echo(f'  lead inserts {name:<35} {result["insertsPerSec"]:>8} inserts/s  errors {result["errors"]}')
+    if output:
+        with open(output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+        click.echo(f'\nWrote {output}')
+
+    if baseline_path:
+        with open(baseline_path) as baseline_file:
+            regressions = compare_results(json.load(baseline_file), results, threshold)
+        for size, name, metric, before, after in regressions:
+            click.echo(f'REGRESSION {size} leads  {name}  {metric} {before} -> {after}')
+        if regressions:
+            raise click.ClickException(f'{len(regressions)} benchmarks regressed more than {threshold:.0%}')
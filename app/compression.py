@@ -0,0 +1,160 @@
+import threading
+import zlib
+from cachetools import LRUCache
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# ---------------------------------------------------------------------------- #
+# Response Compression
+# ---------------------------------------------------------------------------- #
+
+'''
+Compresses response bodies of at least COMPRESSION_MIN_SIZE bytes with the
+best Accept-Encoding the client and the server share. gzip always works,
+br and zstd only when brotli and zstandard are installed. Ties in the
+client's q-values go to the first encoding of COMPRESSION_ENCODINGS.
+
+Responses with an ETag (every @conditional route, so also every response
+cache hit) keep their compressed bytes in an LRU keyed by ETag and
+encoding, so a repeat hit does no compression work. The ETag changes with
+the table versions, stale entries simply age out. A compressed response
+gets the weak form of its ETag, since it is not the same bytes as the
+uncompressed one.
+'''
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/msgpack',
+    'text/plain',
+    'text/csv',
+    'text/html',
+}
+
+
+def gzip_compressor(config):
+    level = config['COMPRESSION_GZIP_LEVEL']
+
+    def compress(body):
+        # wbits 31 writes a gzip header, with a zero mtime so the bytes are stable
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return compressor.compress(body) + compressor.flush()
+    return compress
+
+
+def brotli_compressor(config):
+    quality = config['COMPRESSION_BROTLI_QUALITY']
+    return lambda body: brotli.compress(body, quality=quality)
+
+
+def zstd_compressor(config):
+    compressor = zstandard.ZstdCompressor(level=config['COMPRESSION_ZSTD_LEVEL'])
+    lock = threading.Lock()
+
+    def compress(body):
+        # a ZstdCompressor is not safe to share between threads
+        with lock:
+            return compressor.compress(body)
+    return compress
+
+
+def available_compressors(config):
+    """{encoding: compress(body)} of the configured encodings whose module is installed
+    """
+    factories = {'gzip': gzip_compressor}
+    if brotli is not None:
+        factories['br'] = brotli_compressor
+    if zstandard is not None:
+        factories['zstd'] = zstd_compressor
+
+    compressors = {}
+    for encoding in config['COMPRESSION_ENCODINGS'].split(','):
+        encoding = encoding.strip()
+        if encoding in factories:
+            compressors[encoding] = factories[encoding](config)
+    return compressors
+
+
+class Compression:
+    """after_request compression of the app's responses
+    """
+
+    def __init__(self):
+        self.compressors = {}
+        self.min_size = 0
+        self._bodies = LRUCache(0)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self.compressors = available_compressors(app.config)
+        self.min_size = app.config['COMPRESSION_MIN_SIZE']
+        self._bodies = LRUCache(app.config['COMPRESSION_CACHE_MAX_BYTES'], getsizeof=len)
+        if self.compressors:
+            app.after_request(self.compress_response)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'encodings': list(self.compressors),
+                'entries': len(self._bodies),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def compressed_body(self, response, encoding):
+        """The compressed body, from the LRU if the response has an ETag
+        """
+        etag, weak = response.get_etag()
+        if etag is None or weak:
+            return self.compressors[encoding](response.get_data())
+
+        key = (etag, encoding)
+        with self._lock:
+            body = self._bodies.get(key)
+            if body is not None:
+                self.hits += 1
+                return body
+            self.misses += 1
+
+        body = self.compressors[encoding](response.get_data())
+        if len(body) <= self._bodies.maxsize:
+            with self._lock:
+                self._bodies[key] = body
+        return body
+
+    def compress_response(self, response):
+        if response.status_code == 304:
+            response.vary.add('Accept-Encoding')
+            return response
+        if (response.status_code != 200
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES
+                or response.is_streamed
+                or response.direct_passthrough
+                or 'Content-Encoding' in response.headers):
+            return response
+
+        # the body depends on Accept-Encoding whether or not this one is compressed
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(list(self.compressors))
+        if encoding is None or len(response.get_data()) < self.min_size:
+            return response
+
+        etag, _ = response.get_etag()
+        response.set_data(self.compressed_body(response, encoding))
+        response.headers['Content-Encoding'] = encoding
+        if etag is not None:
+            response.set_etag(etag, weak=True)
+        return response
+
+
+compression = Compression()
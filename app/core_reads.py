@@ -0,0 +1,102 @@
+from collections import namedtuple
+from functools import lru_cache
+from sqlalchemy import and_, select
+
+from .extensions import db
+from .utils import Page
+
+# ---------------------------------------------------------------------------- #
+# Core Reads
+# ---------------------------------------------------------------------------- #
+
+'''
+The read path of the list routes. Rows come straight from Core selects and
+are zipped into the dicts format() would build, without identity-mapped
+objects in between. default_response takes the dicts as they are.
+
+RowSchema
+keys      the serialized keys read from columns, in select order
+columns   the Core columns behind keys
+derived   (key, child id column, parent id column) of every derived field,
+          e.g. FunnelStep.leads is ('leads', lead.id, lead.funnelStepId)
+'''
+
+RowSchema = namedtuple('RowSchema', ['keys', 'columns', 'derived'])
+
+# (model, fieldset) mappings kept at once
+ROW_SCHEMA_CACHE_SIZE = 256
+
+
+@lru_cache(maxsize=ROW_SCHEMA_CACHE_SIZE)
+def row_schema(model, fields=None):
+    """The column to key mapping of format(), or of a ?fields= sparse fieldset
+
+    fields is a tuple so the mapping can be built once per model and fieldset.
+    field_args normalizes the fieldsets, the bound keeps arbitrary
+    combinations of columns from growing the cache.
+    """
+    mapper = model.__mapper__
+    derived_fields = getattr(model, 'derived_fields', {})
+    keys = list(mapper.column_attrs.keys()) + list(derived_fields) if fields is None else ['id', *fields]
+
+    column_keys = [key for key in keys if key not in derived_fields]
+    derived = []
+    for key in keys:
+        if key in derived_fields:
+            relationship = mapper.relationships[derived_fields[key]]
+            child_mapper = relationship.mapper
+            parent_column, = relationship.remote_side
+            derived.append((key, child_mapper.columns['id'], parent_column))
+    return RowSchema(column_keys, [mapper.columns[key] for key in column_keys], derived)
+
+
+def read_snapshot():
+    """Makes the following SELECTs of the request read one snapshot
+
+    Under Postgres' default READ COMMITTED every statement sees the commits
+    made before it started, so two collections read one after the other can
+    disagree. The request's transaction is restarted as REPEATABLE READ
+    READ ONLY instead. Anything read before (the table versions of the ETag)
+    stays in the old transaction, which only ever makes an ETag stale.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return
+    db.session.rollback()
+    db.session.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+
+
+def select_rows(model, fields=None, criteria=(), order_by=None, limit=None):
+    """Rows of the model serialized exactly as format() (or serialize with fields) would
+    """
+    schema = row_schema(model, tuple(fields) if fields is not None else None)
+    statement = select(schema.columns)
+    if criteria:
+        statement = statement.where(and_(*criteria))
+    statement = statement.order_by(*(order_by if order_by is not None else [model.id]))
+    if limit is not None:
+        statement = statement.limit(limit)
+    keys = schema.keys
+    rows = [dict(zip(keys, row)) for row in db.session.execute(statement)]
+
+    # one SELECT per derived field for the whole page, like selectinload
+    for key, child_id, parent_id in schema.derived:
+        children = {row['id']: [] for row in rows}
+        if children:
+            statement = select([child_id, parent_id]).where(parent_id.in_(list(children))).order_by(child_id)
+            for child, parent in db.session.execute(statement):
+                children[parent].append(child)
+        for row in rows:
+            row[key] = children[row['id']]
+    return rows
+
+
+def select_page(model, fields, limit, after=None):
+    """Keyset paginated rows, the Core counterpart of utils.paginate
+    """
+    criteria = [model.id > after] if after is not None else []
+    rows = select_rows(model, fields, criteria, limit=limit + 1)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1]['id']
+    return Page(rows, next_cursor)
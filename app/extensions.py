@@ -1,3 +1,23 @@
+from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
 
-db = SQLAlchemy()
\ No newline at end of file
+db = SQLAlchemy()
+migrate = Migrate()
+
+
+def lock_for_write(session):
+    """Takes SQLite's write lock for the session's transaction, if it doesn't hold it yet
+
+    pysqlite only opens a transaction at the first write, so the reads a
+    write is computed from would run outside of it, and another connection
+    could commit in between. BEGIN IMMEDIATE takes the write lock before
+    those reads, waiting for the current writer instead of failing later.
+    Postgres needs nothing here, its callers lock rows with FOR UPDATE.
+    """
+    connection = session.connection()
+    if connection.dialect.name != 'sqlite':
+        return
+    sqlite_connection = connection.connection.connection
+    if not sqlite_connection.in_transaction:
+        # straight to the driver, so it isn't counted as a statement of the request
+        sqlite_connection.execute('BEGIN IMMEDIATE')
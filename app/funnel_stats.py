@@ -0,0 +1,261 @@
+import re
+from collections import Counter, defaultdict
+from sqlalchemy import case, cast, distinct, event, func, select, Float
+from sqlalchemy.orm.attributes import flag_modified
+
+from .extensions import db, lock_for_write
+from .models import Lead, OpportunityInfo, FunnelStep, FunnelStepStats
+from .versioning import touch
+
+# ---------------------------------------------------------------------------- #
+# Funnel Stats
+# ---------------------------------------------------------------------------- #
+
+'''
+FunnelStepStats holds, for every funnel step, the leads on it and the count
+and total of the quotedPrice and finalPrice of their OpportunityInfo rows.
+ORM writes adjust the affected rows by a delta in the flush that makes them,
+bulk loads recompute them with one GROUP BY (rebuild_funnel_stats).
+'''
+
+STATS_TABLE = FunnelStepStats.__tablename__
+STAT_COLUMNS = ('leadCount', 'quotedCount', 'quotedTotal', 'finalCount', 'finalTotal')
+# Tables whose rows feed the stats, bulk loads into them need a rebuild
+SOURCE_TABLES = (Lead.__tablename__, OpportunityInfo.__tablename__)
+
+# finalPrice is a string column, values that are not plain numbers are left out.
+# numeric_price() applies the same rule in SQL on every dialect.
+NUMBER = re.compile(r'-?[0-9]+(\.[0-9]+)?')
+
+
+def price(value):
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    return float(value) if NUMBER.fullmatch(value) else None
+
+
+def numeric_price(column):
+    """SQL counterpart of price() for a string column
+    """
+    if db.engine.dialect.name == 'postgresql':
+        is_number = column.op('~')(r'^-?[0-9]+(\.[0-9]+)?$')
+    else:
+        # SQLite has no regular expressions: strip the sign, then the rest is
+        # digits with at most one dot, neither first nor last
+        unsigned = case([(column.op('GLOB')('-*'), func.substr(column, 2))], else_=column)
+        is_number = (unsigned != '') \
+            & ~unsigned.op('GLOB')('*[^0-9.]*') \
+            & ~unsigned.op('GLOB')('.*') \
+            & ~unsigned.op('GLOB')('*.') \
+            & ~unsigned.op('GLOB')('*.*.*')
+    return case([(is_number, cast(column, Float))])
+
+
+def price_stats(quoted, final):
+    stats = Counter()
+    quoted, final = price(quoted), price(final)
+    if quoted is not None:
+        stats.update(quotedCount=1, quotedTotal=quoted)
+    if final is not None:
+        stats.update(finalCount=1, finalTotal=final)
+    return stats
+
+# ---------------------------------------------------------------------------- #
+# Incremental Updates
+# ---------------------------------------------------------------------------- #
+
+def stored(session, columns, ids):
+    """{id: rest of the row} as the database has it before this flush
+
+    The rows are locked (FOR UPDATE on Postgres, the write lock on SQLite)
+    until the transaction ends, so a concurrent write waits instead of
+    changing them under the delta.
+    """
+    lock_for_write(session)
+    if not ids:
+        return {}
+    rows = session.query(*columns).filter(columns[0].in_(ids)).order_by(columns[0]).with_for_update()
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+
+def write_back(session, obj, key):
+    """Makes the flush write obj's value of key even if it matches what obj was loaded with
+
+    The deltas are computed against the stored value, which a concurrent
+    commit may have changed since obj was loaded. Without this, setting a
+    value back to the loaded one would count as a move but write nothing.
+    """
+    if obj not in session.deleted:
+        flag_modified(obj, key)
+
+
+def lead_step(session, info):
+    """The step the info's lead is on once this flush is done
+    """
+    if info.leadId is None:
+        lead = info.lead
+    else:
+        lead = session.identity_map.get(session.identity_key(Lead, info.leadId))
+        if lead is None:
+            return session.query(Lead.funnelStepId).filter(Lead.id == info.leadId).with_for_update().scalar()
+    if lead is None or lead in session.deleted:
+        return None
+    return lead.funnelStepId
+
+
+def funnel_deltas(session):
+    """Per step changes to FunnelStepStats made by the pending ORM writes
+
+    Old values are read back from the database rather than from attribute
+    history, which does not keep them for attributes set while expired.
+    """
+    deltas = defaultdict(Counter)
+    changed_leads = [lead for lead in [*session.dirty, *session.deleted] if isinstance(lead, Lead)]
+    infos = [info for info in [*session.new, *session.dirty, *session.deleted] if isinstance(info, OpportunityInfo)]
+    old_infos = stored(
+        session,
+        [OpportunityInfo.id, OpportunityInfo.leadId, OpportunityInfo.quotedPrice, OpportunityInfo.finalPrice],
+        [info.id for info in infos if info not in session.new]
+    )
+    old_steps = stored(
+        session,
+        [Lead.id, Lead.funnelStepId],
+        {lead.id for lead in changed_leads} | {lead_id for lead_id, _, _ in old_infos.values()}
+    )
+
+    # lead id -> (old step, new step) of every lead leaving its step
+    moved = {}
+    for lead in session.new:
+        if isinstance(lead, Lead):
+            deltas[lead.funnelStepId]['leadCount'] += 1
+    for lead in changed_leads:
+        old_step, = old_steps.get(lead.id, (None,))
+        new_step = None if lead in session.deleted else lead.funnelStepId
+        if old_step != new_step:
+            deltas[old_step]['leadCount'] -= 1
+            deltas[new_step]['leadCount'] += 1
+            moved[lead.id] = (old_step, new_step)
+            write_back(session, lead, 'funnelStepId')
+
+    # OpportunityInfo rows written in this flush leave their old lead's old
+    # step with their old prices and join their new lead's new step
+    for info in infos:
+        if info.id in old_infos:
+            lead_id, quoted, final = old_infos[info.id]
+            old_step, = old_steps.get(lead_id, (None,))
+            deltas[old_step].subtract(price_stats(quoted, final))
+            for key, old in zip(('leadId', 'quotedPrice', 'finalPrice'), (lead_id, quoted, final)):
+                if getattr(info, key) != old:
+                    write_back(session, info, key)
+        if info not in session.deleted:
+            deltas[lead_step(session, info)].update(price_stats(info.quotedPrice, info.finalPrice))
+
+    # the untouched OpportunityInfo rows of moved leads follow their lead
+    if moved:
+        rows = session.query(OpportunityInfo.leadId, OpportunityInfo.quotedPrice, OpportunityInfo.finalPrice) \
+            .filter(OpportunityInfo.leadId.in_(moved), ~OpportunityInfo.id.in_(old_infos)) \
+            .order_by(OpportunityInfo.id).with_for_update()
+        for lead_id, quoted, final in rows:
+            old_step, new_step = moved[lead_id]
+            stats = price_stats(quoted, final)
+            deltas[old_step].subtract(stats)
+            deltas[new_step].update(stats)
+
+    deltas.pop(None, None)
+    return {step_id: delta for step_id, delta in deltas.items() if any(delta.values())}
+
+
+def apply_funnel_deltas(deltas):
+    """Adds {funnel step id: Counter of stats} to FunnelStepStats in the current transaction
+    """
+    table = FunnelStepStats.__table__
+    for step_id, delta in sorted(deltas.items()):
+        updated = db.session.execute(
+            table.update()
+            .where(table.c.funnelStepId == step_id)
+            .values({table.c[key]: table.c[key] + value for key, value in delta.items() if value})
+        )
+        if updated.rowcount == 0:
+            db.session.execute(table.insert().values(funnelStepId=step_id, **delta))
+    if deltas:
+        touch(STATS_TABLE)
+
+
+@event.listens_for(db.session, 'before_flush')
+def update_funnel_stats(session, flush_context, instances):
+    with session.no_autoflush:
+        deltas = funnel_deltas(session)
+    apply_funnel_deltas(deltas)
+
+# ---------------------------------------------------------------------------- #
+# Rebuild
+# ---------------------------------------------------------------------------- #
+
+def funnel_stats_select():
+    """Every step's stats from one GROUP BY over lead joined to opportunity_info
+    """
+    final_price = numeric_price(OpportunityInfo.finalPrice)
+    return select([
+        Lead.funnelStepId,
+        func.count(distinct(Lead.id)),
+        func.count(OpportunityInfo.quotedPrice),
+        func.coalesce(func.sum(OpportunityInfo.quotedPrice), 0),
+        func.count(final_price),
+        func.coalesce(func.sum(final_price), 0),
+    ]).select_from(
+        Lead.__table__.outerjoin(OpportunityInfo.__table__, OpportunityInfo.leadId == Lead.id)
+    ).where(Lead.funnelStepId != None).group_by(Lead.funnelStepId)
+
+
+def rebuild_funnel_stats():
+    """Recomputes FunnelStepStats from scratch in the current transaction
+
+    For writes that bypass the ORM (bulk loads, COPY) and to repair drift.
+    """
+    table = FunnelStepStats.__table__
+    db.session.execute(table.delete())
+    db.session.execute(table.insert().from_select(
+        ['funnelStepId', *STAT_COLUMNS],
+        funnel_stats_select()
+    ))
+    touch(STATS_TABLE)
+
+# ---------------------------------------------------------------------------- #
+# Reports
+# ---------------------------------------------------------------------------- #
+
+def average(total, count):
+    return round(total / count, 2) if count else None
+
+
+def funnel_stats(opportunity_id):
+    """Per step counts, conversion rates and average prices of an opportunity's funnel
+
+    A lead on a step has been through every earlier step of the funnel, so
+    the leads that reached a step are the ones on it or further down, and
+    a step's conversion rate is the share of those that reached the next.
+    """
+    columns = [func.coalesce(FunnelStepStats.__table__.c[key], 0) for key in STAT_COLUMNS]
+    rows = db.session.query(FunnelStep.id, FunnelStep.name, *columns) \
+        .outerjoin(FunnelStepStats, FunnelStepStats.funnelStepId == FunnelStep.id) \
+        .filter(FunnelStep.opportunityId == opportunity_id) \
+        .order_by(FunnelStep.id).all()
+
+    reached = 0
+    steps = []
+    for step_id, name, lead_count, quoted_count, quoted_total, final_count, final_total in reversed(rows):
+        next_reached = reached
+        reached += lead_count
+        steps.append({
+            'id': step_id,
+            'name': name,
+            'leadCount': lead_count,
+            'reachedCount': reached,
+            'conversionRate': round(next_reached / reached, 4) if reached and steps else None,
+            'averageQuotedPrice': average(quoted_total, quoted_count),
+            'averageFinalPrice': average(final_total, final_count),
+        })
+    steps.reverse()
+    return steps
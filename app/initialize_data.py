@@ -1,75 +1,137 @@
+import csv
+import json
+import os
+from dateutil.parser import isoparse
+from sqlalchemy import Boolean, DateTime, Float, Integer
+
+from .extensions import db
+from .versioning import touch
+from .funnel_stats import rebuild_funnel_stats, SOURCE_TABLES
+from .changes import stamp_rows, stamp_copied_rows, CHANGE_MODELS
 from .models import Lead, Opportunity, OpportunityInfo, FunnelStep, Todo
+from .todo_queue import RANK_GAP
+
+# Rows sent to the database per executemany round-trip
+BATCH_SIZE = 5000
+
+MODELS = {model.__tablename__: model for model in (Lead, Opportunity, OpportunityInfo, FunnelStep, Todo)}
 
 # ---------------------------------------------------------------------------- #
-# Populate Database
+# Bulk Loading
 # ---------------------------------------------------------------------------- #
 
-def addLeadData():
-    for data in leads_default_data:
-        lead = Lead(
-            data["city"],
-            data["state"],
-            data["chanceToConvert"],
-            data["dateCreated"],
-            data["email"],
-            data["funnelStepId"],
-            data["lastContact"],
-            data["name"],
-            data["phone"],
-            data["status"],
-        )
-        lead.insert()
+def coerce_value(column_type, value):
+    """Converts a raw string (CSV cell, ISO date) to the column's python type
+    """
+    if not isinstance(value, str):
+        return value
+    if value == '':
+        return None
+    if isinstance(column_type, DateTime):
+        return isoparse(value)
+    if isinstance(column_type, Boolean):
+        return value.lower() in ('1', 't', 'true')
+    if isinstance(column_type, Float):
+        return float(value)
+    if isinstance(column_type, Integer):
+        return int(value)
+    return value
+
+
+def coerce_row(model, row):
+    columns = model.__mapper__.columns
+    return {key: coerce_value(columns[key].type, value) for key, value in row.items()}
+
+
+def reset_id_sequence(model):
+    """Moves the Postgres id sequence past rows that were loaded with explicit ids
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return
+    table = model.__tablename__
+    db.session.execute(
+        f'''SELECT setval(pg_get_serial_sequence('"{table}"', 'id'), COALESCE(MAX(id), 1)) FROM "{table}"'''
+    )
+
 
+def bulk_insert(model, rows, batch_size=BATCH_SIZE):
+    """Inserts an iterable of row dicts (keyed by attribute name) in one transaction
 
-def addOpportunityData():
-    for data in opportunites_default_data:
-        opportunity = Opportunity(
-            data["name"],
-            data["funnelSteps"],
-        )
-        opportunity.insert()
+    Rows are sent in batches with bulk_insert_mappings, which skips the unit
+    of work and identity map, so memory stays flat for any number of rows.
+    """
+    def insert_batch(batch):
+        if model in CHANGE_MODELS:
+            stamp_rows(model, batch)
+        db.session.bulk_insert_mappings(model, batch)
 
-def addOpportunityInfoData():
-    for data in opportunity_info_default_data:
-        opportunityInfo = OpportunityInfo(
-            data["filingStatus"],
-            data["finalPrice"],
-            data["leadId"],
-            data["occupation"],
-            data["opportunityId"],
-            data["quotedPrice"],
-            data["yearlyIncome"],
-        )
-        opportunityInfo.insert()
+    count = 0
+    batch = []
+    for row in rows:
+        batch.append(coerce_row(model, row))
+        if len(batch) >= batch_size:
+            insert_batch(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        insert_batch(batch)
+        count += len(batch)
+    reset_id_sequence(model)
+    touch(model.__tablename__)
+    if model.__tablename__ in SOURCE_TABLES:
+        rebuild_funnel_stats()
+    db.session.commit()
+    return count
 
-def addTodoData():
-    for data in todos_default_data:
-        todo = Todo(
-            data["completed"],
-            data["datecompleted"],
-            data["dateCreated"],
-            data["description"],
-            data["leadId"],
-            data["priorityRank"],
-        )
-        todo.insert()
-        
-def addFunnelStepData():
-    for data in funnel_step_default_data:
-        funnelStep = FunnelStep(
-            data["name"],
-            data["opportunityId"],
-            data["leads"],
-        )
-        funnelStep.insert()
+
+def copy_csv(model, csv_file):
+    """Loads a CSV file with Postgres COPY, mapping header attribute names to columns
+    """
+    header = next(csv.reader([csv_file.readline()]))
+    columns = ', '.join('"%s"' % model.__mapper__.columns[key].name for key in header)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(f'''COPY "{model.__tablename__}" ({columns}) FROM STDIN WITH CSV''', csv_file)
+    count = cursor.rowcount
+    if model in CHANGE_MODELS:
+        stamp_copied_rows(model)
+    reset_id_sequence(model)
+    touch(model.__tablename__)
+    if model.__tablename__ in SOURCE_TABLES:
+        rebuild_funnel_stats()
+    db.session.commit()
+    return count
+
+
+def read_ndjson(data_file):
+    for line in data_file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def load_file(model, path):
+    """Loads an NDJSON (.ndjson, .jsonl) or CSV (.csv) file into the model's table
+    """
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline='') as data_file:
+        if extension in ('.ndjson', '.jsonl'):
+            return bulk_insert(model, read_ndjson(data_file))
+        if extension == '.csv':
+            if db.engine.dialect.name == 'postgresql':
+                return copy_csv(model, data_file)
+            return bulk_insert(model, csv.DictReader(data_file))
+    raise ValueError(f'Unsupported file type: {path}')
+
+# ---------------------------------------------------------------------------- #
+# Populate Database
+# ---------------------------------------------------------------------------- #
 
 def initialize_data():
     print('****** Initializing Data ******')
-    addOpportunityData()
-    addFunnelStepData()
-    addLeadData()
-    addOpportunityInfoData()
-    addTodoData()
+    bulk_insert(Opportunity, opportunites_default_data)
+    bulk_insert(FunnelStep, funnel_step_default_data)
+    bulk_insert(Lead, leads_default_data)
+    bulk_insert(OpportunityInfo, opportunity_info_default_data)
+    bulk_insert(Todo, todos_default_data)
 
 # ---------------------------------------------------------------------------- #
 # Initial App Data
@@ -236,19 +298,15 @@ leads_default_data = [
 opportunites_default_data = [
     {
         'name': "Individual Tax Return",
-        'funnelSteps': [1,2,3,4,5,6,7]
     },
     {
         'name': "Business Tax Return",
-        'funnelSteps': [8,9,10,11,12,13,14]
     },
     {
         'name': "Accounting",
-        'funnelSteps': [15,16,17,18,19,20,21]
     },
     {
         'name': "Payroll",
-        'funnelSteps': [22,23,24,25,26,27,28]
     },
 ]
 opportunity_info_default_data = [
@@ -376,148 +434,121 @@ funnel_step_default_data= [
     {
         "name": "Initial Inquiry",
         "opportunityId": 1,
-        "leads" : [1, 2],
     },
     {
         "name": "Took Questionnaire",
         "opportunityId": 1,
-        "leads" : [3,4],
     },
     {
         "name": "Scheduled Phone Consult",
         "opportunityId": 1,
-        "leads" : [5],
     },
     {
         "name": "Had a Phone Consult",
         "opportunityId": 1,
-        "leads" : [6],
     },
     {
         "name": "Expressed Interest",
         "opportunityId": 1,
-        "leads" : [],
     },
     {
         "name": "Created Portal Account",
         "opportunityId": 1,
-        "leads" : [],
     },
     {
         "name": "Signed Engagement Letter",
         "opportunityId": 1,
-        "leads" : [],
     },
     # business tax return
     {
         "name": "Initial Inquiry",
         "opportunityId": 2,
-        "leads" : [7,8],
     },
     {
         "name": "Took Questionnaire",
         "opportunityId": 2,
-        "leads" : [9],
     },
     {
         "name": "Scheduled Phone Consult",
         "opportunityId": 2,
-        "leads" : [10],
     },
     {
         "name": "Had a Phone Consult",
         "opportunityId": 2,
-        "leads" : [],
     },
     {
         "name": "Expressed Interest",
         "opportunityId": 2,
-        "leads" : [],
     },
     {
         "name": "Created Portal Account",
         "opportunityId": 2,
-        "leads" : [],
     },
     {
         "name": "Signed Engagement Letter",
         "opportunityId": 2,
-        "leads" : [],
     },
     # accounting
     {
         "name": "Initial Inquiry",
         "opportunityId": 3,
-        "leads" : [11],
     },
     {
         "name": "Took Questionnaire",
         "opportunityId": 3,
-        "leads" : [],
     },
     {
         "name": "Scheduled Phone Consult",
         "opportunityId": 3,
-        "leads" : [],
     },
     {
         "name": "Had a Phone Consult",
         "opportunityId": 3,
-        "leads" : [],
     },
     {
         "name": "Expressed Interest",
         "opportunityId": 3,
-        "leads" : [],
     },
     {
         "name": "Created Portal Account",
         "opportunityId": 3,
-        "leads" : [],
     },
     {
         "name": "Signed Engagement Letter",
         "opportunityId": 3,
-        "leads" : [],
     },
     # payroll
     {
         "name": "Initial Inquiry",
         "opportunityId": 4,
-        "leads" : [12],
     },
     {
         "name": "Took Questionnaire",
         "opportunityId": 4,
-        "leads" : [13],
     },
     {
         "name": "Scheduled Phone Consult",
         "opportunityId": 4,
-        "leads" : [],
     },
     {
         "name": "Had a Phone Consult",
         "opportunityId": 4,
-        "leads" : [],
     },
     {
         "name": "Expressed Interest",
         "opportunityId": 4,
-        "leads" : [],
     },
     {
         "name": "Created Portal Account",
         "opportunityId": 4,
-        "leads" : [],
     },
     {
         "name": "Signed Engagement Letter",
         "opportunityId": 4,
-        "leads" : [],
     },
 ]
 
+# ranks RANK_GAP apart, as rebalance_ranks() leaves them, so moves fit in between
 todos_default_data = [
     {
       "completed": False,
@@ -525,7 +556,7 @@ todos_default_data = [
       "dateCreated": "2021-02-26T15:32:37.843Z",
       "description": "Send email",
       "leadId": 1,
-      "priorityRank": 1,
+      "priorityRank": 1 * RANK_GAP,
     },
     {
       "completed": False,
@@ -533,7 +564,7 @@ todos_default_data = [
       "dateCreated": "2021-02-26T15:32:37.843Z",
       "description": "Send email",
       "leadId": 2,
-      "priorityRank": 2,
+      "priorityRank": 2 * RANK_GAP,
     },
     {
       "completed": False,
@@ -541,7 +572,7 @@ todos_default_data = [
       "dateCreated": "2021-02-26T15:32:37.843Z",
       "description": "Send email",
       "leadId": 3,
-      "priorityRank": 3,
+      "priorityRank": 3 * RANK_GAP,
     },
     {
       "completed": False,
@@ -549,7 +580,7 @@ todos_default_data = [
       "dateCreated": "2021-02-26T15:32:37.843Z",
       "description": "Send email",
       "leadId": 4,
-      "priorityRank": 4,
+      "priorityRank": 4 * RANK_GAP,
     },
     {
       "completed": False,
@@ -557,7 +588,7 @@ todos_default_data = [
       "dateCreated": "2021-02-26T15:32:37.843Z",
       "description": "Send email",
       "leadId": 5,
-      "priorityRank": 5,
+      "priorityRank": 5 * RANK_GAP,
     },
     {
       "completed": False,
@@ -565,7 +596,7 @@ todos_default_data = [
       "dateCreated": "2021-02-26T15:32:37.843Z",
       "description": "Send email",
       "leadId": 6,
-      "priorityRank": 6,
+      "priorityRank": 6 * RANK_GAP,
     },
     {
       "completed": False,
@@ -573,7 +604,7 @@ todos_default_data = [
       "dateCreated": "2021-02-26T15:32:37.843Z",
       "description": "Send email",
       "leadId": 7,
-      "priorityRank": 7,
+      "priorityRank": 7 * RANK_GAP,
     },
     {
       "completed": False,
@@ -581,7 +612,7 @@ todos_default_data = [
       "dateCreated": "2021-02-26T15:32:37.843Z",
       "description": "Send email",
       "leadId": 8,
-      "priorityRank": 8,
+      "priorityRank": 8 * RANK_GAP,
     },
     {
       "completed": False,
@@ -589,7 +620,7 @@ todos_default_data = [
       "dateCreated": "2021-02-26T15:32:37.843Z",
       "description": "Send email",
       "leadId": 9,
-      "priorityRank": 9,
+      "priorityRank": 9 * RANK_GAP,
     },
     {
       "completed": False,
@@ -597,7 +628,7 @@ todos_default_data = [
       "dateCreated": "2021-02-26T15:32:37.843Z",
       "description": "Send email",
       "leadId": 10,
-      "priorityRank": 10,
+      "priorityRank": 10 * RANK_GAP,
     },
     {
       "completed": False,
@@ -605,7 +636,7 @@ todos_default_data = [
       "dateCreated": "2021-02-26T15:32:37.843Z",
       "description": "Send email",
       "leadId": 11,
-      "priorityRank": 11,
+      "priorityRank": 11 * RANK_GAP,
     },
     {
       "completed": False,
@@ -613,7 +644,7 @@ todos_default_data = [
       "dateCreated": "2021-02-26T15:32:37.843Z",
       "description": "Send email",
       "leadId": 12,
-      "priorityRank": 12,
+      "priorityRank": 12 * RANK_GAP,
     },
     {
       "completed": False,
@@ -621,6 +652,6 @@ todos_default_data = [
       "dateCreated": "2021-02-26T15:32:37.843Z",
       "description": "Send email",
       "leadId": 13,
-      "priorityRank": 13,
+      "priorityRank": 13 * RANK_GAP,
     },
 ]
\ No newline at end of file
@@ -0,0 +1,98 @@
+import datetime
+from flask import current_app, json
+from flask.json import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# ---------------------------------------------------------------------------- #
+# JSON Backend
+# ---------------------------------------------------------------------------- #
+
+'''
+Response bodies are encoded by orjson when it is installed and by the
+stdlib json module otherwise. Both write datetimes as ISO-8601, accept the
+int keys of byId and write non-ASCII text as raw UTF-8 (ensure_ascii off),
+so the two produce the same bytes. JSON_BACKEND picks one explicitly.
+'''
+
+
+class ISOJSONEncoder(JSONEncoder):
+    """Flask's encoder with dates as ISO-8601 instead of HTTP dates
+    """
+
+    def default(self, o):
+        if isinstance(o, (datetime.date, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+class StdlibBackend:
+    name = 'stdlib'
+
+    def __init__(self, sort_keys):
+        self.sort_keys = sort_keys
+
+    def dumps(self, data, pretty=False):
+        options = dict(cls=ISOJSONEncoder, sort_keys=self.sort_keys, ensure_ascii=False)
+        if pretty:
+            text = json.dumps(data, indent=2, **options)
+        else:
+            text = json.dumps(data, separators=(',', ':'), **options)
+        return text.encode()
+
+
+class OrjsonBackend:
+    name = 'orjson'
+
+    def __init__(self, sort_keys):
+        self.option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        # types orjson does not know natively (Decimal, uuid, ...) go through Flask's encoder
+        self.default = ISOJSONEncoder().default
+
+    def dumps(self, data, pretty=False):
+        option = self.option | (orjson.OPT_INDENT_2 if pretty else 0)
+        return orjson.dumps(data, default=self.default, option=option)
+
+
+def make_backend(name, sort_keys=False):
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'stdlib'
+    if name == 'orjson':
+        if orjson is None:
+            raise RuntimeError('JSON_BACKEND is orjson but orjson is not installed.')
+        return OrjsonBackend(sort_keys)
+    return StdlibBackend(sort_keys)
+
+
+class JSONBackend:
+    """Encodes response bodies with the backend configured by init_app
+    """
+
+    def __init__(self):
+        self.backend = StdlibBackend(sort_keys=False)
+
+    def init_app(self, app):
+        app.json_encoder = ISOJSONEncoder
+        self.backend = make_backend(app.config['JSON_BACKEND'], app.config['JSON_SORT_KEYS'])
+
+    @property
+    def name(self):
+        return self.backend.name
+
+    def dumps(self, data):
+        return self.backend.dumps(data)
+
+    def response(self, data):
+        """A jsonify equivalent, pretty printed only when Flask would
+        """
+        pretty = current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] or current_app.debug
+        return current_app.response_class(
+            self.backend.dumps(data, pretty) + b'\n',
+            mimetype=current_app.config['JSONIFY_MIMETYPE'],
+        )
+
+
+json_backend = JSONBackend()
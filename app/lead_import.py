@@ -0,0 +1,168 @@
+import csv
+import json
+from collections import Counter
+from datetime import datetime
+
+from .extensions import db
+from .models import Lead, FunnelStep
+from .versioning import touch
+from .funnel_stats import apply_funnel_deltas
+from .changes import stamp_rows
+
+# ---------------------------------------------------------------------------- #
+# Bulk Lead Import
+# ---------------------------------------------------------------------------- #
+
+BATCH_SIZE = 1000
+# Rows past this many failures are counted but not described
+MAX_REPORTED_ERRORS = 1000
+
+CSV_CONTENT_TYPES = ('text/csv',)
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+REQUIRED_FIELDS = ('name', 'funnelStepId')
+OPTIONAL_FIELDS = ('city', 'state', 'email', 'phone')
+
+
+def decode_lines(lines, invalid):
+    """Decodes raw body lines as UTF-8
+
+    A line that is not valid UTF-8 is decoded with replacement characters
+    and counted in invalid[0], so the row that contains it can be rejected.
+    """
+    for line in lines:
+        try:
+            yield line.decode('utf-8')
+        except UnicodeDecodeError:
+            invalid[0] += 1
+            yield line.decode('utf-8', 'replace')
+
+
+def read_rows(lines, content_type):
+    """Yields (row, error) pairs from an iterator of raw body lines
+    """
+    invalid = [0]
+    text_lines = decode_lines(lines, invalid)
+    if content_type in CSV_CONTENT_TYPES:
+        reader = csv.DictReader(text_lines)
+        # a broken header shows up as missing fields, not as a broken first row
+        reader.fieldnames
+        invalid[0] = 0
+        for row in reader:
+            if invalid[0]:
+                invalid[0] = 0
+                yield None, 'Row is not valid UTF-8.'
+                continue
+            yield row, None
+    else:
+        for line in text_lines:
+            if invalid[0]:
+                invalid[0] = 0
+                yield None, 'Row is not valid UTF-8.'
+                continue
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield None, 'Malformed JSON.'
+                continue
+            if not isinstance(row, dict):
+                yield None, 'Each line must be a JSON object.'
+                continue
+            yield row, None
+
+
+def validate_row(row, funnel_step_ids):
+    """Returns (lead row, []) for a valid row and (None, errors) otherwise
+    """
+    errors = []
+    for field in REQUIRED_FIELDS:
+        if row.get(field) in (None, ''):
+            errors.append(f'{field} is required.')
+    for field in ('name', *OPTIONAL_FIELDS):
+        if row.get(field) not in (None, '') and not isinstance(row[field], str):
+            errors.append(f'{field} must be a string.')
+
+    funnel_step_id = row.get('funnelStepId')
+    if funnel_step_id not in (None, ''):
+        try:
+            funnel_step_id = int(funnel_step_id)
+        except (TypeError, ValueError):
+            errors.append('funnelStepId must be an integer.')
+        else:
+            if funnel_step_id not in funnel_step_ids:
+                errors.append(f'Funnel step {funnel_step_id} does not exist.')
+
+    email = row.get('email') or None
+    if isinstance(email, str) and '@' not in email:
+        errors.append('email is not a valid email address.')
+
+    if errors:
+        return None, errors
+
+    now = datetime.now()
+    lead = {field: row.get(field) or None for field in OPTIONAL_FIELDS}
+    lead.update(
+        name=row['name'],
+        funnelStepId=funnel_step_id,
+        chanceToConvert=0.15,
+        dateCreated=now,
+        lastContact=now,
+        status='Follow Up',
+    )
+    return lead, []
+
+
+def flush_batch(leads):
+    """Inserts a batch of leads in one transaction
+
+    On Postgres the batch goes out as a single multi-row INSERT. New leads
+    have no OpportunityInfo yet, so they only add to their steps' lead counts.
+    """
+    table = Lead.__table__
+    stamp_rows(Lead, leads)
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(table.insert().values(leads))
+    else:
+        db.session.execute(table.insert(), leads)
+    touch(Lead.__tablename__)
+    lead_counts = Counter(lead['funnelStepId'] for lead in leads)
+    apply_funnel_deltas({step_id: Counter(leadCount=count) for step_id, count in lead_counts.items()})
+    db.session.commit()
+    return len(leads)
+
+
+def import_leads(lines, content_type):
+    """Validates and inserts leads from a streamed CSV or NDJSON body
+
+    Rows are inserted in BATCH_SIZE transactions as they are read, so the
+    body is never buffered. Returns the number of inserted leads and a
+    report of the rows that were rejected (1-based, header excluded).
+    """
+    funnel_step_ids = {step_id for (step_id,) in db.session.query(FunnelStep.id)}
+    inserted = 0
+    failed = 0
+    errors = []
+    batch = []
+
+    for row_number, (row, read_error) in enumerate(read_rows(lines, content_type), start=1):
+        lead, row_errors = (None, [read_error]) if read_error else validate_row(row, funnel_step_ids)
+        if row_errors:
+            failed += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({'row': row_number, 'errors': row_errors})
+            continue
+        batch.append(lead)
+        if len(batch) >= BATCH_SIZE:
+            inserted += flush_batch(batch)
+            batch = []
+    if batch:
+        inserted += flush_batch(batch)
+
+    return {
+        'inserted': inserted,
+        'failed': failed,
+        'errors': errors,
+        'errorsTruncated': failed > len(errors),
+    }
@@ -0,0 +1,196 @@
+from datetime import datetime
+import numpy as np
+from sqlalchemy import and_, bindparam, case, func, select, text, String
+
+from .extensions import db
+from .models import Lead, FunnelStep, OpportunityInfo, Todo
+from .versioning import touch
+from .changes import number_at_commit
+
+# ---------------------------------------------------------------------------- #
+# Lead Scoring
+# ---------------------------------------------------------------------------- #
+
+'''
+Weights of the logistic model behind Lead.chanceToConvert
+    stepProgress     how far down its opportunity's funnel the lead is, 0 to 1
+    recency          exp(-days since last contact / RECENCY_DAYS)
+    openTodos        open todos, capped at 5 and scaled to 0 to 1
+    completedRatio   share of the lead's todos that are done
+    quoted           the lead has been quoted a price
+    finalPrice       the lead has a final price
+'''
+
+INTERCEPT = -2.5
+WEIGHTS = {
+    'stepProgress': 2.5,
+    'recency': 1.0,
+    'openTodos': 0.3,
+    'completedRatio': 0.8,
+    'quoted': 0.4,
+    'finalPrice': 2.0,
+}
+STATUS_WEIGHTS = {
+    'Hot Lead': 1.0,
+    'With Client': 0.6,
+    'Follow Up': 0.0,
+    'Automated': -0.3,
+    'On Hold': -1.0,
+}
+RECENCY_DAYS = 30.0
+
+
+def step_progress_lookup():
+    """An array indexed by funnel step id with the step's progress through its funnel
+    """
+    steps = db.session.execute(
+        select([FunnelStep.id, FunnelStep.opportunityId]).order_by(FunnelStep.opportunityId, FunnelStep.id)
+    ).fetchall()
+    if not steps:
+        return np.zeros(1)
+    step_ids = np.array([step_id for step_id, _ in steps])
+    opportunity_ids = np.array([opportunity_id or 0 for _, opportunity_id in steps])
+
+    # position of every step within its opportunity, steps are sorted by opportunity
+    starts = np.r_[0, np.flatnonzero(np.diff(opportunity_ids)) + 1]
+    sizes = np.diff(np.r_[starts, len(steps)])
+    positions = np.arange(len(steps)) - np.repeat(starts, sizes)
+    last_positions = np.repeat(sizes - 1, sizes)
+
+    lookup = np.zeros(step_ids.max() + 1)
+    lookup[step_ids] = np.divide(positions, last_positions, out=np.zeros(len(steps)), where=last_positions > 0)
+    return lookup
+
+
+def scatter(lead_ids, rows, columns):
+    """Spreads per-lead aggregate rows (leadId, *values) onto the lead_ids order
+    """
+    arrays = [np.zeros(len(lead_ids)) for _ in range(columns)]
+    if not rows:
+        return arrays
+    keys = np.array([row[0] for row in rows])
+    positions = np.searchsorted(lead_ids, keys)
+    found = (positions < len(lead_ids)) & (lead_ids[np.minimum(positions, len(lead_ids) - 1)] == keys)
+    for column, array in enumerate(arrays, start=1):
+        values = np.array([row[column] or 0 for row in rows], dtype=float)
+        array[positions[found]] = values[found]
+    return arrays
+
+
+def count_filled(column):
+    """Counts the non-NULL values of a column, leaving out empty strings of a string column
+    """
+    filled = column != None
+    if isinstance(column.type, String):
+        filled = and_(filled, column != '')
+    return func.sum(case([(filled, 1)], else_=0))
+
+
+def load_features(now):
+    """Loads every lead's features into columnar arrays, ordered by lead id
+
+    Todo and OpportunityInfo features are aggregated per lead in SQL, so the
+    python side only ever sees one row per lead per table.
+    """
+    leads = db.session.execute(
+        select([Lead.id, Lead.funnelStepId, Lead.lastContact, Lead.status]).order_by(Lead.id)
+    ).fetchall()
+    if not leads:
+        return np.zeros(0, dtype=int), {}
+    lead_ids, funnel_step_ids, last_contacts, statuses = (np.array(column) for column in zip(*leads))
+    lead_ids = lead_ids.astype(int)
+
+    progress = step_progress_lookup()
+    funnel_step_ids = np.array([step_id or 0 for step_id in funnel_step_ids])
+    funnel_step_ids[funnel_step_ids >= len(progress)] = 0
+
+    last_contacts = last_contacts.astype('datetime64[s]')
+    days_since_contact = (np.datetime64(now, 's') - last_contacts) / np.timedelta64(1, 'D')
+    recency = np.exp(-np.nan_to_num(np.maximum(days_since_contact, 0), nan=np.inf) / RECENCY_DAYS)
+
+    todo_rows = db.session.execute(
+        select([
+            Todo.leadId,
+            func.sum(case([(Todo.completed == False, 1)], else_=0)),
+            func.sum(case([(Todo.completed == True, 1)], else_=0)),
+        ]).group_by(Todo.leadId)
+    ).fetchall()
+    open_todos, completed_todos = scatter(lead_ids, todo_rows, 2)
+    total_todos = open_todos + completed_todos
+
+    info_rows = db.session.execute(
+        select([
+            OpportunityInfo.leadId,
+            count_filled(OpportunityInfo.quotedPrice),
+            count_filled(OpportunityInfo.finalPrice),
+        ]).group_by(OpportunityInfo.leadId)
+    ).fetchall()
+    quoted, final_price = scatter(lead_ids, info_rows, 2)
+
+    status_names, status_codes = np.unique(statuses.astype(str), return_inverse=True)
+    status_weights = np.array([STATUS_WEIGHTS.get(name, 0.0) for name in status_names])
+
+    return lead_ids, {
+        'stepProgress': progress[funnel_step_ids],
+        'recency': recency,
+        'openTodos': np.minimum(open_todos, 5) / 5,
+        'completedRatio': np.divide(completed_todos, total_todos, out=np.zeros(len(lead_ids)), where=total_todos > 0),
+        'quoted': (quoted > 0).astype(float),
+        'finalPrice': (final_price > 0).astype(float),
+        'status': status_weights[status_codes.ravel()],
+    }
+
+
+def score(features):
+    """Scores every lead in one vectorized pass
+    """
+    logits = INTERCEPT + features['status']
+    for name, weight in WEIGHTS.items():
+        logits = logits + weight * features[name]
+    return np.round(1 / (1 + np.exp(-logits)), 4)
+
+
+def stored_scores(lead_ids):
+    """The chanceToConvert every lead has now, in lead_ids order (0 where unset)
+    """
+    rows = db.session.execute(select([Lead.id, Lead.chanceToConvert])).fetchall()
+    scores, = scatter(lead_ids, rows, 1)
+    return scores
+
+
+def write_scores(lead_ids, scores):
+    """Writes the scores back with a single UPDATE on Postgres, the leads are numbered for /changes at commit
+    """
+    now = datetime.now()
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text('''
+            UPDATE lead SET "chanceToConvert" = scored.score, "changeSeq" = NULL, "updatedAt" = :now
+            FROM unnest(CAST(:ids AS integer[]), CAST(:scores AS double precision[])) AS scored(id, score)
+            WHERE lead.id = scored.id
+        '''), {'ids': lead_ids.tolist(), 'scores': scores.tolist(), 'now': now})
+    else:
+        table = Lead.__table__
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('lead_id'))
+            .values(chanceToConvert=bindparam('score'), changeSeq=None, updatedAt=now),
+            [{'lead_id': lead_id, 'score': value} for lead_id, value in zip(lead_ids.tolist(), scores.tolist())]
+        )
+    number_at_commit(Lead.__tablename__)
+    touch(Lead.__tablename__)
+    db.session.commit()
+
+
+def score_leads(now=None):
+    """Recomputes chanceToConvert for every lead, returns the number of leads scored
+
+    Only the scores that changed are written, so /changes clients don't
+    reload every lead after each run.
+    """
+    lead_ids, features = load_features(now or datetime.now())
+    if not len(lead_ids):
+        return 0
+    scores = score(features)
+    changed = scores != stored_scores(lead_ids)
+    if changed.any():
+        write_scores(lead_ids[changed], scores[changed])
+    return len(lead_ids)
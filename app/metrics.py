@@ -0,0 +1,228 @@
+import threading
+import time
+from bisect import bisect_left
+from flask import g, request, current_app, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+
+from .extensions import db
+
+# ---------------------------------------------------------------------------- #
+# Metrics
+# ---------------------------------------------------------------------------- #
+
+'''
+Counters, gauges and histograms kept in process and rendered in the
+Prometheus text format by GET /metrics. Every worker process keeps its own
+values, so scrape each worker or run a single one behind the scraper.
+'''
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            values = sorted(self.values.items())
+        for labels, value in values:
+            lines.append(f'{self.name}{format_labels(self.labels, labels)} {value}')
+        return lines
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, labels=(), value=0):
+        with self._lock:
+            self.values[labels] = value
+
+
+class Histogram(Metric):
+    """Bucket counts plus the sum and count of every observed value, per label set
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self.values.get(labels)
+            if series is None:
+                # one count per bucket, one for +Inf, then sum and count
+                series = self.values[labels] = [0] * (len(self.buckets) + 1) + [0, 0]
+            series[bisect_left(self.buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            values = sorted((labels, list(series)) for labels, series in self.values.items())
+        for labels, series in values:
+            cumulative = 0
+            for bound, count in zip([*self.buckets, '+Inf'], series):
+                cumulative += count
+                bucket_labels = format_labels([*self.labels, 'le'], [*labels, bound])
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.labels, labels)} {series[-2]}')
+            lines.append(f'{self.name}_count{format_labels(self.labels, labels)} {series[-1]}')
+        return lines
+
+
+class Metrics:
+    """Request, SQL and connection pool instrumentation for the app
+
+    Requests are labelled with their url rule (/leads/<int:lead_id>), not
+    the raw path, so the number of series stays bounded. Streamed responses
+    are timed to their first byte and have no recorded size.
+    """
+
+    def __init__(self):
+        route_labels = ('method', 'route', 'status')
+        self.requests = Counter('http_requests_total', 'Requests served.', route_labels)
+        self.latency = Histogram('http_request_duration_seconds', 'Request latency.', route_labels)
+        self.in_flight = Gauge('http_requests_in_flight', 'Requests being served.')
+        self.response_size = Histogram(
+            'http_response_size_bytes', 'Response body size.', ('method', 'route'), SIZE_BUCKETS)
+        self.request_queries = Histogram(
+            'http_request_sql_queries', 'SQL queries issued per request.', ('method', 'route'), QUERY_COUNT_BUCKETS)
+        self.request_db_time = Histogram(
+            'http_request_sql_duration_seconds', 'Time spent in SQL per request.', ('method', 'route'))
+        self.queries = Counter('sql_queries_total', 'SQL statements executed.')
+        self.query_time = Counter('sql_query_duration_seconds_total', 'Time spent executing SQL statements.')
+        self.pool_events = Counter('db_pool_events_total', 'Connection pool events.', ('event',))
+        self.pool_checkout_time = Histogram(
+            'db_pool_checkout_duration_seconds', 'Time connections stay checked out of the pool.')
+        self.pool_status = Gauge('db_pool_connections', 'Connections of the pool by state.', ('state',))
+        self.listening = False
+
+    def init_app(self, app):
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        app.teardown_request(self.teardown_request)
+
+        if self.listening:
+            return
+        self.listening = True
+        # class level listeners, so they cover the engine Flask-SQLAlchemy creates lazily
+        event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+        event.listen(Pool, 'connect', self.pool_connect)
+        event.listen(Pool, 'checkout', self.pool_checkout)
+        event.listen(Pool, 'checkin', self.pool_checkin)
+
+    # ---- Requests ---- #
+
+    def start_request(self):
+        g.metrics_start = time.perf_counter()
+        g.sql_queries = 0
+        g.sql_seconds = 0.0
+        g.metrics_in_flight = True
+        self.in_flight.inc((), 1)
+
+    def finish_request(self, response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        self.requests.inc((request.method, route, response.status_code))
+        self.latency.observe((request.method, route, response.status_code), time.perf_counter() - start)
+        if not response.is_streamed:
+            self.response_size.observe((request.method, route), response.calculate_content_length() or 0)
+        self.request_queries.observe((request.method, route), g.sql_queries)
+        self.request_db_time.observe((request.method, route), g.sql_seconds)
+        return response
+
+    def teardown_request(self, exception):
+        if g.pop('metrics_in_flight', False):
+            self.in_flight.inc((), -1)
+
+    # ---- SQL ---- #
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('metrics_query_start')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        self.queries.inc()
+        self.query_time.inc((), elapsed)
+        if has_request_context() and 'sql_queries' in g:
+            g.sql_queries += 1
+            g.sql_seconds += elapsed
+
+    # ---- Connection Pool ---- #
+
+    def pool_connect(self, dbapi_connection, connection_record):
+        self.pool_events.inc(('connect',))
+
+    def pool_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        connection_record.info['metrics_checkout_start'] = time.perf_counter()
+        self.pool_events.inc(('checkout',))
+
+    def pool_checkin(self, dbapi_connection, connection_record):
+        start = connection_record.info.pop('metrics_checkout_start', None)
+        if start is not None:
+            self.pool_checkout_time.observe((), time.perf_counter() - start)
+        self.pool_events.inc(('checkin',))
+
+    def read_pool_status(self):
+        """Current pool occupancy, for pools that size themselves (QueuePool)
+        """
+        pool = db.get_engine(current_app).pool
+        for state, method in (('size', 'size'), ('checked_out', 'checkedout'), ('overflow', 'overflow')):
+            if hasattr(pool, method):
+                self.pool_status.set((state,), getattr(pool, method)())
+
+    def render(self):
+        self.read_pool_status()
+        metrics = [
+            self.requests, self.latency, self.in_flight, self.response_size,
+            self.request_queries, self.request_db_time, self.queries, self.query_time,
+            self.pool_events, self.pool_checkout_time, self.pool_status,
+        ]
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+app_metrics = Metrics()
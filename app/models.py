@@ -1,9 +1,33 @@
-from sqlalchemy import Column, ARRAY, String, Integer, Boolean, DateTime, Float, create_engine, ForeignKey
+from sqlalchemy import Column, String, Integer, BigInteger, Boolean, DateTime, Float, Index, create_engine, ForeignKey, DDL, event, literal_column
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import relationship
+from sqlalchemy.schema import CreateIndex
 
 from .extensions import db
 
 
+# ---------------------------------------------------------------------------- #
+# Postgres only indexes
+# ---------------------------------------------------------------------------- #
+
+'''
+Indexes declared with info={'dialect': 'postgresql'} (the trigram indexes
+of lead search) are created on Postgres only. Elsewhere their CREATE INDEX
+compiles to a no-op, since SQLite has neither GIN nor regexp_replace.
+'''
+
+
+@compiles(CreateIndex)
+def create_dialect_index(create, compiler, **kw):
+    dialect = create.element.info.get('dialect')
+    if dialect is not None and dialect != compiler.dialect.name:
+        return '-- %s only: %s' % (dialect, create.element.name)
+    return compiler.visit_create_index(create, **kw)
+
+
+PHONE_DIGITS = r"regexp_replace(phone, '\D', '', 'g')"
+
+
 '''
 Leads
 
@@ -18,15 +42,31 @@ class Lead(db.Model):
     chanceToConvert = Column(Float)
     dateCreated = Column(DateTime)
     email = Column(String, nullable=True)
-    funnelStepId = Column(Integer, ForeignKey('funnelStep.id'))
+    funnelStepId = Column(Integer, ForeignKey('funnelStep.id'), index=True)
     lastContact = Column(DateTime)
     name = Column(String)
     phone = Column(String)
-    status = Column(String, nullable=True)
+    status = Column(String, nullable=True, index=True)
+    updatedAt = Column(DateTime)
+    # position in the /changes feed, reassigned on every write (see changes.py)
+    changeSeq = Column(BigInteger, index=True)
 
     funnelStep = relationship("FunnelStep", back_populates="lead")
     opportunityInfo = relationship("OpportunityInfo", back_populates="lead")
     todo = relationship("Todo", back_populates="lead")
+
+    __table_args__ = (
+        # the expressions search.search_postgres filters on, see the lead search migration
+        Index('ix_lead_name_trgm', literal_column('lower(name)'), postgresql_using='gin',
+              postgresql_ops={'lower(name)': 'gin_trgm_ops'}, info={'dialect': 'postgresql'}),
+        Index('ix_lead_email_trgm', literal_column('lower(email)'), postgresql_using='gin',
+              postgresql_ops={'lower(email)': 'gin_trgm_ops'}, info={'dialect': 'postgresql'}),
+        Index('ix_lead_city_trgm', literal_column('lower(city)'), postgresql_using='gin',
+              postgresql_ops={'lower(city)': 'gin_trgm_ops'}, info={'dialect': 'postgresql'}),
+        Index('ix_lead_state_lower', literal_column('lower(state)'), info={'dialect': 'postgresql'}),
+        Index('ix_lead_phone_digits_trgm', literal_column(PHONE_DIGITS), postgresql_using='gin',
+              postgresql_ops={PHONE_DIGITS: 'gin_trgm_ops'}, info={'dialect': 'postgresql'}),
+    )
     
     
     def __init__(
@@ -76,10 +116,18 @@ class Lead(db.Model):
             'lastContact': self.lastContact,
             'name': self.name,
             'phone': self.phone,
-            'status': self.status
+            'status': self.status,
+            'updatedAt': self.updatedAt,
+            'changeSeq': self.changeSeq,
         }
 
 
+# gin_trgm_ops comes from the pg_trgm extension
+event.listen(
+    Lead.__table__, 'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+
+
 '''
 Opportunities
 
@@ -89,19 +137,26 @@ class Opportunity(db.Model):
     __tablename__ = 'opportunity'
 
     id = Column(Integer, primary_key=True)
-    funnelSteps = Column("data", ARRAY(Integer), nullable=True)
     name = Column(String)
+    updatedAt = Column(DateTime)
+    # position in the /changes feed, reassigned on every write (see changes.py)
+    changeSeq = Column(BigInteger, index=True)
     
-    funnelStep = relationship("FunnelStep", back_populates="opportunity")
+    funnelStep = relationship("FunnelStep", back_populates="opportunity", order_by="FunnelStep.id")
     opportunityInfo = relationship("OpportunityInfo", back_populates="opportunity")
 
+    # API fields served from a relationship instead of a column
+    derived_fields = {'funnelSteps': 'funnelStep'}
+
     def __init__(
         self,
         name,
-        funnelSteps
     ):
         self.name = name
-        self.funnelSteps = funnelSteps
+
+    @property
+    def funnelSteps(self):
+        return [funnel_step.id for funnel_step in self.funnelStep]
 
     def insert(self):
         db.session.add(self)
@@ -118,6 +173,8 @@ class Opportunity(db.Model):
         return {
             'id': self.id,
             'name': self.name,
+            'updatedAt': self.updatedAt,
+            'changeSeq': self.changeSeq,
             'funnelSteps': self.funnelSteps,
         }
         
@@ -137,11 +194,14 @@ class OpportunityInfo(db.Model):
     id = Column(Integer, primary_key=True)
     filingStatus = Column(String)
     finalPrice = Column(String, nullable=True)
-    leadId = Column(Integer, ForeignKey('lead.id'))
+    leadId = Column(Integer, ForeignKey('lead.id'), index=True)
     occupation = Column(String, nullable=True)
-    opportunityId = Column(Integer, ForeignKey('opportunity.id'))
+    opportunityId = Column(Integer, ForeignKey('opportunity.id'), index=True)
     quotedPrice = Column(Float, nullable=True)
     yearlyIncome = Column(String, nullable=True)
+    updatedAt = Column(DateTime)
+    # position in the /changes feed, reassigned on every write (see changes.py)
+    changeSeq = Column(BigInteger, index=True)
 
     lead = relationship("Lead", back_populates="opportunityInfo")
     opportunity = relationship("Opportunity", back_populates="opportunityInfo")
@@ -185,6 +245,8 @@ class OpportunityInfo(db.Model):
             'opportunityId': self.opportunityId,
             'quotedPrice': self.quotedPrice,
             'yearlyIncome': self.yearlyIncome,
+            'updatedAt': self.updatedAt,
+            'changeSeq': self.changeSeq,
         }
         
         
@@ -197,22 +259,29 @@ class FunnelStep(db.Model):
     __tablename__ = 'funnelStep'
 
     id = Column(Integer, primary_key=True)
-    leads = Column("data", ARRAY(Integer), nullable=True)
     name = Column(String)
-    opportunityId = Column(Integer, ForeignKey('opportunity.id'))
+    opportunityId = Column(Integer, ForeignKey('opportunity.id'), index=True)
+    updatedAt = Column(DateTime)
+    # position in the /changes feed, reassigned on every write (see changes.py)
+    changeSeq = Column(BigInteger, index=True)
 
-    lead = relationship("Lead", back_populates="funnelStep")
+    lead = relationship("Lead", back_populates="funnelStep", order_by="Lead.id")
     opportunity = relationship("Opportunity", back_populates="funnelStep")
+
+    # API fields served from a relationship instead of a column
+    derived_fields = {'leads': 'lead'}
     
     def __init__(
         self,
         name,
         opportunityId,
-        leads
     ):
         self.name = name
         self.opportunityId = opportunityId
-        self.leads = leads
+
+    @property
+    def leads(self):
+        return [lead.id for lead in self.lead]
 
     def insert(self):
         db.session.add(self)
@@ -228,9 +297,11 @@ class FunnelStep(db.Model):
     def format(self):
         return {
             'id': self.id,
-            'leads' : self.leads,
             'name': self.name,
-            'opportunityId' : self.opportunityId,
+            'opportunityId': self.opportunityId,
+            'updatedAt': self.updatedAt,
+            'changeSeq': self.changeSeq,
+            'leads': self.leads,
         }
 
 '''
@@ -246,11 +317,20 @@ class Todo(db.Model):
     datecompleted = Column(String, nullable=True)
     dateCreated = Column(String)
     description = Column(String)
-    leadId = Column(Integer, ForeignKey('lead.id'))
-    priorityRank = Column(Integer)
+    leadId = Column(Integer, ForeignKey('lead.id'), index=True)
+    # gap-spaced (see todo_queue.py), so moving a todo rewrites only its own rank
+    priorityRank = Column(BigInteger, index=True)
+    updatedAt = Column(DateTime)
+    # position in the /changes feed, reassigned on every write (see changes.py)
+    changeSeq = Column(BigInteger, index=True)
     
     lead = relationship("Lead", back_populates="todo")
 
+    __table_args__ = (
+        # open todos in priority order (ties by id), for GET /todos/next
+        Index('ix_todo_completed_priorityRank_id', 'completed', 'priorityRank', 'id'),
+    )
+
     def __init__(
         self,
         completed,
@@ -287,5 +367,77 @@ class Todo(db.Model):
             'description': self.description,
             'leadId': self.leadId,
             'priorityRank': self.priorityRank,
+            'updatedAt': self.updatedAt,
+            'changeSeq': self.changeSeq,
         }
-        
\ No newline at end of file
+
+
+'''
+Funnel Step Stats
+
+'''
+
+# Lead counts and price totals per funnel step, kept current in the same
+# transaction as every lead and opportunity info write (see funnel_stats.py)
+# so funnel analytics never scan the lead table.
+class FunnelStepStats(db.Model):
+    __tablename__ = 'funnel_step_stats'
+
+    funnelStepId = Column(Integer, ForeignKey('funnelStep.id', ondelete='CASCADE'), primary_key=True)
+    leadCount = Column(Integer, nullable=False, default=0)
+    quotedCount = Column(Integer, nullable=False, default=0)
+    quotedTotal = Column(Float, nullable=False, default=0)
+    finalCount = Column(Integer, nullable=False, default=0)
+    finalTotal = Column(Float, nullable=False, default=0)
+
+
+'''
+Table Versions
+
+'''
+
+# One row per table, bumped in the same transaction as every write to that
+# table (see versioning.py). Read routes derive their ETags from it.
+class TableVersion(db.Model):
+    __tablename__ = 'table_version'
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+    def __init__(self, name, version=0):
+        self.name = name
+        self.version = version
+
+
+'''
+Changes
+
+'''
+
+# The last change sequence number handed out, a single row (id 1). Writers
+# reserve numbers by incrementing it, and its row lock makes the numbers
+# increase in commit order (see changes.py).
+class ChangeCounter(db.Model):
+    __tablename__ = 'change_counter'
+
+    id = Column(Integer, primary_key=True)
+    seq = Column(BigInteger, nullable=False, default=0)
+    # tombstones numbered up to here are gone, see changes.prune_tombstones
+    prunedSeq = Column(BigInteger, nullable=False, default=0, server_default='0')
+
+
+# One row per deleted entity, so /changes can report deletes
+class Tombstone(db.Model):
+    __tablename__ = 'tombstone'
+
+    id = Column(Integer, primary_key=True)
+    tableName = Column(String, nullable=False)
+    entityId = Column(Integer, nullable=False)
+    changeSeq = Column(BigInteger, index=True)
+    deletedAt = Column(DateTime)
+
+    def __init__(self, tableName, entityId, changeSeq, deletedAt):
+        self.tableName = tableName
+        self.entityId = entityId
+        self.changeSeq = changeSeq
+        self.deletedAt = deletedAt
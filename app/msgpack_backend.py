@@ -0,0 +1,49 @@
+import datetime
+import msgpack
+from flask import current_app
+
+# ---------------------------------------------------------------------------- #
+# MessagePack Responses
+# ---------------------------------------------------------------------------- #
+
+'''
+The default_response envelope for clients sending Accept: application/msgpack.
+Datetimes are msgpack Timestamps (ext type -1), naive ones are taken as UTC.
+byId keys are strings, as in JSON, so decoders with the default
+strict_map_key=True read them.
+'''
+
+MSGPACK_MIMETYPE = 'application/msgpack'
+MSGPACK_MIMETYPES = (MSGPACK_MIMETYPE, 'application/x-msgpack')
+
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def encode_default(o):
+    if isinstance(o, datetime.datetime):
+        if o.tzinfo is None:
+            o = o.replace(tzinfo=datetime.timezone.utc)
+        # integer arithmetic, Timestamp.from_datetime goes through a float
+        delta = o - EPOCH
+        return msgpack.Timestamp(delta.days * 86400 + delta.seconds, delta.microseconds * 1000)
+    if isinstance(o, (datetime.date, datetime.time)):
+        return o.isoformat()
+    raise TypeError(f'Object of type {type(o).__name__} is not MessagePack serializable')
+
+
+def packb(data):
+    return msgpack.packb(data, default=encode_default, use_bin_type=True)
+
+
+def unpackb(body):
+    """Decodes a response body, Timestamps come back as aware datetimes
+    """
+    return msgpack.unpackb(body, timestamp=3)
+
+
+def response(data):
+    for value in data.values():
+        if isinstance(value, dict) and 'byId' in value:
+            value['byId'] = {str(key): item for key, item in value['byId'].items()}
+    return current_app.response_class(packb(data), mimetype=MSGPACK_MIMETYPE)
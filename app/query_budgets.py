@@ -0,0 +1,111 @@
+import re
+from contextlib import contextmanager
+from flask import current_app
+from sqlalchemy import event
+
+from .extensions import db
+from .cache import response_cache, NullBackend
+
+# ---------------------------------------------------------------------------- #
+# Query Budgets
+# ---------------------------------------------------------------------------- #
+
+'''
+Every GET route declares the most SQL statements one request may issue
+with @query_budget(n), placed right under @api.route. check_query_budgets
+requests every route against a small and a large dataset and reports the
+routes that go over their budget, or whose statement count grows with the
+number of rows (an N+1 on a lazy relationship).
+
+Budgets are set to exactly the statements a route issues today, with no
+headroom on purpose. Any added statement fails the check, so a change
+that needs one raises the route's budget in the same diff, where a
+reviewer sees it. tests/test_query_budgets.py runs the check at 10 and
+10,000 leads.
+'''
+
+# Routes with url parameters are requested for the row with this id
+SAMPLE_ID = 1
+
+
+def query_budget(statements, query_string=''):
+    """Declares the statement budget of a route, query_string is used when checking it
+    """
+    def query_budget_decorator(f):
+        f.query_budget = statements
+        f.query_budget_query_string = query_string
+        return f
+    return query_budget_decorator
+
+
+@contextmanager
+def count_queries():
+    """Counts the statements sent to the database inside the block
+    """
+    counter = {'statements': 0}
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        counter['statements'] += 1
+
+    engine = db.get_engine(current_app)
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+
+def budget_urls(app):
+    """(url, endpoint, budget) for every GET route of the app, budget is None if undeclared
+    """
+    urls = []
+    for rule in sorted(app.url_map.iter_rules(), key=lambda rule: rule.rule):
+        if 'GET' not in rule.methods or rule.endpoint == 'static':
+            continue
+        view = app.view_functions[rule.endpoint]
+        url = re.sub(r'<(?:\w+:)?\w+>', str(SAMPLE_ID), rule.rule)
+        query_string = getattr(view, 'query_budget_query_string', '')
+        urls.append((url + ('?' + query_string if query_string else ''), rule.endpoint,
+                     getattr(view, 'query_budget', None)))
+    return urls
+
+
+def measure_queries(app):
+    """{url: (status, statements)} of one uncached request to every GET route
+    """
+    client = app.test_client()
+    backend = response_cache.backend
+    response_cache.backend = NullBackend()
+    try:
+        results = {}
+        for url, _, _ in budget_urls(app):
+            # a fresh app context, so no session or g state carries over between requests
+            with app.app_context(), count_queries() as counter:
+                response = client.get(url)
+                response.get_data()
+            results[url] = (response.status_code, counter['statements'])
+        return results
+    finally:
+        response_cache.backend = backend
+
+
+def compare_query_budgets(app, small, large):
+    """Returns [(url, budget, statements at small, statements at large, problem)]
+
+    small and large are measure_queries results taken before and after the
+    dataset was grown, see the check_query_budgets command.
+    """
+    results = []
+    for url, endpoint, budget in budget_urls(app):
+        (small_status, small_count), (large_status, large_count) = small[url], large[url]
+        problem = None
+        if budget is None:
+            problem = f'{endpoint} has no @query_budget'
+        elif small_status != 200 or large_status != 200:
+            problem = f'responded {small_status} and {large_status}'
+        elif max(small_count, large_count) > budget:
+            problem = 'over budget'
+        elif large_count > small_count:
+            problem = 'statements grow with the number of rows'
+        results.append((url, budget, small_count, large_count, problem))
+    return results
@@ -0,0 +1,66 @@
+import re
+from sqlalchemy import text
+
+from .extensions import db
+
+# ---------------------------------------------------------------------------- #
+# Query Plans
+# ---------------------------------------------------------------------------- #
+
+'''
+HOT_QUERIES
+(name, table, sql, params) for every query shape the routes run against
+an indexed column. Each one must be answered with an index on a dataset
+large enough for the planner to prefer it (see seed_synthetic).
+'''
+
+HOT_QUERIES = [
+    ('leads in funnel step', 'lead',
+     'SELECT id FROM lead WHERE "funnelStepId" = :id', {'id': 1}),
+    ('leads by status', 'lead',
+     'SELECT * FROM lead WHERE status = :status', {'status': 'Hot Lead'}),
+    ('funnel steps of opportunity', 'funnelStep',
+     'SELECT * FROM "funnelStep" WHERE "opportunityId" = :id', {'id': 1}),
+    ('todos of lead', 'todo',
+     'SELECT * FROM todo WHERE "leadId" = :id', {'id': 1}),
+    ('todos by priority', 'todo',
+     'SELECT * FROM todo ORDER BY "priorityRank" LIMIT 20', {}),
+    ('next open todos', 'todo',
+     'SELECT * FROM todo WHERE completed = false ORDER BY "priorityRank", id LIMIT 20', {}),
+    ('opportunity info of lead', 'opportunity_info',
+     'SELECT * FROM opportunity_info WHERE "leadId" = :id', {'id': 1}),
+    ('opportunity info of opportunity', 'opportunity_info',
+     'SELECT id FROM opportunity_info WHERE "opportunityId" = :id ORDER BY id LIMIT 100', {'id': 1}),
+]
+
+
+def explain(sql, params):
+    """Returns the query plan as text lines for Postgres or SQLite
+    """
+    if db.engine.dialect.name == 'sqlite':
+        rows = db.session.execute(text('EXPLAIN QUERY PLAN ' + sql), params)
+        return [row[-1] for row in rows]
+    rows = db.session.execute(text('EXPLAIN ' + sql), params)
+    return [row[0] for row in rows]
+
+
+def full_scans(plan, table):
+    """Plan lines that read every row of the table instead of using an index
+    """
+    if db.engine.dialect.name == 'sqlite':
+        pattern = re.compile(r'^SCAN (TABLE )?"?%s"?(?! USING)' % re.escape(table))
+    else:
+        pattern = re.compile(r'Seq Scan on "?%s"?\b' % re.escape(table))
+    return [line for line in plan if pattern.search(line.strip())]
+
+
+def check_query_plans():
+    """EXPLAINs every hot query, returns [(name, plan, ok)]
+    """
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute('ANALYZE')
+    results = []
+    for name, table, sql, params in HOT_QUERIES:
+        plan = explain(sql, params)
+        results.append((name, plan, not full_scans(plan, table)))
+    return results
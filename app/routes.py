@@ -1,9 +1,20 @@
 from datetime import datetime
-from flask import Blueprint, jsonify, abort, request
+from flask import Blueprint, Response, jsonify, abort, request, current_app
 
 # from auth import AuthError, requires_auth
 from .models import Lead, Opportunity, FunnelStep, OpportunityInfo, Todo
-from .utils import default_response
+from .versioning import conditional
+from .cache import cached, response_cache
+from .metrics import app_metrics
+from .compression import compression
+from .query_budgets import query_budget
+from .todo_queue import next_todos, move_todo
+from .search import search_leads
+from .funnel_stats import funnel_stats
+from .changes import FEED_TABLES, since_arg, changes_since
+from .lead_import import import_leads, CSV_CONTENT_TYPES, NDJSON_CONTENT_TYPES
+from .core_reads import select_rows, select_page, read_snapshot
+from .utils import Page, default_response, page_args, wants_stream, stream_response, field_args, with_fields
 
 api = Blueprint('api', __name__)
 
@@ -14,33 +25,67 @@ api = Blueprint('api', __name__)
 # ---------------------------------------------------------------------------- #
 
 @api.route('/opportunities', methods=['GET'])
+@query_budget(3)
+@conditional('opportunity', 'funnelStep')
+@cached('opportunity', 'funnelStep')
 def get_opportunities():
+    fields = field_args(Opportunity)
     try:
-        query_result = Opportunity.query.all()
-        return default_response([(query_result, 'opportunities')])
+        query_result = select_rows(Opportunity, fields)
+        return default_response([(query_result, 'opportunities', fields)])
     except Exception as e:
         abort(500)
 
+
+@api.route('/opportunities/<int:opportunity_id>/funnel-stats', methods=['GET'])
+@query_budget(3)
+@conditional('opportunity', 'funnelStep', 'funnel_step_stats')
+@cached('opportunity', 'funnelStep', 'funnel_step_stats')
+def get_funnel_stats(opportunity_id):
+    if not Opportunity.query.get(opportunity_id):
+        abort(404)
+    try:
+        # read from the per step counters, never from the lead table
+        return jsonify({
+            'success': True,
+            'code': 200,
+            'opportunityId': opportunity_id,
+            'funnelSteps': funnel_stats(opportunity_id),
+        })
+    except Exception as e:
+        abort(500, e)
+
 # ---------------------------------------------------------------------------- #
 # Opportunity Info
 # ---------------------------------------------------------------------------- #
 
 @api.route('/opportunity-info', methods=['GET'])
+@query_budget(2)
+@conditional('opportunity_info')
+@cached('opportunity_info')
 def get_opportunity_infos():
+    fields = field_args(OpportunityInfo)
+    if wants_stream():
+        return stream_response([(with_fields(OpportunityInfo.query, fields), 'opportunities', fields)])
+    limit, after = page_args()
     try:
-        query_result = OpportunityInfo.query.all()
-        return default_response([(query_result, 'opportunities')])
+        query_result = select_page(OpportunityInfo, fields, limit, after)
+        return default_response([(query_result, 'opportunities', fields)])
     except Exception as e:
         print(e)
         abort(500)
 
 @api.route('/opportunity-info/<int:opportunity_info_id>', methods=['GET'])
+@query_budget(2)
+@conditional('opportunity_info')
+@cached('opportunity_info')
 def get_opportunity_info(opportunity_info_id):
+    fields = field_args(OpportunityInfo)
     try:
-        opportunity_info = OpportunityInfo.query.get(opportunity_info_id)
+        opportunity_info = with_fields(OpportunityInfo.query, fields).get(opportunity_info_id)
         if not opportunity_info:
             abort(404)
-        return default_response([(opportunity_info, 'opportunities')])
+        return default_response([(opportunity_info, 'opportunities', fields)])
     except Exception as e:
         abort(500, e)
 
@@ -49,21 +94,31 @@ def get_opportunity_info(opportunity_info_id):
 # ---------------------------------------------------------------------------- #
 
 @api.route('/funnel-steps', methods=['GET'])
+@query_budget(3)
+@conditional('funnelStep', 'lead')
+@cached('funnelStep', 'lead')
 def get_funnel_steps():
+    fields = field_args(FunnelStep)
+    if wants_stream():
+        return stream_response([(with_fields(FunnelStep.query, fields), 'funnelSteps', fields)])
+    limit, after = page_args()
     try:
-        query_result = FunnelStep.query.all()
-        funnel_steps = [funnel_step.format() for funnel_step in query_result]
-        return default_response([(query_result, 'funnelSteps')])
+        query_result = select_page(FunnelStep, fields, limit, after)
+        return default_response([(query_result, 'funnelSteps', fields)])
     except Exception:
         abort(500)
 
 @api.route('/funnel-steps/<int:funnel_step_id>', methods=['GET'])
+@query_budget(3)
+@conditional('funnelStep', 'lead')
+@cached('funnelStep', 'lead')
 def get_funnel_step(funnel_step_id):
+    fields = field_args(FunnelStep)
     try:
-        funnel_step = FunnelStep.query.get(funnel_step_id)
+        funnel_step = with_fields(FunnelStep.query, fields).get(funnel_step_id)
         if not funnel_step:
             abort(404)
-        return default_response([(funnel_step, 'funnelSteps')])
+        return default_response([(funnel_step, 'funnelSteps', fields)])
     except Exception as e:
         abort(500, e)
 
@@ -71,49 +126,90 @@ def get_funnel_step(funnel_step_id):
 # Leads
 # ---------------------------------------------------------------------------- #
 
+# POST /leads answers 400 without writing anything when one of these keys is missing
+REQUIRED_LEAD_FIELDS = ('city', 'state', 'email', 'funnelStepId', 'name', 'phone')
+
 @api.route('/leads', methods=['GET'])
+@query_budget(2)
+@conditional('lead')
+@cached('lead')
 def get_leads():
+    fields = field_args(Lead)
+    if wants_stream():
+        return stream_response([(with_fields(Lead.query, fields), 'leads', fields)])
+    limit, after = page_args()
+    try:
+        query_result = select_page(Lead, fields, limit, after)
+        return default_response([(query_result, 'leads', fields)])
+    except Exception as e:
+        abort(500, e)
+
+@api.route('/leads/search', methods=['GET'])
+@query_budget(3, query_string='q=jack')
+@conditional('lead')
+@cached('lead')
+def search_leads_route():
+    q = request.args.get('q', '').strip()
+    if not q:
+        abort(400, 'q is required.')
+    fields = field_args(Lead)
+    # the cursor of a ranked search is the offset of its next page
+    limit, after = page_args()
+    offset = after or 0
+    if offset > current_app.config['MAX_SEARCH_DEPTH']:
+        abort(400, 'Search results can not be paged that deep, refine the query.')
     try:
-        query_result = Lead.query.all()
-        return default_response([(query_result, 'leads')])
+        leads, has_more = search_leads(q, limit, offset)
+        query_result = Page(leads, offset + len(leads) if has_more else None)
+        return default_response([(query_result, 'leads', fields)])
     except Exception as e:
         abort(500, e)
 
 @api.route('/leads/<int:lead_id>', methods=['GET'])
+@query_budget(2)
+@conditional('lead')
+@cached('lead')
 def get_lead(lead_id):
+    fields = field_args(Lead)
     try:
-        lead = Lead.query.get(lead_id)
+        lead = with_fields(Lead.query, fields).get(lead_id)
         if not lead:
             abort(404)
-        return default_response([(lead, 'leads')])
+        return default_response([(lead, 'leads', fields)])
     except Exception as e:
         abort(500, e)
         
 
 @api.route('/leads', methods=['POST'])
 def add_lead():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        abort(400, 'The body must be a JSON object.')
+    missing = [field for field in REQUIRED_LEAD_FIELDS if field not in payload]
+    if missing:
+        abort(400, 'Missing required fields: %s.' % ', '.join(missing))
+    funnelStepId = payload['funnelStepId']
+    if not isinstance(funnelStepId, int) or not FunnelStep.query.get(funnelStepId):
+        abort(400, 'funnelStepId must be an existing funnel step.')
     try:
         # add new lead to db
-        payload = request.get_json()
         lead = Lead(
             city= payload["city"],
             state= payload["state"],
             chanceToConvert=0.15,
             dateCreated=datetime.now(),
             email=payload["email"],
-            funnelStepId=payload["funnelStepId"],
+            funnelStepId=funnelStepId,
             lastContact=datetime.now(),
             name=payload["name"],
             phone=payload["phone"],
             status="Follow Up"
         )
+        # funnel step membership is lead.funnelStepId, so this single
+        # insert is the whole write
         lead.insert()
         
-        # add lead to funnel step array
-        funnelStep = FunnelStep.query.get(payload["funnelStepId"])
-        funnelStep.leads = [*funnelStep.leads, lead.id]
-        funnelStep.update()
-        
+        funnelStep = FunnelStep.query.get(funnelStepId)
         return default_response([
             (lead, 'leads'),
             (funnelStep, 'funnelSteps'),
@@ -121,28 +217,202 @@ def add_lead():
     except Exception as e:
         abort(500, e)
         
+@api.route('/leads/<int:lead_id>', methods=['PATCH'])
+def update_lead(lead_id):
+    payload = request.get_json() or {}
+    lead = Lead.query.get(lead_id)
+    if not lead:
+        abort(404)
+    if 'funnelStepId' in payload and not FunnelStep.query.get(payload['funnelStepId']):
+        abort(400, 'funnelStepId must be an existing funnel step.')
+    try:
+        previousFunnelStepId = lead.funnelStepId
+        for field in ('city', 'state', 'email', 'funnelStepId', 'name', 'phone', 'status'):
+            if field in payload:
+                setattr(lead, field, payload[field])
+        lead.update()
+        
+        # moving a lead between steps is this one row update, both steps
+        # are returned so their leads lists can be refreshed
+        funnelStepIds = {previousFunnelStepId, lead.funnelStepId}
+        funnelSteps = with_fields(FunnelStep.query, None) \
+            .filter(FunnelStep.id.in_(funnelStepIds)).all()
+        return default_response([
+            (lead, 'leads'),
+            (funnelSteps, 'funnelSteps'),
+            ])
+    except Exception as e:
+        abort(500, e)
+        
+
+@api.route('/leads/bulk', methods=['POST'])
+def add_leads_bulk():
+    if request.mimetype not in CSV_CONTENT_TYPES + NDJSON_CONTENT_TYPES:
+        abort(400, 'Content-Type must be text/csv or application/x-ndjson.')
+    try:
+        report = import_leads(request.stream, request.mimetype)
+        return jsonify({
+            'success': True,
+            'code': 200,
+            **report
+        })
+    except Exception as e:
+        abort(500, e)
+        
 # ---------------------------------------------------------------------------- #
 # Todos
 # ---------------------------------------------------------------------------- #
 
 @api.route('/todos', methods=['GET'])
+@query_budget(2)
+@conditional('todo')
+@cached('todo')
 def get_todos():
+    fields = field_args(Todo)
+    if wants_stream():
+        return stream_response([(with_fields(Todo.query, fields), 'todos', fields)])
+    limit, after = page_args()
     try:
-        query_result = Todo.query.all()
-        return default_response([(query_result, 'todos')])
+        query_result = select_page(Todo, fields, limit, after)
+        return default_response([(query_result, 'todos', fields)])
     except Exception as e:
         abort(500, e)
         
+@api.route('/todos/next', methods=['GET'])
+@query_budget(2)
+@conditional('todo')
+@cached('todo')
+def get_next_todos():
+    fields = field_args(Todo)
+    limit, _ = page_args()
+    try:
+        query_result = next_todos(limit, fields)
+        return default_response([(query_result, 'todos', fields)])
+    except Exception as e:
+        abort(500, e)
+
+
+@api.route('/todos/<int:todo_id>/move', methods=['PATCH'])
+def move_todo_after(todo_id):
+    payload = request.get_json() or {}
+    after_id = payload.get('afterId')
+    if after_id == todo_id:
+        abort(400, 'A todo can not be moved after itself.')
+    todo = Todo.query.get(todo_id)
+    after = Todo.query.get(after_id) if after_id is not None else None
+    if not todo or (after_id is not None and not after):
+        abort(404)
+    try:
+        move_todo(todo, after)
+        return default_response([(todo, 'todos')])
+    except Exception as e:
+        abort(500, e)
+
+
 @api.route('/todos/<int:todo_id>', methods=['GET'])
+@query_budget(2)
+@conditional('todo')
+@cached('todo')
 def get_todo(todo_id):
+    fields = field_args(Todo)
     try:
-        todo = Todo.query.get(todo_id)
+        todo = with_fields(Todo.query, fields).get(todo_id)
         if not todo:
             abort(404)
-        return default_response([(todo, 'todos')])
+        return default_response([(todo, 'todos', fields)])
+    except Exception as e:
+        abort(500, e)
+
+
+# ---------------------------------------------------------------------------- #
+# Bootstrap
+# ---------------------------------------------------------------------------- #
+
+# Everything the frontend loads on login, in the order it is returned
+BOOTSTRAP_COLLECTIONS = [
+    (Opportunity, 'opportunities'),
+    (FunnelStep, 'funnelSteps'),
+    (Lead, 'leads'),
+    (OpportunityInfo, 'opportunityInfo'),
+    (Todo, 'todos'),
+]
+BOOTSTRAP_TABLES = [model.__tablename__ for model, _ in BOOTSTRAP_COLLECTIONS]
+
+
+@api.route('/bootstrap', methods=['GET'])
+@query_budget(9)
+@conditional(*BOOTSTRAP_TABLES)
+@cached(*BOOTSTRAP_TABLES)
+def get_bootstrap():
+    # ?limit= applies to every collection, ?<collection>.limit=, .after= and
+    # .fields= (e.g. ?leads.fields=name,status) to one of them
+    collections = [
+        (model, identifier, field_args(model, identifier + '.'), page_args(identifier + '.'))
+        for model, identifier in BOOTSTRAP_COLLECTIONS
+    ]
+    try:
+        # every collection from the same snapshot
+        read_snapshot()
+        schemas = []
+        for model, identifier, fields, (limit, after) in collections:
+            query_result = select_page(model, fields, limit, after)
+            schemas.append((query_result, identifier, fields))
+        return default_response(schemas)
     except Exception as e:
         abort(500, e)
 
+# ---------------------------------------------------------------------------- #
+# Changes
+# ---------------------------------------------------------------------------- #
+
+@api.route('/changes', methods=['GET'])
+@query_budget(10, query_string='since=0')
+@conditional(*FEED_TABLES)
+@cached(*FEED_TABLES)
+def get_changes():
+    # ?since= is the cursor of the previous response, 0 loads everything
+    # (?limit= changes at a time). Polling with If-None-Match gets a 304
+    # until something is written. A cursor older than the pruned
+    # tombstones gets a 410, the client then loads everything with since=0.
+    since = since_arg()
+    limit, _ = page_args()
+    try:
+        changes = changes_since(since, limit)
+    except Exception as e:
+        abort(500, e)
+    if changes.cursor < since:
+        abort(400, 'since is ahead of the latest change, load everything again with since=0.')
+    if 0 < since < changes.oldest_cursor:
+        abort(410, 'Deletes after since have been pruned, load everything again with since=0.')
+    return default_response(changes.collections, {
+        'deleted': changes.deleted,
+        'cursor': changes.cursor,
+        'hasMore': changes.has_more,
+    })
+
+# ---------------------------------------------------------------------------- #
+# Cache
+# ---------------------------------------------------------------------------- #
+
+@api.route('/cache/stats', methods=['GET'])
+@query_budget(0)
+def get_cache_stats():
+    return jsonify({
+        'success': True,
+        'code': 200,
+        **response_cache.stats(),
+        'compression': compression.stats(),
+    })
+
+# ---------------------------------------------------------------------------- #
+# Metrics
+# ---------------------------------------------------------------------------- #
+
+@api.route('/metrics', methods=['GET'])
+@query_budget(0)
+def get_metrics():
+    return Response(app_metrics.render(), mimetype='text/plain; version=0.0.4')
+
 
 @api.errorhandler(500)
 def server_error(error):
@@ -155,7 +425,7 @@ def server_error(error):
     
     
 @api.errorhandler(404)
-def not_found():
+def not_found(error):
     return jsonify({
         "message": "Not Found",
         "code": 404,
@@ -165,7 +435,7 @@ def not_found():
 
 
 @api.errorhandler(403)
-def forbidden():
+def forbidden(error):
     return jsonify({
         "message": "Forbiden",
         "code": 403,
@@ -179,15 +449,45 @@ def bad_request(error):
     return jsonify({
         "success": False,
         "code": 400,
-        "description": error.message
+        "description": error.description
     }), 400
 
 
 @api.errorhandler(401)
-def unauthorized():
+def unauthorized(error):
     return jsonify({
         "message": "Unauthorized",
         "code": 401,
         "description": "Please login",
         "success": False,
     }), 401
+
+
+@api.errorhandler(406)
+def not_acceptable(error):
+    return jsonify({
+        "message": "Not Acceptable",
+        "code": 406,
+        "description": error.description,
+        "success": False,
+    }), 406
+
+
+@api.errorhandler(410)
+def gone(error):
+    return jsonify({
+        "message": "Gone",
+        "code": 410,
+        "description": error.description,
+        "success": False,
+    }), 410
+
+
+@api.errorhandler(503)
+def service_unavailable(error):
+    return jsonify({
+        "message": "Service Unavailable",
+        "code": 503,
+        "description": error.description,
+        "success": False,
+    }), 503
@@ -0,0 +1,210 @@
+import re
+import threading
+from collections import defaultdict
+from flask import current_app
+from sqlalchemy import case, false, func, null, or_, select, true, union_all
+
+from .extensions import db
+from .models import Lead, Tombstone
+from .versioning import current_versions
+
+# ---------------------------------------------------------------------------- #
+# Lead Search
+# ---------------------------------------------------------------------------- #
+
+# Same default as pg_trgm's similarity threshold for the % operator
+SIMILARITY_THRESHOLD = 0.3
+# Phone searches need at least this many digits to be worth a substring match
+MIN_PHONE_DIGITS = 3
+
+
+def phone_digits(value):
+    return re.sub(r'\D', '', value or '')
+
+
+def search_leads(q, limit, offset):
+    """Ranked leads matching q by prefix or similarity, returns (leads, has_more)
+    """
+    backend = current_app.config['SEARCH_BACKEND']
+    if backend == 'auto':
+        backend = 'postgres' if db.engine.dialect.name == 'postgresql' else 'memory'
+    if backend == 'postgres':
+        return search_postgres(q, limit, offset)
+    return memory_index.search(q, limit, offset)
+
+
+def search_postgres(q, limit, offset):
+    """Trigram search, served by the GIN indexes of the search migration
+
+    Every condition matches one of the indexed expressions, so Postgres
+    combines them with a BitmapOr and only ranks the matching rows.
+    """
+    q = q.lower()
+    digits = phone_digits(q)
+    name = func.lower(Lead.name)
+    email = func.lower(Lead.email)
+    city = func.lower(Lead.city)
+    state = func.lower(Lead.state)
+
+    conditions = [
+        name.startswith(q, autoescape=True),
+        name.op('%')(q),
+        email.startswith(q, autoescape=True),
+        email.op('%')(q),
+        city.op('%')(q),
+        state == q,
+    ]
+    if len(digits) >= MIN_PHONE_DIGITS:
+        conditions.append(func.regexp_replace(Lead.phone, r'\D', '', 'g').contains(digits))
+
+    rank = func.greatest(
+        case([(name.startswith(q, autoescape=True), 1.0)], else_=0.0),
+        func.similarity(name, q),
+        func.similarity(email, q),
+        0.5 * func.similarity(city, q),
+    )
+    leads = Lead.query.filter(or_(*conditions)) \
+        .order_by(rank.desc(), Lead.id) \
+        .offset(offset).limit(limit + 1).all()
+    return leads[:limit], len(leads) > limit
+
+
+def similarity(grams, other):
+    """pg_trgm's similarity(): the trigrams two strings share over the trigrams of either
+    """
+    union = grams | other
+    return len(grams & other) / len(union) if union else 0.0
+
+
+def trigrams(text):
+    """pg_trgm style trigrams: every word padded with two spaces in front and one after
+    """
+    grams = set()
+    for word in re.findall(r'[a-z0-9]+', (text or '').lower()):
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class LeadSearchIndex:
+    """An in-process trigram inverted index over the searchable lead fields
+
+    The stand-in for Postgres' trigram indexes on SQLite and in development.
+    Whenever the lead table version changes, it applies the leads numbered
+    after the last changeSeq it has seen and drops the deleted ones (see
+    changes.py), instead of reading every lead again.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.seq = None
+        self.postings = defaultdict(set)
+        self.documents = {}
+        self._lock = threading.Lock()
+
+    def add(self, lead_id, name, email, city, state, phone):
+        fields = [(name or '').lower(), (email or '').lower(), (city or '').lower(), (state or '').lower()]
+        digits = phone_digits(phone)
+        field_grams = [trigrams(field) for field in fields]
+        self.documents[lead_id] = (fields, field_grams, digits)
+        for gram in set().union(*field_grams, trigrams(digits)):
+            self.postings[gram].add(lead_id)
+
+    def remove(self, lead_id):
+        document = self.documents.pop(lead_id, None)
+        if document is None:
+            return
+        _, field_grams, digits = document
+        for gram in set().union(*field_grams, trigrams(digits)):
+            self.postings[gram].discard(lead_id)
+            if not self.postings[gram]:
+                del self.postings[gram]
+
+    def update(self, version):
+        """Applies the lead changes numbered after self.seq
+
+        Change numbers become visible in order, so everything at or below
+        the highest number read has been applied.
+        """
+        since = self.seq or 0
+        seq = since
+        table = Tombstone.__table__
+        fields = [Lead.name, Lead.email, Lead.city, Lead.state, Lead.phone]
+        changed = select([Lead.id, *fields, Lead.changeSeq, false().label('deleted')]) \
+            .where(Lead.changeSeq > since)
+        deleted = select([
+            table.c.entityId, *[null().label(field.key) for field in fields], table.c.changeSeq, true().label('deleted')
+        ]).where(table.c.tableName == Lead.__tablename__).where(table.c.changeSeq > since)
+        rows = db.session.execute(union_all(changed, deleted))
+        for lead_id, name, email, city, state, phone, change_seq, is_deleted in rows:
+            self.remove(lead_id)
+            if not is_deleted:
+                self.add(lead_id, name, email, city, state, phone)
+            seq = max(seq, change_seq)
+        self.seq = seq
+        self.version = version
+
+    def clear(self):
+        """Forgets the index, for databases recreated with versions starting over
+        """
+        with self._lock:
+            self.version = None
+            self.seq = None
+            self.postings = defaultdict(set)
+            self.documents = {}
+
+    def refresh(self):
+        version = current_versions([Lead.__tablename__])
+        if version != self.version:
+            with self._lock:
+                if version != self.version:
+                    self.update(version)
+
+    def rank(self, lead_id, q, grams, digits):
+        """The rank search_postgres gives the lead, None when it doesn't match
+
+        Each field is compared with its own trigrams, as similarity() and %
+        do in Postgres, so both backends match and order the same leads.
+        """
+        (name, email, city, state), (name_grams, email_grams, city_grams, _), phone = self.documents[lead_id]
+        name_similarity = similarity(grams, name_grams)
+        email_similarity = similarity(grams, email_grams)
+        city_similarity = similarity(grams, city_grams)
+        matches = (
+            name.startswith(q) or name_similarity >= SIMILARITY_THRESHOLD
+            or email.startswith(q) or email_similarity >= SIMILARITY_THRESHOLD
+            or city_similarity >= SIMILARITY_THRESHOLD
+            or state == q
+            or (len(digits) >= MIN_PHONE_DIGITS and digits in phone)
+        )
+        if not matches:
+            return None
+        return max(1.0 if name.startswith(q) else 0.0, name_similarity, email_similarity, 0.5 * city_similarity)
+
+    def search(self, q, limit, offset):
+        self.refresh()
+        q = q.lower()
+        digits = phone_digits(q)
+        grams = trigrams(q)
+        if not grams:
+            return [], False
+
+        # every match shares at least one trigram with q, only those leads are ranked
+        candidates = set()
+        ranked = []
+        # updates change the postings in place
+        with self._lock:
+            for gram in grams:
+                candidates.update(self.postings.get(gram, ()))
+            for lead_id in candidates:
+                rank = self.rank(lead_id, q, grams, digits)
+                if rank is not None:
+                    ranked.append((-rank, lead_id))
+        ranked.sort()
+
+        page = [lead_id for _, lead_id in ranked[offset:offset + limit]]
+        leads = {lead.id: lead for lead in Lead.query.filter(Lead.id.in_(page))} if page else {}
+        return [leads[lead_id] for lead_id in page if lead_id in leads], len(ranked) > offset + limit
+
+
+memory_index = LeadSearchIndex()
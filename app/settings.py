@@ -2,4 +2,43 @@ import os
 
 SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
 SECRET_KEY = os.environ.get('SECRET_KEY')
-SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+SQLALCHEMY_TRACK_MODIFICATIONS = False
+# Keyset pagination for the list routes (?limit=&after=)
+DEFAULT_PAGE_SIZE = int(os.environ.get('DEFAULT_PAGE_SIZE', 100))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 1000))
+
+# Rows fetched per server-side cursor round-trip for ?stream=true responses
+STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', 1000))
+
+# Response cache for the read routes: 'memory', 'redis' or 'none'
+RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND', 'memory')
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+RESPONSE_CACHE_REDIS_URL = os.environ.get('RESPONSE_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+# A client object with redis-py's get/set, used instead of the url (e.g. a stand-in in tests)
+RESPONSE_CACHE_REDIS_CLIENT = None
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 300))
+
+# Tombstones of deletes older than this are pruned by flask prune_tombstones, a
+# /changes cursor from before the newest pruned one gets a 410 and resyncs from 0
+TOMBSTONE_RETENTION_DAYS = int(os.environ.get('TOMBSTONE_RETENTION_DAYS', 30))
+
+# Lead search: 'postgres' (pg_trgm indexes), 'memory' (in-process index) or 'auto'
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'auto')
+MAX_SEARCH_DEPTH = int(os.environ.get('MAX_SEARCH_DEPTH', 1000))
+
+# Response JSON encoder: 'orjson' (C encoder, if installed), 'stdlib' or 'auto'
+JSON_BACKEND = os.environ.get('JSON_BACKEND', 'auto')
+# Sorted keys and indentation only cost time, debug mode still pretty prints.
+# This also applies to every jsonify() response: keys keep their insertion order.
+JSON_SORT_KEYS = False
+JSONIFY_PRETTYPRINT_REGULAR = False
+
+# Response compression: bodies of COMPRESSION_MIN_SIZE bytes and up, in the first
+# accepted encoding of COMPRESSION_ENCODINGS (br needs brotli, zstd needs zstandard)
+COMPRESSION_ENCODINGS = os.environ.get('COMPRESSION_ENCODINGS', 'zstd,br,gzip')
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 5))
+COMPRESSION_ZSTD_LEVEL = int(os.environ.get('COMPRESSION_ZSTD_LEVEL', 3))
+# Compressed bodies of ETagged responses, so repeat hits are not compressed again
+COMPRESSION_CACHE_MAX_BYTES = int(os.environ.get('COMPRESSION_CACHE_MAX_BYTES', 16 * 1024 * 1024))
@@ -0,0 +1,150 @@
+import random
+from array import array
+from datetime import datetime, timedelta
+from sqlalchemy import func
+
+from .extensions import db
+from .models import Lead, Opportunity, OpportunityInfo, FunnelStep, Todo
+from .initialize_data import bulk_insert
+from .todo_queue import RANK_GAP
+
+# ---------------------------------------------------------------------------- #
+# Synthetic Data
+# ---------------------------------------------------------------------------- #
+
+# Every generated date falls in the year before this, so runs are reproducible
+EPOCH = datetime(2021, 3, 1)
+
+FIRST_NAMES = [
+    'Jack', 'Mahaut', 'Nathaniel', 'Olivia', 'Liam', 'Emma', 'Noah', 'Ava',
+    'Sophia', 'Lucas', 'Mia', 'Ethan', 'Harper', 'Mason', 'Amelia', 'Logan',
+]
+LAST_NAMES = [
+    'Dorsey', 'Brennan', 'Harris', 'Smith', 'Johnson', 'Williams', 'Brown',
+    'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez', 'Lopez',
+]
+CITIES = [
+    ('San Franciso', 'CA'), ('Waterloo', 'IA'), ('Avon', 'IN'), ('Bedford', 'OH'),
+    ('Dublin', 'OH'), ('Elyria', 'OH'), ('Howell', 'NJ'), ('Leland', 'NC'),
+    ('Matthews', 'NC'), ('Mays Landing', 'NJ'), ('Saint Petersburg', 'FL'),
+    ('Webster', 'NY'), ('Atlanta', 'GA'),
+]
+STATUSES = ['Follow Up', 'Automated', 'Hot Lead', 'On Hold', 'With Client']
+# Most leads sit in follow up or automation, few are hot at any time
+STATUS_WEIGHTS = [50, 30, 5, 10, 5]
+FILING_STATUSES = ['Single', 'Married', 'Head of Household']
+OCCUPATIONS = ['Software Engineer', 'Business Analyst', 'Senior Consultant', 'Teacher', 'Nurse']
+YEARLY_INCOMES = ['$0-50k', '$50k-100k', '$100k-150k', '$150k+']
+OPPORTUNITY_NAMES = ['Individual Tax Return', 'Business Tax Return', 'Accounting', 'Payroll']
+FUNNEL_STEP_NAMES = [
+    'Initial Inquiry', 'Took Questionnaire', 'Scheduled Phone Consult',
+    'Had a Phone Consult', 'Expressed Interest', 'Created Portal Account',
+    'Signed Engagement Letter',
+]
+TODO_DESCRIPTIONS = ['Send email', 'Call back', 'Send questionnaire', 'Request documents', 'Send invoice']
+
+
+def next_id(model):
+    return (db.session.query(func.max(model.id)).scalar() or 0) + 1
+
+
+def random_date(rng):
+    return EPOCH - timedelta(seconds=rng.randrange(365 * 24 * 3600))
+
+
+def generate_leads(rng, first_lead_id, count, first_step_id, step_count, lead_steps):
+    """Yields lead rows, recording each lead's step offset in lead_steps
+    """
+    for offset in range(count):
+        lead_id = first_lead_id + offset
+        step = rng.randrange(step_count)
+        lead_steps.append(step)
+        first_name = rng.choice(FIRST_NAMES)
+        last_name = rng.choice(LAST_NAMES)
+        city, state = rng.choice(CITIES)
+        date_created = random_date(rng)
+        yield {
+            'id': lead_id,
+            'city': city,
+            'state': state,
+            'chanceToConvert': round(rng.random(), 2),
+            'dateCreated': date_created,
+            'email': f'{first_name}.{last_name}{lead_id}@example.com'.lower(),
+            'funnelStepId': first_step_id + step,
+            'lastContact': date_created + timedelta(days=rng.randrange(30)),
+            'name': f'{first_name} {last_name}',
+            'phone': '+1%010d' % rng.randrange(2002000000, 9899999999),
+            'status': rng.choices(STATUSES, STATUS_WEIGHTS)[0],
+        }
+
+
+def generate_opportunity_infos(rng, first_lead_id, lead_steps, first_opportunity_id, steps_per_opportunity):
+    for offset, step in enumerate(lead_steps):
+        quoted_price = rng.randrange(100, 2000, 50)
+        yield {
+            'filingStatus': rng.choice(FILING_STATUSES),
+            'finalPrice': str(quoted_price) if step % steps_per_opportunity == steps_per_opportunity - 1 else None,
+            'leadId': first_lead_id + offset,
+            'occupation': rng.choice(OCCUPATIONS),
+            'opportunityId': first_opportunity_id + step // steps_per_opportunity,
+            'quotedPrice': quoted_price,
+            'yearlyIncome': rng.choice(YEARLY_INCOMES),
+        }
+
+
+def generate_todos(rng, first_lead_id, lead_count, todos_per_lead, first_rank):
+    rank = first_rank
+    for offset in range(lead_count):
+        for _ in range(todos_per_lead):
+            completed = rng.random() < 0.3
+            date_created = random_date(rng)
+            yield {
+                'completed': completed,
+                'datecompleted': (date_created + timedelta(days=1)).isoformat() if completed else None,
+                'dateCreated': date_created.isoformat(),
+                'description': rng.choice(TODO_DESCRIPTIONS),
+                'leadId': first_lead_id + offset,
+                'priorityRank': rank,
+            }
+            rank += RANK_GAP
+
+
+def seed_synthetic_data(leads, todos_per_lead, opportunities=4, seed=0):
+    """Appends a referentially consistent synthetic dataset to the database
+
+    Every opportunity gets the usual seven funnel steps and each lead lands
+    on a random step with one OpportunityInfo row and todos_per_lead todos.
+    The same seed and sizes always produce the same rows. Rows are generated
+    lazily and streamed to the database in batches.
+    """
+    rng = random.Random(seed)
+    steps_per_opportunity = len(FUNNEL_STEP_NAMES)
+    step_count = opportunities * steps_per_opportunity
+
+    first_opportunity_id = next_id(Opportunity)
+    first_step_id = next_id(FunnelStep)
+    first_lead_id = next_id(Lead)
+    first_rank = (db.session.query(func.max(Todo.priorityRank)).scalar() or 0) + RANK_GAP
+
+    bulk_insert(Opportunity, (
+        {
+            'id': first_opportunity_id + index,
+            'name': OPPORTUNITY_NAMES[index % len(OPPORTUNITY_NAMES)],
+        }
+        for index in range(opportunities)
+    ))
+    bulk_insert(FunnelStep, (
+        {
+            'id': first_step_id + index,
+            'name': FUNNEL_STEP_NAMES[index % steps_per_opportunity],
+            'opportunityId': first_opportunity_id + index // steps_per_opportunity,
+        }
+        for index in range(step_count)
+    ))
+
+    # one byte per lead, so OpportunityInfo can follow each lead's opportunity
+    lead_steps = array('B') if step_count < 256 else array('I')
+    bulk_insert(Lead, generate_leads(rng, first_lead_id, leads, first_step_id, step_count, lead_steps))
+    bulk_insert(OpportunityInfo, generate_opportunity_infos(
+        rng, first_lead_id, lead_steps, first_opportunity_id, steps_per_opportunity))
+    bulk_insert(Todo, generate_todos(rng, first_lead_id, leads, todos_per_lead, first_rank))
@@ -0,0 +1,80 @@
+from datetime import datetime
+from sqlalchemy import text
+
+from .extensions import db
+from .models import Todo
+from .core_reads import select_rows
+from .versioning import touch
+from .changes import number_at_commit
+
+# ---------------------------------------------------------------------------- #
+# Todo Queue
+# ---------------------------------------------------------------------------- #
+
+# Distance between consecutive ranks. A todo moved between two neighbours
+# takes the midpoint, so about log2(RANK_GAP) moves into the same spot fit
+# before the ranks have to be spread out again.
+RANK_GAP = 1024
+
+
+def next_todos(limit, fields=None):
+    """Open todos in priority order, read off the (completed, priorityRank, id) index
+    """
+    return select_rows(Todo, fields, [Todo.completed == False], order_by=[Todo.priorityRank, Todo.id], limit=limit)
+
+
+def rebalance_ranks():
+    """Spreads every todo's rank RANK_GAP apart, keeping the current order
+
+    Only the todos whose rank changes are written, so only they get a new
+    changeSeq and go out on the /changes feed.
+    """
+    db.session.execute(text('''
+        UPDATE todo SET "priorityRank" = ranked.position * :gap,
+                        "changeSeq" = NULL,
+                        "updatedAt" = :now
+        FROM (
+            SELECT id, row_number() OVER (ORDER BY "priorityRank", id) AS position FROM todo
+        ) AS ranked
+        WHERE todo.id = ranked.id
+          AND (todo."priorityRank" IS NULL OR todo."priorityRank" <> ranked.position * :gap)
+    '''), {'gap': RANK_GAP, 'now': datetime.now()})
+    number_at_commit(Todo.__tablename__)
+    touch(Todo.__tablename__)
+
+
+def rank_after(todo, after):
+    """The rank that places todo right after the todo `after` (None for the top)
+
+    Returns None when there is no free rank between the two neighbours (or
+    `after` shares its rank). Each neighbour lookup is a single index probe.
+    """
+    query = Todo.query.with_entities(Todo.priorityRank).filter(Todo.id != todo.id)
+    if after is None:
+        following = query.order_by(Todo.priorityRank).first()
+        return following[0] - RANK_GAP if following else RANK_GAP
+
+    if query.filter(Todo.id != after.id, Todo.priorityRank == after.priorityRank).first():
+        return None
+    following = query.filter(Todo.priorityRank > after.priorityRank) \
+        .order_by(Todo.priorityRank).first()
+    if following is None:
+        return after.priorityRank + RANK_GAP
+    if following[0] - after.priorityRank < 2:
+        return None
+    return (after.priorityRank + following[0]) // 2
+
+
+def move_todo(todo, after):
+    """Moves todo right after `after` (None for the top), rewriting one row
+
+    When the neighbours' ranks are adjacent, all ranks are spread out once
+    first, which amortizes to nothing over the moves in between.
+    """
+    rank = rank_after(todo, after)
+    if rank is None:
+        rebalance_ranks()
+        db.session.expire_all()
+        rank = rank_after(todo, after)
+    todo.priorityRank = rank
+    todo.update()
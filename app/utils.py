@@ -1,21 +1,202 @@
-from flask import jsonify
+from array import array
+from collections import namedtuple
+from flask import request, current_app, abort, Response, stream_with_context
+from sqlalchemy.orm import load_only, selectinload
 
-def default_response(schemas):
+from .json_backend import json_backend
+from . import msgpack_backend
+from .msgpack_backend import MSGPACK_MIMETYPES
+
+'''
+Page
+A single keyset-paginated slice of a query, plus the cursor of the next slice
+
+'''
+
+Page = namedtuple('Page', ['items', 'next_cursor'])
+
+
+def page_args(prefix=''):
+    """Reads and validates the ?limit=&after= pagination arguments
+
+    With a prefix (e.g. 'leads.') the prefixed arguments are read, and the
+    limit falls back to the plain ?limit=.
+    """
+    default_limit = current_app.config['DEFAULT_PAGE_SIZE']
+    max_limit = current_app.config['MAX_PAGE_SIZE']
+    try:
+        limit = int(request.args.get(prefix + 'limit', request.args.get('limit', default_limit)))
+        after = request.args.get(prefix + 'after', None)
+        after = int(after) if after is not None else None
+    except ValueError:
+        abort(400, 'limit and after must be integers.')
+    if limit < 1:
+        abort(400, 'limit must be a positive integer.')
+    return min(limit, max_limit), after
+
+
+def paginate(query, model, limit, after=None):
+    """Keyset pagination on the primary key, never an OFFSET scan
+
+    Fetches one extra row to know whether a next page exists.
+    """
+    if after is not None:
+        query = query.filter(model.id > after)
+    items = query.order_by(model.id).limit(limit + 1).all()
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = items[-1].id
+    return Page(items, next_cursor)
+
+
+def field_args(model, prefix=''):
+    """Reads ?fields=name,status and validates it against the model's columns
+
+    Returns None when every field is wanted. id is always serialized. The
+    fields come back once each in the model's column order, so every way of
+    writing the same fieldset maps to the same one.
+    """
+    fields = request.args.get(prefix + 'fields', None)
+    if not fields:
+        return None
+    requested = {field.strip() for field in fields.split(',') if field.strip()} - {'id'}
+    allowed = [*model.__mapper__.column_attrs.keys(), *getattr(model, 'derived_fields', {})]
+    unknown = requested - set(allowed)
+    if unknown:
+        abort(400, f'Unknown fields: {", ".join(sorted(unknown))}.')
+    return [field for field in allowed if field in requested]
+
+
+def with_fields(query, fields):
+    """Pushes a sparse fieldset down into the SELECT so other columns aren't loaded
+
+    Derived fields (e.g. FunnelStep.leads) are eager loaded with one extra
+    SELECT ... WHERE fk IN (...) per query instead of one per row.
+    """
+    model = query.column_descriptions[0]['entity']
+    derived_fields = getattr(model, 'derived_fields', {})
+    wanted = derived_fields if fields is None else [field for field in fields if field in derived_fields]
+    for field in wanted:
+        query = query.options(selectinload(getattr(model, derived_fields[field])).load_only('id'))
+    if fields is not None:
+        columns = [field for field in fields if field not in derived_fields]
+        query = query.options(load_only('id', *columns))
+    return query
+
+
+def serialize(item, fields=None):
+    if fields is None:
+        return item.format()
+    return {'id': item.id, **{field: getattr(item, field) for field in fields}}
+
+
+def unpack_schema(schema):
+    """A schema is (query_result, identifier) or (query_result, identifier, fields)
+    """
+    query_result, identifier, *rest = schema
+    return query_result, identifier, rest[0] if rest else None
+
+
+def default_response(schemas, extra=None):
+    """The normalized envelope of every schema, plus any extra top level keys
+    """
     response = {}
-    for query_result, identifier in schemas:
+    for schema in schemas:
+        query_result, identifier, fields = unpack_schema(schema)
         allIds = []
         byId = {}
+        page = None
+        if isinstance(query_result, Page):
+            page = query_result
+            query_result = page.items
         if not type(query_result) is list:
             query_result = [query_result]
         for item in query_result:
+            # rows from core_reads arrive already serialized
+            if isinstance(item, dict):
+                allIds.append(item['id'])
+                byId[item['id']] = item
+                continue
             allIds.append(item.id)
-            byId[item.id] = item.format()
+            byId[item.id] = serialize(item, fields)
         response[identifier] = {
             "allIds": allIds,
             "byId": byId,
         }
-    return jsonify({
+        if page is not None:
+            response[identifier]["nextCursor"] = page.next_cursor
+    body = {
         'success': True,
         'code': 200,
-        **response
-    })
\ No newline at end of file
+        **response,
+        **(extra or {})
+    }
+    if response_format() == 'msgpack':
+        response = msgpack_backend.response(body)
+    else:
+        response = json_backend.response(body)
+    response.vary.add('Accept')
+    return response
+
+
+def response_format():
+    """'msgpack' when the client prefers it over JSON (Accept header), 'json' otherwise
+    """
+    best = request.accept_mimetypes.best_match(['application/json', *MSGPACK_MIMETYPES])
+    return 'msgpack' if best in MSGPACK_MIMETYPES else 'json'
+
+
+def wants_stream():
+    return request.args.get('stream', '').lower() in ('1', 'true')
+
+
+def stream_response(schemas):
+    """Streams the default_response envelope for whole tables in constant memory
+
+    Each schema is a (query, identifier[, fields]) tuple. Rows are pulled through a
+    server-side cursor in STREAM_BATCH_SIZE batches and written out as they
+    arrive. allIds is written from the ids of the rows just streamed, kept as
+    8-byte ints rather than a list, so it always matches byId and the byId dict
+    is never held in memory.
+
+    Only JSON is streamed: a MessagePack map needs its length up front, so a
+    client that accepts MessagePack but not JSON gets a 406.
+    """
+    if response_format() == 'msgpack' and not request.accept_mimetypes['application/json']:
+        abort(406, 'Streamed responses are only available as application/json.')
+    batch_size = current_app.config['STREAM_BATCH_SIZE']
+
+    def stream(query):
+        return query.execution_options(stream_results=True).yield_per(batch_size)
+
+    def generate():
+        yield b'{"success":true,"code":200'
+        for schema in schemas:
+            query, identifier, fields = unpack_schema(schema)
+            model = query.column_descriptions[0]['entity']
+            query = query.order_by(model.id)
+
+            yield b',%s:{"byId":{' % json_backend.dumps(identifier)
+            ids = array('q')
+            chunk = []
+            separator = b''
+            for item in stream(query):
+                ids.append(item.id)
+                chunk.append(b'%s"%d":%s' % (separator, item.id, json_backend.dumps(serialize(item, fields))))
+                separator = b','
+                if len(chunk) >= batch_size:
+                    yield b''.join(chunk)
+                    chunk = []
+            yield b''.join(chunk)
+
+            yield b'},"allIds":['
+            for start in range(0, len(ids), batch_size):
+                batch = b','.join(b'%d' % item_id for item_id in ids[start:start + batch_size])
+                yield (b',' if start else b'') + batch
+            yield b']}'
+        yield b'}'
+
+    response = Response(stream_with_context(generate()), mimetype='application/json')
+    response.vary.add('Accept')
+    return response
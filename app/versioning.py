@@ -0,0 +1,140 @@
+import hashlib
+from functools import wraps
+from flask import request, make_response, g, Response
+from sqlalchemy import event
+
+from .extensions import db
+from .models import TableVersion
+from .utils import response_format
+
+# ---------------------------------------------------------------------------- #
+# Table Versions
+# ---------------------------------------------------------------------------- #
+
+'''
+Writes only record the tables they touch. The versions are bumped once per
+transaction, right before it commits, in table name order, so their row
+locks are held for the commit alone rather than from the first write on,
+and two transactions always take them in the same order.
+'''
+
+# Callbacks run with the set of written tables once their transaction commits
+commit_listeners = []
+# Callbacks run with the session right before it commits, after the versions
+commit_hooks = []
+
+
+def on_commit(callback):
+    commit_listeners.append(callback)
+    return callback
+
+
+def before_commit(callback):
+    """Registers callback(session) to run last inside each committing transaction
+
+    Any lock it takes comes after the table versions', in registration order.
+    """
+    commit_hooks.append(callback)
+    return callback
+
+
+def touch(*tables):
+    """Marks tables as written in the current transaction, their versions are bumped at commit
+
+    ORM writes are picked up automatically by the before_flush listener below,
+    this is for writes that bypass the unit of work (bulk inserts, Core
+    statements, COPY).
+    """
+    db.session.info.setdefault('touched_tables', set()).update(tables)
+
+
+def bump_versions(session, tables):
+    table = TableVersion.__table__
+    for name in sorted(tables):
+        updated = session.execute(
+            table.update().where(table.c.name == name).values(version=table.c.version + 1)
+        )
+        if updated.rowcount == 0:
+            session.execute(table.insert().values(name=name, version=1))
+
+
+@event.listens_for(db.session, 'before_flush')
+def touch_flushed_tables(session, flush_context, instances):
+    tables = set()
+    for obj in [*session.new, *session.deleted]:
+        tables.add(obj.__table__.name)
+    for obj in session.dirty:
+        if session.is_modified(obj):
+            tables.add(obj.__table__.name)
+    tables.discard(TableVersion.__tablename__)
+    touch(*tables)
+
+
+@event.listens_for(db.session, 'before_commit')
+def bump_touched_tables(session):
+    # the commit's own flush comes after this event, so it is done here first
+    session.flush()
+    bump_versions(session, session.info.get('touched_tables', ()))
+    for callback in commit_hooks:
+        callback(session)
+
+
+@event.listens_for(db.session, 'after_commit')
+def notify_commit_listeners(session):
+    tables = session.info.pop('touched_tables', None)
+    if tables:
+        for callback in commit_listeners:
+            callback(tables)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_touched_tables(session):
+    session.info.pop('touched_tables', None)
+
+
+def current_versions(tables):
+    """Versions of the given tables, read once per request
+    """
+    key = tuple(sorted(tables))
+    cache = g.setdefault('table_versions', {})
+    if key not in cache:
+        rows = db.session.query(TableVersion.name, TableVersion.version) \
+            .filter(TableVersion.name.in_(key)).all()
+        versions = dict(rows)
+        cache[key] = [(name, versions.get(name, 0)) for name in key]
+    return cache[key]
+
+# ---------------------------------------------------------------------------- #
+# Conditional GET
+# ---------------------------------------------------------------------------- #
+
+def compute_etag(tables):
+    """A strong ETag for the current url and response format given the versions of the tables it reads
+    """
+    key = repr((response_format(), request.full_path, current_versions(tables)))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def conditional(*tables):
+    """Answers If-None-Match with a 304 before the route runs any query
+
+    The versions are read before the route's own queries, so a write that
+    lands in between can only make the ETag stale, never the body.
+    """
+    def conditional_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            etag = compute_etag(tables)
+            # weak comparison, compressed responses carry the weak form of the ETag
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+                response.set_etag(etag, weak=not request.if_none_match.contains(etag))
+                response.vary.add('Accept')
+                return response
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+
+        return wrapper
+    return conditional_decorator
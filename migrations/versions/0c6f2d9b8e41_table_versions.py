@@ -0,0 +1,33 @@
+"""table versions
+
+Adds table_version, the per-table counters behind the ETags of the read
+routes (see versioning.py). Databases that were created with
+db.create_all() after it was introduced already have the table, and
+should be stamped with this revision (flask db stamp 0c6f2d9b8e41).
+
+Revision ID: 0c6f2d9b8e41
+Revises: ee255319d5a0
+Create Date: 2021-03-04 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0c6f2d9b8e41'
+down_revision = 'ee255319d5a0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('table_version',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('table_version')
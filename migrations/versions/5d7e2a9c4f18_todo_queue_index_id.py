@@ -0,0 +1,30 @@
+"""todo queue index id
+
+GET /todos/next orders open todos by (priorityRank, id). With id in the
+index as well, ties in priorityRank are read in order off the index too,
+instead of being sorted after the scan.
+
+Revision ID: 5d7e2a9c4f18
+Revises: b3f1c07a9d62
+Create Date: 2021-04-09 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d7e2a9c4f18'
+down_revision = 'b3f1c07a9d62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_todo_completed_priorityRank_id', 'todo', ['completed', 'priorityRank', 'id'], unique=False)
+    op.drop_index('ix_todo_completed_priorityRank', table_name='todo')
+
+
+def downgrade():
+    op.create_index('ix_todo_completed_priorityRank', 'todo', ['completed', 'priorityRank'], unique=False)
+    op.drop_index('ix_todo_completed_priorityRank_id', table_name='todo')
@@ -0,0 +1,34 @@
+"""foreign key and filter indexes
+
+Revision ID: 6aa82ebe89d4
+Revises: d4ec431a65e5
+Create Date: 2021-03-15 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6aa82ebe89d4'
+down_revision = 'd4ec431a65e5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_lead_status'), 'lead', ['status'], unique=False)
+    op.create_index(op.f('ix_opportunity_info_leadId'), 'opportunity_info', ['leadId'], unique=False)
+    op.create_index(op.f('ix_opportunity_info_opportunityId'), 'opportunity_info', ['opportunityId'], unique=False)
+    op.create_index(op.f('ix_todo_completed'), 'todo', ['completed'], unique=False)
+    op.create_index(op.f('ix_todo_leadId'), 'todo', ['leadId'], unique=False)
+    op.create_index(op.f('ix_todo_priorityRank'), 'todo', ['priorityRank'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_todo_priorityRank'), table_name='todo')
+    op.drop_index(op.f('ix_todo_leadId'), table_name='todo')
+    op.drop_index(op.f('ix_todo_completed'), table_name='todo')
+    op.drop_index(op.f('ix_opportunity_info_opportunityId'), table_name='opportunity_info')
+    op.drop_index(op.f('ix_opportunity_info_leadId'), table_name='opportunity_info')
+    op.drop_index(op.f('ix_lead_status'), table_name='lead')
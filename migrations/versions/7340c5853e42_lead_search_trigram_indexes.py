@@ -0,0 +1,37 @@
+"""lead search trigram indexes
+
+GIN trigram indexes on the expressions search.search_postgres filters
+on, so prefix (LIKE 'q%'), similarity (%) and phone digit substring
+matches are all index scans.
+
+Revision ID: 7340c5853e42
+Revises: e8a714a1c605
+Create Date: 2021-03-29 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7340c5853e42'
+down_revision = 'e8a714a1c605'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute('CREATE INDEX ix_lead_name_trgm ON lead USING gin (lower(name) gin_trgm_ops)')
+    op.execute('CREATE INDEX ix_lead_email_trgm ON lead USING gin (lower(email) gin_trgm_ops)')
+    op.execute('CREATE INDEX ix_lead_city_trgm ON lead USING gin (lower(city) gin_trgm_ops)')
+    op.execute('CREATE INDEX ix_lead_state_lower ON lead (lower(state))')
+    op.execute(r'''CREATE INDEX ix_lead_phone_digits_trgm ON lead USING gin (regexp_replace(phone, '\D', '', 'g') gin_trgm_ops)''')
+
+
+def downgrade():
+    op.execute('DROP INDEX ix_lead_phone_digits_trgm')
+    op.execute('DROP INDEX ix_lead_state_lower')
+    op.execute('DROP INDEX ix_lead_city_trgm')
+    op.execute('DROP INDEX ix_lead_email_trgm')
+    op.execute('DROP INDEX ix_lead_name_trgm')
@@ -0,0 +1,28 @@
+"""tombstone retention
+
+Adds prunedSeq to the change_counter row: the highest change number of
+the tombstones flask prune_tombstones has deleted. /changes answers a
+cursor below it with a 410 (see changes.py).
+
+Revision ID: 9b2e6f4d1a73
+Revises: 5d7e2a9c4f18
+Create Date: 2021-04-12 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b2e6f4d1a73'
+down_revision = '5d7e2a9c4f18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('change_counter', sa.Column('prunedSeq', sa.BigInteger(), server_default='0', nullable=False))
+
+
+def downgrade():
+    op.drop_column('change_counter', 'prunedSeq')
@@ -0,0 +1,67 @@
+"""change feed
+
+Adds updatedAt and an indexed changeSeq to every table in the /changes
+feed (see changes.py), plus the change_counter and tombstone tables.
+Existing rows are numbered table by table in id order, and the counter
+starts after the last of them.
+
+Revision ID: b3f1c07a9d62
+Revises: e24a9c72e5cb
+Create Date: 2021-04-07 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3f1c07a9d62'
+down_revision = 'e24a9c72e5cb'
+branch_labels = None
+depends_on = None
+
+# changes.CHANGE_COLLECTIONS order
+TABLES = ['opportunity', 'funnelStep', 'lead', 'opportunity_info', 'todo']
+
+
+def upgrade():
+    op.create_table('change_counter',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('seq', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('tombstone',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tableName', sa.String(), nullable=False),
+    sa.Column('entityId', sa.Integer(), nullable=False),
+    sa.Column('changeSeq', sa.BigInteger(), nullable=True),
+    sa.Column('deletedAt', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_tombstone_changeSeq'), 'tombstone', ['changeSeq'], unique=False)
+
+    connection = op.get_bind()
+    offset = 0
+    for table in TABLES:
+        op.add_column(table, sa.Column('updatedAt', sa.DateTime(), nullable=True))
+        op.add_column(table, sa.Column('changeSeq', sa.BigInteger(), nullable=True))
+        op.execute(f'''
+            UPDATE "{table}" SET "changeSeq" = {offset} + numbered.position, "updatedAt" = now()
+            FROM (
+                SELECT id, row_number() OVER (ORDER BY id) AS position FROM "{table}"
+            ) AS numbered
+            WHERE "{table}".id = numbered.id
+        ''')
+        op.create_index(op.f(f'ix_{table}_changeSeq'), table, ['changeSeq'], unique=False)
+        offset += connection.execute(f'SELECT count(*) FROM "{table}"').scalar()
+    op.execute(f'INSERT INTO change_counter (id, seq) VALUES (1, {offset})')
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        op.drop_index(op.f(f'ix_{table}_changeSeq'), table_name=table)
+        op.drop_column(table, 'changeSeq')
+        op.drop_column(table, 'updatedAt')
+    op.drop_index(op.f('ix_tombstone_changeSeq'), table_name='tombstone')
+    op.drop_table('tombstone')
+    op.drop_table('change_counter')
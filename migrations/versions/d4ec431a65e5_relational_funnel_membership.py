@@ -0,0 +1,59 @@
+"""relational funnel membership
+
+Drops the denormalized funnelStep.data (leads) and opportunity.data
+(funnelSteps) arrays. Membership is served from the indexed
+lead.funnelStepId and funnelStep.opportunityId foreign keys, which are
+first backfilled from the arrays wherever the two disagree.
+
+Revision ID: d4ec431a65e5
+Revises: 0c6f2d9b8e41
+Create Date: 2021-03-08 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'd4ec431a65e5'
+down_revision = '0c6f2d9b8e41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('''
+        UPDATE lead SET "funnelStepId" = step.id
+        FROM "funnelStep" step
+        WHERE lead.id = ANY(step.data)
+          AND lead."funnelStepId" IS DISTINCT FROM step.id
+    ''')
+    op.execute('''
+        UPDATE "funnelStep" SET "opportunityId" = opportunity.id
+        FROM opportunity
+        WHERE "funnelStep".id = ANY(opportunity.data)
+          AND "funnelStep"."opportunityId" IS DISTINCT FROM opportunity.id
+    ''')
+    op.create_index(op.f('ix_lead_funnelStepId'), 'lead', ['funnelStepId'], unique=False)
+    op.create_index(op.f('ix_funnelStep_opportunityId'), 'funnelStep', ['opportunityId'], unique=False)
+    op.drop_column('funnelStep', 'data')
+    op.drop_column('opportunity', 'data')
+
+
+def downgrade():
+    op.add_column('opportunity', sa.Column('data', postgresql.ARRAY(sa.Integer()), nullable=True))
+    op.add_column('funnelStep', sa.Column('data', postgresql.ARRAY(sa.Integer()), nullable=True))
+    op.execute('''
+        UPDATE opportunity SET data = COALESCE((
+            SELECT array_agg(step.id ORDER BY step.id) FROM "funnelStep" step
+            WHERE step."opportunityId" = opportunity.id
+        ), '{}')
+    ''')
+    op.execute('''
+        UPDATE "funnelStep" SET data = COALESCE((
+            SELECT array_agg(lead.id ORDER BY lead.id) FROM lead
+            WHERE lead."funnelStepId" = "funnelStep".id
+        ), '{}')
+    ''')
+    op.drop_index(op.f('ix_funnelStep_opportunityId'), table_name='funnelStep')
+    op.drop_index(op.f('ix_lead_funnelStepId'), table_name='lead')
@@ -0,0 +1,53 @@
+"""funnel step stats
+
+Adds the funnel_step_stats counter table (see funnel_stats.py) and fills
+it with the same GROUP BY as funnel_stats.rebuild_funnel_stats.
+
+Revision ID: e24a9c72e5cb
+Revises: 7340c5853e42
+Create Date: 2021-03-31 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e24a9c72e5cb'
+down_revision = '7340c5853e42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('funnel_step_stats',
+    sa.Column('funnelStepId', sa.Integer(), nullable=False),
+    sa.Column('leadCount', sa.Integer(), nullable=False),
+    sa.Column('quotedCount', sa.Integer(), nullable=False),
+    sa.Column('quotedTotal', sa.Float(), nullable=False),
+    sa.Column('finalCount', sa.Integer(), nullable=False),
+    sa.Column('finalTotal', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['funnelStepId'], ['funnelStep.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('funnelStepId')
+    )
+    op.execute(r'''
+        INSERT INTO funnel_step_stats ("funnelStepId", "leadCount", "quotedCount", "quotedTotal", "finalCount", "finalTotal")
+        SELECT lead."funnelStepId",
+               count(DISTINCT lead.id),
+               count(info."quotedPrice"),
+               coalesce(sum(info."quotedPrice"), 0),
+               count(info.final_price),
+               coalesce(sum(info.final_price), 0)
+        FROM lead
+        LEFT OUTER JOIN (
+            SELECT "leadId", "quotedPrice",
+                   CASE WHEN "finalPrice" ~ '^-?[0-9]+(\.[0-9]+)?$' THEN CAST("finalPrice" AS FLOAT) END AS final_price
+            FROM opportunity_info
+        ) AS info ON info."leadId" = lead.id
+        WHERE lead."funnelStepId" IS NOT NULL
+        GROUP BY lead."funnelStepId"
+    ''')
+
+
+def downgrade():
+    op.drop_table('funnel_step_stats')
@@ -0,0 +1,47 @@
+"""gap spaced todo ranks
+
+Widens todo.priorityRank to bigint and spreads the existing ranks 1024
+apart (todo_queue.RANK_GAP), keeping their order. Replaces the
+todo.completed index with (completed, priorityRank), which also serves
+completed-only filters.
+
+Revision ID: e8a714a1c605
+Revises: 6aa82ebe89d4
+Create Date: 2021-03-22 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8a714a1c605'
+down_revision = '6aa82ebe89d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.alter_column('todo', 'priorityRank', type_=sa.BigInteger(), existing_type=sa.Integer())
+    op.execute('''
+        UPDATE todo SET "priorityRank" = ranked.position * 1024
+        FROM (
+            SELECT id, row_number() OVER (ORDER BY "priorityRank", id) AS position FROM todo
+        ) AS ranked
+        WHERE todo.id = ranked.id
+    ''')
+    op.drop_index(op.f('ix_todo_completed'), table_name='todo')
+    op.create_index('ix_todo_completed_priorityRank', 'todo', ['completed', 'priorityRank'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_todo_completed_priorityRank', table_name='todo')
+    op.create_index(op.f('ix_todo_completed'), 'todo', ['completed'], unique=False)
+    op.execute('''
+        UPDATE todo SET "priorityRank" = ranked.position
+        FROM (
+            SELECT id, row_number() OVER (ORDER BY "priorityRank", id) AS position FROM todo
+        ) AS ranked
+        WHERE todo.id = ranked.id
+    ''')
+    op.alter_column('todo', 'priorityRank', type_=sa.Integer(), existing_type=sa.BigInteger())
@@ -0,0 +1,84 @@
+"""initial tables
+
+The schema as it was created by db.create_all() before migrations were
+introduced. Databases created that way should be stamped with this
+revision (flask db stamp ee255319d5a0) instead of upgraded through it.
+
+Revision ID: ee255319d5a0
+Revises: 
+Create Date: 2021-03-01 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'ee255319d5a0'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('opportunity',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('data', postgresql.ARRAY(sa.Integer()), nullable=True),
+    sa.Column('name', sa.String(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('funnelStep',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('data', postgresql.ARRAY(sa.Integer()), nullable=True),
+    sa.Column('name', sa.String(), nullable=True),
+    sa.Column('opportunityId', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['opportunityId'], ['opportunity.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('lead',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('city', sa.String(), nullable=True),
+    sa.Column('state', sa.String(), nullable=True),
+    sa.Column('chanceToConvert', sa.Float(), nullable=True),
+    sa.Column('dateCreated', sa.DateTime(), nullable=True),
+    sa.Column('email', sa.String(), nullable=True),
+    sa.Column('funnelStepId', sa.Integer(), nullable=True),
+    sa.Column('lastContact', sa.DateTime(), nullable=True),
+    sa.Column('name', sa.String(), nullable=True),
+    sa.Column('phone', sa.String(), nullable=True),
+    sa.Column('status', sa.String(), nullable=True),
+    sa.ForeignKeyConstraint(['funnelStepId'], ['funnelStep.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('opportunity_info',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('filingStatus', sa.String(), nullable=True),
+    sa.Column('finalPrice', sa.String(), nullable=True),
+    sa.Column('leadId', sa.Integer(), nullable=True),
+    sa.Column('occupation', sa.String(), nullable=True),
+    sa.Column('opportunityId', sa.Integer(), nullable=True),
+    sa.Column('quotedPrice', sa.Float(), nullable=True),
+    sa.Column('yearlyIncome', sa.String(), nullable=True),
+    sa.ForeignKeyConstraint(['leadId'], ['lead.id'], ),
+    sa.ForeignKeyConstraint(['opportunityId'], ['opportunity.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('todo',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('completed', sa.Boolean(), nullable=True),
+    sa.Column('datecompleted', sa.String(), nullable=True),
+    sa.Column('dateCreated', sa.String(), nullable=True),
+    sa.Column('description', sa.String(), nullable=True),
+    sa.Column('leadId', sa.Integer(), nullable=True),
+    sa.Column('priorityRank', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['leadId'], ['lead.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('todo')
+    op.drop_table('opportunity_info')
+    op.drop_table('lead')
+    op.drop_table('funnelStep')
+    op.drop_table('opportunity')
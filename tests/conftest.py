@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+from app import create_app
+from app.extensions import db
+from app.search import memory_index
+
+
+@pytest.fixture
+def app_config():
+    """Settings overrides of the app fixture, override this fixture in a test module to change them
+    """
+    return {}
+
+
+@pytest.fixture
+def app(tmp_path, app_config):
+    """An app on a fresh database, a SQLite file unless TEST_DATABASE_URL is set
+
+    TEST_DATABASE_URL is dropped and recreated, point it at a scratch database.
+    """
+    url = os.environ.get('TEST_DATABASE_URL', 'sqlite:///' + str(tmp_path / 'test.db'))
+    app = create_app(config={'SQLALCHEMY_DATABASE_URI': url, 'TESTING': True, **app_config})
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.remove()
+    memory_index.clear()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.get_engine(app).dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,247 @@
+import base64
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwt
+from werkzeug.exceptions import HTTPException
+
+from app import auth
+from app.auth import JWKSCache, JWKSUnavailable, TokenCache
+
+
+def b64(number):
+    data = number.to_bytes((number.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def make_key(kid):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    numbers = private_key.public_key().public_numbers()
+    jwk = {'kty': 'RSA', 'kid': kid, 'use': 'sig', 'alg': 'RS256', 'n': b64(numbers.n), 'e': b64(numbers.e)}
+    pem = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+    return jwk, pem
+
+
+class StubJWKS:
+    """A local stand-in for the Auth0 JWKS endpoint that counts its requests
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.requests = 0
+        self.failing = False
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                if stub.failing:
+                    self.send_error(502)
+                    return
+                body = json.dumps({'keys': stub.keys}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/.well-known/jwks.json'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture(scope='module')
+def keys():
+    return {kid: make_key(kid) for kid in ('first', 'rotated')}
+
+
+@pytest.fixture
+def jwks(keys):
+    with StubJWKS() as stub:
+        stub.keys = [keys['first'][0]]
+        yield stub
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('condition not met in time')
+        time.sleep(0.01)
+
+
+def test_keys_are_fetched_once_and_served_from_memory(jwks):
+    cache = JWKSCache(jwks.url, ttl=3600, min_refetch_interval=30)
+    assert cache.get('first')['kid'] == 'first'
+    assert cache.get('first')['kid'] == 'first'
+    assert jwks.requests == 1
+
+
+def test_stale_keys_are_served_while_refetched_in_the_background(jwks, keys):
+    cache = JWKSCache(jwks.url, ttl=3600, min_refetch_interval=30)
+    cache.get('first')
+    jwks.keys = [keys['rotated'][0]]
+    cache.ttl = 0
+
+    # the stale key is still served, the refetch happens off the request
+    assert cache.get('first')['kid'] == 'first'
+    wait_for(lambda: jwks.requests == 2 and not cache._refreshing)
+    assert cache.get('rotated')['kid'] == 'rotated'
+
+
+def test_unknown_kid_refetches_once_per_interval(jwks, keys):
+    cache = JWKSCache(jwks.url, ttl=3600, min_refetch_interval=30)
+    cache.get('first')
+    jwks.keys.append(keys['rotated'][0])
+
+    # within the interval an unknown kid is not refetched
+    assert cache.get('rotated') is None
+    assert jwks.requests == 1
+
+    # past it, the rotated key is picked up by a synchronous refetch
+    cache.min_refetch_interval = 0
+    time.sleep(0.01)
+    assert cache.get('rotated')['kid'] == 'rotated'
+    assert jwks.requests == 2
+    assert cache.get('unknown') is None
+    assert jwks.requests == 3
+
+
+def test_failed_first_fetch_raises_and_backs_off(jwks):
+    jwks.failing = True
+    cache = JWKSCache(jwks.url, ttl=3600, min_refetch_interval=30, retry_backoff=60)
+    with pytest.raises(JWKSUnavailable):
+        cache.get('first')
+    # nothing cached and backing off: no request reaches the IdP
+    with pytest.raises(JWKSUnavailable):
+        cache.get('first')
+    assert jwks.requests == 1
+
+    jwks.failing = False
+    cache._retry_at = 0
+    assert cache.get('first')['kid'] == 'first'
+    assert cache._backoff == 0
+
+
+def test_failed_refresh_keeps_the_cached_keys_and_backs_off(jwks, keys):
+    cache = JWKSCache(jwks.url, ttl=3600, min_refetch_interval=30, retry_backoff=60)
+    cache.get('first')
+    jwks.failing = True
+    cache.ttl = 0
+
+    assert cache.get('first')['kid'] == 'first'
+    wait_for(lambda: jwks.requests == 2 and not cache._refreshing)
+    # stale but served, and no new refresh thread per request while backing off
+    for _ in range(10):
+        assert cache.get('first')['kid'] == 'first'
+    assert jwks.requests == 2
+
+    # an unknown kid can't be checked against the IdP either
+    cache.min_refetch_interval = 0
+    with pytest.raises(JWKSUnavailable):
+        cache.get('rotated')
+    assert jwks.requests == 2
+
+
+def test_backoff_doubles_up_to_the_max(jwks):
+    jwks.failing = True
+    cache = JWKSCache(jwks.url, ttl=3600, min_refetch_interval=30, retry_backoff=1, max_retry_backoff=4)
+    backoffs = []
+    for _ in range(4):
+        cache._retry_at = 0
+        assert not cache.refresh()
+        backoffs.append(cache._backoff)
+    assert backoffs == [1, 2, 4, 4]
+
+
+def test_token_cache_drops_expired_and_least_recent_tokens():
+    cache = TokenCache(maxsize=2)
+    cache.set('expired', {'exp': time.time() - 1})
+    assert cache.get('expired') is None
+
+    cache.set('a', {'exp': time.time() + 60})
+    cache.set('b', {'exp': time.time() + 60})
+    cache.get('a')
+    cache.set('c', {'exp': time.time() + 60})
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+
+
+def test_verified_tokens_are_cached(jwks, keys, monkeypatch):
+    monkeypatch.setattr(auth, 'jwks_cache', JWKSCache(jwks.url, ttl=3600, min_refetch_interval=30))
+    monkeypatch.setattr(auth, 'token_cache', TokenCache(maxsize=8))
+    claims = {
+        'iss': f'https://{auth.AUTH0_DOMAIN}/',
+        'aud': auth.API_AUDIENCE,
+        'exp': int(time.time()) + 60,
+        'permissions': ['get:leads'],
+    }
+    token = jwt.encode(claims, keys['first'][1], algorithm='RS256', headers={'kid': 'first'})
+
+    assert auth.verify_decode_jwt(token)['permissions'] == ['get:leads']
+    assert auth.verify_decode_jwt(token) is auth.token_cache.get(token)
+    assert jwks.requests == 1
+
+    unknown = jwt.encode(claims, keys['rotated'][1], algorithm='RS256', headers={'kid': 'rotated'})
+    with pytest.raises(HTTPException) as error:
+        auth.verify_decode_jwt(unknown)
+    assert error.value.code == 400
+
+
+def test_unreachable_jwks_is_a_503(jwks, keys, monkeypatch):
+    jwks.failing = True
+    monkeypatch.setattr(auth, 'jwks_cache', JWKSCache(jwks.url, ttl=3600, min_refetch_interval=30))
+    monkeypatch.setattr(auth, 'token_cache', TokenCache(maxsize=8))
+    claims = {'iss': f'https://{auth.AUTH0_DOMAIN}/', 'aud': auth.API_AUDIENCE, 'exp': int(time.time()) + 60}
+    token = jwt.encode(claims, keys['first'][1], algorithm='RS256', headers={'kid': 'first'})
+
+    with pytest.raises(HTTPException) as error:
+        auth.verify_decode_jwt(token)
+    assert error.value.code == 503
+
+
+def test_cached_verification_overhead(jwks, keys, monkeypatch):
+    """Per request cost of verify_decode_jwt against the stub JWKS server, run with -s to see it
+    """
+    claims = {'iss': f'https://{auth.AUTH0_DOMAIN}/', 'aud': auth.API_AUDIENCE, 'exp': int(time.time()) + 60}
+    token = jwt.encode(claims, keys['first'][1], algorithm='RS256', headers={'kid': 'first'})
+    shared_keys = JWKSCache(jwks.url, ttl=3600, min_refetch_interval=30)
+    shared_tokens = TokenCache(maxsize=8)
+
+    def median_ms(make_caches, runs=50):
+        times = []
+        for _ in range(runs):
+            jwks_cache, token_cache = make_caches()
+            monkeypatch.setattr(auth, 'jwks_cache', jwks_cache)
+            monkeypatch.setattr(auth, 'token_cache', token_cache)
+            start = time.perf_counter()
+            auth.verify_decode_jwt(token)
+            times.append((time.perf_counter() - start) * 1000)
+        return statistics.median(times)
+
+    # as before the caches: fetch the JWKS and verify the signature on every request
+    uncached = median_ms(lambda: (JWKSCache(jwks.url, ttl=3600, min_refetch_interval=30), TokenCache(maxsize=8)))
+    keys_cached = median_ms(lambda: (shared_keys, TokenCache(maxsize=8)))
+    token_cached = median_ms(lambda: (shared_keys, shared_tokens))
+    print(f'\nverify_decode_jwt median: uncached {uncached:.3f} ms, '
+          f'keys cached {keys_cached:.3f} ms, token cached {token_cached:.4f} ms')
+    assert token_cached < keys_cached < uncached
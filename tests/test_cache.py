@@ -0,0 +1,81 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.cache import MemoryBackend, CacheEntry, RedisBackend, response_cache
+from app.extensions import db
+from app.synthetic_data import seed_synthetic_data
+
+
+class StubRedis:
+    """The part of redis-py's client RedisBackend uses, kept in a dict
+    """
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+
+
+def entry(body):
+    return CacheEntry([('lead', 1)], body, 'application/json')
+
+
+def test_lru_evictions_leave_the_table_index():
+    backend = MemoryBackend(max_bytes=100)
+    for i in range(1000):
+        backend.set(f'key{i}', entry(b'x' * 10), ['lead'] if i % 2 else ['lead', 'todo'])
+
+    assert len(backend) == 10
+    assert set(backend._tables_by_key) == set(backend._entries)
+    assert set().union(*backend._keys_by_table.values()) == set(backend._entries)
+
+    backend.evict_tables(['todo'])
+    assert len(backend) == 5
+    assert 'todo' not in backend._keys_by_table
+    assert set(backend._keys_by_table['lead']) == set(backend._entries)
+
+
+def test_hits_and_misses_are_counted_from_concurrent_requests(app):
+    with app.app_context():
+        seed_synthetic_data(20, todos_per_lead=1)
+        db.session.remove()
+    hits, misses = response_cache.hits, response_cache.misses
+
+    def get(i):
+        return app.test_client().get('/todos').status_code
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert set(executor.map(get, range(200))) == {200}
+    assert (response_cache.hits - hits) + (response_cache.misses - misses) == 200
+
+
+class TestRedisBackend:
+    @pytest.fixture
+    def app_config(self):
+        return {'RESPONSE_CACHE_BACKEND': 'redis', 'RESPONSE_CACHE_REDIS_CLIENT': StubRedis()}
+
+    def test_entries_are_shared_and_rejected_once_stale(self, app, client):
+        assert isinstance(response_cache.backend, RedisBackend)
+        with app.app_context():
+            seed_synthetic_data(5, todos_per_lead=0)
+            db.session.remove()
+
+        hits = response_cache.hits
+        first = client.get('/leads')
+        assert client.get('/leads').data == first.data
+        assert response_cache.hits == hits + 1
+        assert len(app.config['RESPONSE_CACHE_REDIS_CLIENT'].values) == 1
+
+        response = client.post('/leads', json={
+            'name': 'New Lead', 'funnelStepId': 1, 'city': None, 'state': None, 'email': None, 'phone': None,
+        })
+        assert response.status_code == 200
+        after_write = json.loads(client.get('/leads').data)
+        assert response_cache.hits == hits + 1
+        assert len(after_write['leads']['allIds']) == 6
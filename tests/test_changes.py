@@ -0,0 +1,140 @@
+import json
+import random
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from app.changes import CHANGE_MODELS, latest_change_seq, prune_tombstones
+from app.extensions import db
+from app.models import Lead, FunnelStep, Todo, Tombstone
+from app.synthetic_data import seed_synthetic_data
+
+from .test_funnel_stats import send
+
+
+def all_change_seqs():
+    seqs = []
+    for model in (*CHANGE_MODELS, Tombstone):
+        seqs += [seq for (seq,) in db.session.query(model.changeSeq)]
+    return seqs
+
+
+def read_feed(client, since=0):
+    """Pages through /changes from since, returns (last page, {collection: {id: row}}, {collection: deleted ids})
+    """
+    rows, deleted = {}, {}
+    while True:
+        page = client.get(f'/changes?since={since}&limit=25').get_json()
+        for identifier, deleted_ids in page['deleted'].items():
+            deleted.setdefault(identifier, set()).update(deleted_ids)
+        for identifier, collection in page.items():
+            if isinstance(collection, dict) and 'byId' in collection:
+                rows.setdefault(identifier, {}).update(collection['byId'])
+        since = page['cursor']
+        if not page['hasMore']:
+            return page, rows, deleted
+
+
+def test_writes_show_up_in_the_feed(app, client):
+    with app.app_context():
+        seed_synthetic_data(20, todos_per_lead=1, opportunities=1)
+        lead = Lead.query.order_by(Lead.id).first()
+        lead_id, step_id = lead.id, lead.funnelStepId
+        db.session.remove()
+    page, rows, _ = read_feed(client)
+    assert len(rows['leads']) == 20 and len(rows['todos']) == 20
+
+    cursor = page['cursor']
+    other_step = next(step for step in rows['funnelSteps'].values() if step['id'] != step_id)
+    response = client.patch(f'/leads/{lead_id}', data=json.dumps({'funnelStepId': other_step['id']}),
+                            content_type='application/json')
+    assert response.status_code == 200
+    with app.app_context():
+        db.session.delete(Lead.query.order_by(Lead.id.desc()).first())
+        db.session.commit()
+        assert None not in all_change_seqs()
+        db.session.remove()
+
+    page, rows, deleted = read_feed(client, cursor)
+    assert rows['leads'][str(lead_id)]['funnelStepId'] == other_step['id']
+    # both steps list the lead in or out, the deleted lead's step lost it
+    assert {step_id, other_step['id']} <= {step['id'] for step in rows['funnelSteps'].values()}
+    assert len(deleted['leads']) == 1
+    # the todo of the deleted lead lost its leadId
+    assert any(todo['leadId'] is None for todo in rows['todos'].values())
+
+
+def test_cursors_older_than_the_pruned_tombstones_are_gone(app, client):
+    with app.app_context():
+        seed_synthetic_data(20, todos_per_lead=0, opportunities=1)
+        db.session.remove()
+    old_cursor = read_feed(client)[0]['cursor']
+
+    with app.app_context():
+        for lead in Lead.query.order_by(Lead.id).limit(3):
+            db.session.delete(lead)
+        db.session.commit()
+        # two of the deletes are past the retention period
+        tombstones = Tombstone.query.order_by(Tombstone.changeSeq).all()
+        recent_id = tombstones[2].id
+        for tombstone in tombstones[:2]:
+            tombstone.deletedAt = datetime.now() - timedelta(days=60)
+        db.session.commit()
+        db.session.remove()
+    assert client.get(f'/changes?since={old_cursor}').status_code == 200
+    latest_cursor = read_feed(client, old_cursor)[0]['cursor']
+
+    with app.app_context():
+        assert prune_tombstones(datetime.now() - timedelta(days=30)) == 2
+        db.session.commit()
+        assert [tombstone.id for tombstone in Tombstone.query] == [recent_id]
+        db.session.remove()
+
+    # the cached 200 is not served again, the client has to start over
+    gone = client.get(f'/changes?since={old_cursor}')
+    assert gone.status_code == 410
+    assert 'since=0' in gone.get_json()['description']
+    # a load from since=0 takes several pages, none of them below the pruned cursors
+    page, rows, _ = read_feed(client)
+    assert sum(map(len, rows.values())) > 25
+    assert len(rows['leads']) == 17
+    assert client.get(f'/changes?since={latest_cursor}').status_code == 200
+    # nothing left to prune
+    with app.app_context():
+        assert prune_tombstones(datetime.now() - timedelta(days=30)) == 0
+
+
+def test_concurrent_writes_are_numbered_once(app):
+    with app.app_context():
+        seed_synthetic_data(30, todos_per_lead=1, opportunities=1)
+        step_ids = [step_id for (step_id,) in db.session.query(FunnelStep.id)]
+        lead_ids = [lead_id for (lead_id,) in db.session.query(Lead.id)]
+        todo_ids = [todo_id for (todo_id,) in db.session.query(Todo.id)]
+        db.session.remove()
+
+    def write(i):
+        rng = random.Random(i)
+        client = app.test_client()
+        kind = i % 4
+        if kind == 0:
+            body = {'city': 'Reno', 'state': 'NV', 'email': f'lead{i}@example.com',
+                    'funnelStepId': rng.choice(step_ids), 'name': f'lead {i}', 'phone': '555-0100'}
+            return send(client, 'POST', '/leads', json.dumps(body))
+        if kind == 1:
+            body = {'funnelStepId': rng.choice(step_ids), 'name': f'patched {i}'}
+            return send(client, 'PATCH', f'/leads/{rng.choice(lead_ids)}', json.dumps(body))
+        if kind == 2:
+            body = {'afterId': rng.choice(todo_ids)}
+            return send(client, 'PATCH', f'/todos/{rng.choice(todo_ids)}/move', json.dumps(body))
+        rows = [{'name': f'bulk {i}.{n}', 'funnelStepId': rng.choice(step_ids)} for n in range(5)]
+        return send(client, 'POST', '/leads/bulk', '\n'.join(map(json.dumps, rows)), 'application/x-ndjson')
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        statuses = set(executor.map(write, range(120)))
+    # a todo moved after itself is a 400
+    assert statuses <= {200, 400}
+
+    with app.app_context():
+        seqs = all_change_seqs()
+        assert None not in seqs
+        assert len(seqs) == len(set(seqs))
+        assert max(seqs) == latest_change_seq()
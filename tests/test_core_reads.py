@@ -0,0 +1,55 @@
+import pytest
+
+from app.core_reads import select_page, row_schema, ROW_SCHEMA_CACHE_SIZE
+from app.extensions import db
+from app.models import Lead, Opportunity, OpportunityInfo, FunnelStep, Todo
+from app.synthetic_data import seed_synthetic_data
+from app.utils import default_response, paginate, with_fields
+
+COLLECTIONS = [
+    (Opportunity, 'opportunities'),
+    (FunnelStep, 'funnelSteps'),
+    (Lead, 'leads'),
+    (OpportunityInfo, 'opportunityInfo'),
+    (Todo, 'todos'),
+]
+
+
+@pytest.fixture
+def seeded(app):
+    with app.app_context():
+        seed_synthetic_data(40, todos_per_lead=2, opportunities=2)
+        db.session.remove()
+    return app
+
+
+@pytest.mark.parametrize('model, identifier', COLLECTIONS, ids=[identifier for _, identifier in COLLECTIONS])
+@pytest.mark.parametrize('accept', ['application/json', 'application/msgpack'])
+def test_core_reads_match_the_orm_byte_for_byte(seeded, model, identifier, accept):
+    with seeded.test_request_context(headers={'Accept': accept}):
+        orm = default_response([(paginate(with_fields(model.query, None), model, 25), identifier)]).get_data()
+        db.session.remove()
+        core = default_response([(select_page(model, None, 25), identifier)]).get_data()
+    assert orm == core
+
+
+def test_sparse_fieldsets_match_the_orm(seeded):
+    fields = ['name', 'funnelStepId']
+    with seeded.test_request_context():
+        orm = default_response([(paginate(with_fields(Lead.query, fields), Lead, 25), 'leads', fields)]).get_data()
+        db.session.remove()
+        core = default_response([(select_page(Lead, fields, 25), 'leads', fields)]).get_data()
+    assert orm == core
+
+
+def test_fieldsets_are_normalized_before_they_reach_the_schema_cache(seeded):
+    client = seeded.test_client()
+    row_schema.cache_clear()
+    bodies = set()
+    for fields in ('name,funnelStepId', 'funnelStepId,name', 'name,name,funnelStepId,id', ' funnelStepId , name'):
+        response = client.get(f'/leads?fields={fields}&limit=5')
+        assert response.status_code == 200
+        bodies.add(response.get_data())
+    assert len(bodies) == 1
+    assert row_schema.cache_info().currsize == 1
+    assert row_schema.cache_info().maxsize == ROW_SCHEMA_CACHE_SIZE
@@ -0,0 +1,74 @@
+import json
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import literal, select
+
+from app.extensions import db
+from app.funnel_stats import funnel_stats_select, numeric_price, price, STAT_COLUMNS
+from app.models import Lead, FunnelStep, FunnelStepStats, OpportunityInfo, Opportunity, TableVersion
+from app.synthetic_data import seed_synthetic_data
+
+WRITES = 150
+# Strings on either side of the plain number rule of price()
+PRICES = ['12', '-3', '2.50', '-0.5', '007', '', '.', '-', '--1', '1.2.3', '1.', '.5', '-.5',
+          '1e3', ' 1', '1,000', '$10', 'abc', '\u0663']
+
+
+def send(client, method, url, body, content_type='application/json'):
+    return client.open(url, method=method, data=body, content_type=content_type).status_code
+
+
+def stored_stats():
+    rows = db.session.query(FunnelStepStats.funnelStepId, *[FunnelStepStats.__table__.c[key] for key in STAT_COLUMNS])
+    return {row[0]: tuple(row[1:]) for row in rows if any(row[1:])}
+
+
+def test_concurrent_writes_lose_no_stats_updates(app):
+    with app.app_context():
+        seed_synthetic_data(50, todos_per_lead=0, opportunities=1)
+        step_ids = [step_id for (step_id,) in db.session.query(FunnelStep.id)]
+        lead_ids = [lead_id for (lead_id,) in db.session.query(Lead.id)]
+        versions = dict(db.session.query(TableVersion.name, TableVersion.version))
+        db.session.remove()
+
+    def write(i):
+        rng = random.Random(i)
+        client = app.test_client()
+        kind = i % 3
+        if kind == 0:
+            body = {'city': 'Reno', 'state': 'NV', 'email': f'lead{i}@example.com',
+                    'funnelStepId': rng.choice(step_ids), 'name': f'lead {i}', 'phone': '555-0100'}
+            return send(client, 'POST', '/leads', json.dumps(body))
+        if kind == 1:
+            body = {'funnelStepId': rng.choice(step_ids), 'name': f'patched {i}'}
+            return send(client, 'PATCH', f'/leads/{rng.choice(lead_ids)}', json.dumps(body))
+        rows = [{'name': f'bulk {i}.{n}', 'funnelStepId': rng.choice(step_ids)} for n in range(5)]
+        return send(client, 'POST', '/leads/bulk', '\n'.join(map(json.dumps, rows)), 'application/x-ndjson')
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert set(executor.map(write, range(WRITES))) == {200}
+
+    with app.app_context():
+        expected = {row[0]: tuple(row[1:]) for row in db.session.execute(funnel_stats_select())}
+        assert stored_stats() == expected
+        assert db.session.query(Lead).count() == 50 + WRITES // 3 + 5 * (WRITES // 3)
+        # every committed write bumped the lead table's version exactly once
+        assert db.session.query(TableVersion.version).filter(TableVersion.name == 'lead').scalar() \
+            == versions.get('lead', 0) + WRITES
+
+
+def test_sql_prices_follow_the_python_rule(app):
+    with app.app_context():
+        assert [db.session.execute(select([numeric_price(literal(value))])).scalar() for value in PRICES] \
+            == [price(value) for value in PRICES]
+
+        # ORM writes (deltas) and the rebuild count the same prices
+        seed_synthetic_data(len(PRICES), todos_per_lead=0, opportunities=1)
+        opportunity_id = db.session.query(Opportunity.id).scalar()
+        lead_ids = [lead_id for (lead_id,) in db.session.query(Lead.id).order_by(Lead.id)]
+        for lead_id, value in zip(lead_ids, PRICES):
+            db.session.add(OpportunityInfo('Single', value, lead_id, 'Nurse', opportunity_id, None, '$0-50k'))
+        db.session.commit()
+        expected = {row[0]: tuple(row[1:]) for row in db.session.execute(funnel_stats_select())}
+        assert stored_stats() == expected
@@ -0,0 +1,26 @@
+import datetime
+
+import pytest
+
+from app.json_backend import make_backend
+
+pytest.importorskip('orjson')
+
+DOCUMENT = {
+    'success': True,
+    'leads': {
+        'allIds': [2, 1],
+        'byId': {
+            2: {'name': 'Zoë Müller', 'city': 'São Paulo', 'note': '見積もり ✓', 'score': 0.1},
+            1: {'name': 'Jack', 'dateCreated': datetime.datetime(2021, 3, 1, 9, 30), 'due': datetime.date(2021, 3, 2)},
+        },
+    },
+}
+
+
+@pytest.mark.parametrize('sort_keys', [False, True])
+@pytest.mark.parametrize('pretty', [False, True])
+def test_backends_write_the_same_bytes(sort_keys, pretty):
+    stdlib = make_backend('stdlib', sort_keys).dumps(DOCUMENT, pretty)
+    assert stdlib == make_backend('orjson', sort_keys).dumps(DOCUMENT, pretty)
+    assert 'Zoë Müller'.encode() in stdlib
@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+from app.extensions import db
+from app.models import Lead, FunnelStep
+from app.synthetic_data import seed_synthetic_data
+
+
+@pytest.fixture
+def step_id(app):
+    with app.app_context():
+        seed_synthetic_data(1, todos_per_lead=0)
+        step_id = FunnelStep.query.first().id
+        db.session.remove()
+    return step_id
+
+
+def lead_count(app):
+    with app.app_context():
+        count = Lead.query.count()
+        db.session.remove()
+    return count
+
+
+def post(client, body, content_type):
+    response = client.post('/leads/bulk', data=body, content_type=content_type)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_rows_of_the_wrong_type_are_reported(app, client, step_id):
+    before = lead_count(app)
+    rows = [
+        {'name': 'valid', 'funnelStepId': step_id, 'email': 'valid@example.com'},
+        {'name': 'number email', 'funnelStepId': step_id, 'email': 123},
+        {'name': ['not', 'a', 'string'], 'funnelStepId': step_id},
+        {'name': 'number phone', 'funnelStepId': step_id, 'phone': 5550100},
+    ]
+    report = post(client, '\n'.join(json.dumps(row) for row in rows), 'application/x-ndjson')
+
+    assert report['inserted'] == 1
+    assert report['errors'] == [
+        {'row': 2, 'errors': ['email must be a string.']},
+        {'row': 3, 'errors': ['name must be a string.']},
+        {'row': 4, 'errors': ['phone must be a string.']},
+    ]
+    assert lead_count(app) == before + 1
+
+
+def test_invalid_utf8_rejects_only_its_row(app, client, step_id):
+    before = lead_count(app)
+    csv_body = (
+        b'name,funnelStepId\n'
+        + f'first,{step_id}\n'.encode()
+        + b'\xff\xfe broken,' + str(step_id).encode() + b'\n'
+        + f'third,{step_id}\n'.encode()
+    )
+    report = post(client, csv_body, 'text/csv')
+    assert report['inserted'] == 2
+    assert report['errors'] == [{'row': 2, 'errors': ['Row is not valid UTF-8.']}]
+
+    ndjson_body = (
+        json.dumps({'name': 'first', 'funnelStepId': step_id}).encode() + b'\n'
+        + b'{"name": "\xc3\x28", "funnelStepId": 1}\n'
+        + json.dumps({'name': 'third', 'funnelStepId': step_id}).encode() + b'\n'
+    )
+    report = post(client, ndjson_body, 'application/x-ndjson')
+    assert report['inserted'] == 2
+    assert report['errors'] == [{'row': 2, 'errors': ['Row is not valid UTF-8.']}]
+    assert lead_count(app) == before + 4
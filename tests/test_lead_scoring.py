@@ -0,0 +1,20 @@
+from datetime import datetime
+
+from app.extensions import db
+from app.lead_scoring import load_features
+from app.models import OpportunityInfo
+from app.synthetic_data import seed_synthetic_data
+
+
+def test_empty_prices_do_not_count_as_quoted_or_final(app):
+    with app.app_context():
+        seed_synthetic_data(2, todos_per_lead=0, opportunities=1)
+        empty, filled = OpportunityInfo.query.order_by(OpportunityInfo.leadId).all()
+        empty.quotedPrice, empty.finalPrice = None, ''
+        filled.quotedPrice, filled.finalPrice = 1200.0, '1500'
+        db.session.commit()
+
+        lead_ids, features = load_features(datetime.now())
+        assert lead_ids.tolist() == [empty.leadId, filled.leadId]
+        assert features['quoted'].tolist() == [0.0, 1.0]
+        assert features['finalPrice'].tolist() == [0.0, 1.0]
@@ -0,0 +1,50 @@
+import json
+
+from app.extensions import db
+from app.models import Lead
+from app.synthetic_data import seed_synthetic_data
+
+
+def patch(client, lead_id, body):
+    return client.patch(f'/leads/{lead_id}', data=json.dumps(body), content_type='application/json')
+
+
+def test_patching_a_missing_lead_is_a_404(client):
+    assert patch(client, 12345, {'name': 'nobody'}).status_code == 404
+
+
+def test_patching_in_a_missing_funnel_step_is_a_400(app, client):
+    with app.app_context():
+        seed_synthetic_data(1, todos_per_lead=0, opportunities=1)
+        lead = Lead.query.first()
+        lead_id, step_id = lead.id, lead.funnelStepId
+        db.session.remove()
+
+    assert patch(client, lead_id, {'funnelStepId': 12345}).status_code == 400
+    with app.app_context():
+        assert Lead.query.get(lead_id).funnelStepId == step_id
+
+
+def test_adding_an_invalid_lead_is_a_400_and_writes_nothing(app, client):
+    with app.app_context():
+        seed_synthetic_data(1, todos_per_lead=0, opportunities=1)
+        step_id = Lead.query.first().funnelStepId
+        db.session.remove()
+    lead = {'city': 'Reno', 'state': 'NV', 'email': 'new@example.com',
+            'funnelStepId': step_id, 'name': 'New Lead', 'phone': '555-0100'}
+
+    def post(body):
+        return client.post('/leads', data=json.dumps(body), content_type='application/json')
+
+    missing = post({key: value for key, value in lead.items() if key != 'phone'})
+    assert missing.status_code == 400
+    assert 'phone' in missing.get_json()['description']
+    assert post({**lead, 'funnelStepId': 12345}).status_code == 400
+    assert post({**lead, 'funnelStepId': str(step_id)}).status_code == 400
+    assert post([lead]).status_code == 400
+    with app.app_context():
+        assert Lead.query.count() == 1
+
+    assert post(lead).status_code == 200
+    with app.app_context():
+        assert Lead.query.count() == 2
@@ -0,0 +1,19 @@
+from app.extensions import db
+from app.query_budgets import measure_queries, compare_query_budgets
+from app.synthetic_data import seed_synthetic_data
+
+
+def test_routes_stay_within_their_query_budgets(app):
+    with app.app_context():
+        seed_synthetic_data(10, todos_per_lead=3, seed=0)
+        db.session.remove()
+    small = measure_queries(app)
+    with app.app_context():
+        seed_synthetic_data(10000 - 10, todos_per_lead=3, seed=1)
+        db.session.remove()
+    large = measure_queries(app)
+
+    problems = [(url, budget, small_count, large_count, problem)
+                for url, budget, small_count, large_count, problem in compare_query_budgets(app, small, large)
+                if problem]
+    assert problems == []
@@ -0,0 +1,11 @@
+from app.query_plans import check_query_plans, HOT_QUERIES
+from app.synthetic_data import seed_synthetic_data
+
+
+def test_hot_queries_use_indexes(app):
+    with app.app_context():
+        seed_synthetic_data(2000, todos_per_lead=3)
+        results = check_query_plans()
+
+    assert [name for name, _, _ in results] == [name for name, _, _, _ in HOT_QUERIES]
+    assert [(name, plan) for name, plan, ok in results if not ok] == []
@@ -0,0 +1,61 @@
+import json
+
+from app.extensions import db
+from app.models import Lead
+from app.search import LeadSearchIndex, memory_index, similarity, trigrams
+from app.synthetic_data import seed_synthetic_data
+
+
+def names(client, q):
+    response = client.get(f'/leads/search?q={q}')
+    assert response.status_code == 200
+    return [lead['name'] for lead in response.get_json()['leads']['byId'].values()]
+
+
+def test_memory_index_follows_lead_changes(app, client):
+    with app.app_context():
+        seed_synthetic_data(30, todos_per_lead=0, opportunities=1)
+        first, last = Lead.query.order_by(Lead.id).first(), Lead.query.order_by(Lead.id.desc()).first()
+        first_id, last_id, last_name = first.id, last.id, last.name
+        db.session.remove()
+    names(client, 'a')
+    seq = memory_index.seq
+
+    response = client.patch(f'/leads/{first_id}', data=json.dumps({'name': 'Zebulon Quixote'}),
+                            content_type='application/json')
+    assert response.status_code == 200
+    assert names(client, 'zebulon') == ['Zebulon Quixote']
+    assert memory_index.seq > seq
+
+    with app.app_context():
+        db.session.delete(Lead.query.get(last_id))
+        db.session.commit()
+        assert last_name not in names(client, last_name.split()[0].lower())
+
+        # the updated index holds what a fresh one reads
+        fresh = LeadSearchIndex()
+        fresh.update(None)
+        assert fresh.documents == memory_index.documents
+        assert fresh.postings == memory_index.postings
+
+
+def test_similarity_matches_pg_trgm():
+    # SELECT similarity('word', 'words') is 0.571429 in Postgres
+    assert round(similarity(trigrams('word'), trigrams('words')), 6) == 0.571429
+    assert similarity(trigrams('jack'), trigrams('janice perez')) < 0.3
+
+
+def test_fields_are_matched_on_their_own_trigrams(app, client):
+    with app.app_context():
+        for name, email, city in [('Jack Smith', 'js@example.com', 'Reno'),
+                                  ('Janice Perez', 'jp@example.com', 'Ames'),
+                                  ('Maria Jackson', 'mj@example.com', 'Boise')]:
+            db.session.add(Lead(city=city, state='ID', chanceToConvert=0.15, dateCreated=None, email=email,
+                                funnelStepId=None, lastContact=None, name=name, phone=None, status='Follow Up'))
+        db.session.commit()
+        db.session.remove()
+
+    # 'maria jackson' shares 4 of 15 trigrams with 'jack', under the threshold as in Postgres
+    assert names(client, 'jack') == ['Jack Smith']
+    assert names(client, 'boise') == ['Maria Jackson']
+    assert names(client, 'id') == ['Jack Smith', 'Janice Perez', 'Maria Jackson']
@@ -0,0 +1,44 @@
+import json
+
+import pytest
+
+from app.extensions import db
+from app.models import Lead
+from app.synthetic_data import seed_synthetic_data
+
+LEADS = 30
+
+
+@pytest.fixture
+def app_config():
+    # several batches per collection
+    return {'STREAM_BATCH_SIZE': 7}
+
+
+@pytest.fixture
+def seeded(app):
+    with app.app_context():
+        seed_synthetic_data(LEADS, todos_per_lead=0, opportunities=1)
+        db.session.remove()
+
+
+def test_streamed_ids_match_the_streamed_rows(seeded, app, client):
+    response = client.get('/leads?stream=1')
+    assert response.status_code == 200
+    assert 'Accept' in response.headers['Vary']
+    leads = json.loads(response.data)['leads']
+    assert leads['allIds'] == sorted(int(lead_id) for lead_id in leads['byId'])
+    with app.app_context():
+        assert leads['allIds'] == [lead_id for (lead_id,) in db.session.query(Lead.id).order_by(Lead.id)]
+
+
+def test_streams_are_json_only(seeded, client):
+    msgpack_only = client.get('/leads?stream=1', headers={'Accept': 'application/msgpack'})
+    assert msgpack_only.status_code == 406
+    assert msgpack_only.get_json()['code'] == 406
+
+    # JSON is still acceptable, so it is what the client gets
+    fallback = client.get('/leads?stream=1', headers={'Accept': 'application/msgpack, application/json;q=0.5'})
+    assert fallback.status_code == 200
+    assert fallback.mimetype == 'application/json'
+    assert len(json.loads(fallback.data)['leads']['allIds']) == LEADS
@@ -0,0 +1,15 @@
+from app.models import OpportunityInfo, FunnelStep, Lead
+from app.synthetic_data import seed_synthetic_data, FUNNEL_STEP_NAMES
+
+
+def test_every_opportunity_has_final_prices_on_its_last_step(app):
+    with app.app_context():
+        seed_synthetic_data(500, todos_per_lead=0, opportunities=4)
+        rows = OpportunityInfo.query \
+            .join(Lead, Lead.id == OpportunityInfo.leadId) \
+            .join(FunnelStep, FunnelStep.id == Lead.funnelStepId) \
+            .with_entities(OpportunityInfo.opportunityId, FunnelStep.name, OpportunityInfo.finalPrice).all()
+
+    final_opportunities = {opportunity_id for opportunity_id, _, final in rows if final is not None}
+    assert final_opportunities == {opportunity_id for opportunity_id, _, _ in rows}
+    assert {name for _, name, final in rows if final is not None} == {FUNNEL_STEP_NAMES[-1]}
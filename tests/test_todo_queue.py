@@ -0,0 +1,24 @@
+from app.extensions import db
+from app.models import Todo
+from app.synthetic_data import seed_synthetic_data
+from app.todo_queue import RANK_GAP, rebalance_ranks
+
+
+def test_rebalancing_rewrites_only_the_todos_whose_rank_changes(app):
+    with app.app_context():
+        seed_synthetic_data(2, todos_per_lead=3, opportunities=1)
+        todos = Todo.query.order_by(Todo.priorityRank, Todo.id).all()
+        assert [todo.priorityRank for todo in todos] == [RANK_GAP * (i + 1) for i in range(len(todos))]
+
+        # squeeze the third todo right behind the second one
+        todos[2].priorityRank = todos[1].priorityRank + 1
+        db.session.commit()
+        seqs = dict(db.session.query(Todo.id, Todo.changeSeq))
+
+        rebalance_ranks()
+        db.session.commit()
+        after = dict(db.session.query(Todo.id, Todo.changeSeq))
+        changed = {todo_id for todo_id in seqs if after[todo_id] != seqs[todo_id]}
+        assert changed == {todos[2].id}
+        assert [rank for (rank,) in db.session.query(Todo.priorityRank).order_by(Todo.priorityRank)] \
+            == [RANK_GAP * (i + 1) for i in range(len(todos))]